@@ -53,6 +53,5 @@ setup(
         "filelock>=3.0.12,<4",
         "implements>=0.2.0,<1",
         "pynacl>=1.4.0,<2",
-        "python_dynamodb_lock>=0.9.1,<1",
     ],
 )
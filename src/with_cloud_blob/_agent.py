@@ -0,0 +1,482 @@
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import json
+import os
+import pathlib
+import socket
+import socketserver
+import struct
+import threading
+import time
+import typing as tp
+
+import click
+
+from . import _modify
+from . import backend_intf
+from . import backends
+from ._cache import cache_dir
+from ._log import logger
+
+# (backend name, locator, options)
+AgentLoc = tp.Tuple[str, str, tp.Mapping[str, str]]
+
+# messages are a JSON header prefixed with its length, followed by raw data of sizes listed in the header
+_LENGTH = struct.Struct(">I")
+_MAX_HEADER_SIZE = 64 * 1024 * 1024
+_MAX_LOAD_WORKERS = 16
+# clients give up on an agent silent for this long, which sends keepalives to waiting ones more often
+_TIMEOUT = 60.0
+_KEEPALIVE_PERIOD = _TIMEOUT / 4
+
+
+def socket_path() -> pathlib.Path:
+    env = os.environ.get("WITH_CLOUD_BLOB_AGENT_SOCKET")
+    return pathlib.Path(env) if env else cache_dir() / "agent.sock"
+
+
+def _credentials_env() -> str:
+    """
+    Return digest of environment variables which may select credentials or configuration of backends.
+    """
+    items = sorted((k, v) for k, v in os.environ.items() if k.startswith("AWS_") or k == "HOME")
+    return hashlib.sha256(json.dumps(items).encode()).hexdigest()
+
+
+def _connect(path: pathlib.Path, request: tp.Any) -> tp.Tuple[socket.socket, tp.Any]:
+    """
+    Send request to the agent at path and return the socket along with the first response,
+    raising ConnectionRefusedError if the agent refuses to serve the request.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        sock.settimeout(_TIMEOUT)
+        sock.connect(str(path))
+        _send_message(sock, dict(request, env=_credentials_env()))
+        header = _recv_header(sock)
+
+        if "refused" in header:
+            raise ConnectionRefusedError(header["refused"])
+    except BaseException:
+        sock.close()
+        raise
+
+    return sock, header
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+
+    while size:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("connection closed by peer")
+
+        chunks.append(chunk)
+        size -= len(chunk)
+
+    return b"".join(chunks)
+
+
+def _send_message(sock: socket.socket, header: tp.Any, data: tp.Sequence[bytes] = ()) -> None:
+    raw_header = json.dumps(header).encode()
+    sock.sendall(_LENGTH.pack(len(raw_header)) + raw_header)
+
+    for i in data:
+        sock.sendall(i)
+
+
+def _recv_header(sock: socket.socket) -> tp.Any:
+    size, = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+    if size > _MAX_HEADER_SIZE:
+        raise ConnectionError(f"message header of {size} bytes is too large")
+
+    return json.loads(_recv_exactly(sock, size))
+
+
+def load(
+    locs: tp.Sequence[AgentLoc],
+    *,
+    consistent: bool,
+) -> tp.Optional[tp.List[tp.Union[bytes, backend_intf.BackendError]]]:
+    """
+    Load blobs through the agent, if it is running, as storage backends' load() or load_consistent() would.
+    Return None if the agent is not available.
+    """
+    path = socket_path()
+    if not path.exists():
+        return None
+
+    try:
+        sock, header = _connect(path, {"op": "load", "consistent": consistent, "locs": [list(i) for i in locs]})
+
+        with sock:
+            return [
+                backend_intf.BackendError(i["error"]) if "error" in i else _recv_exactly(sock, i["size"])
+                for i in header["results"]
+            ]
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.debug(f"agent at {path} is not available: {e}")
+        return None
+
+
+def _apply(sock: socket.socket, header: tp.Any, modifier: backend_intf.StorageModifier) -> None:
+    data = None if header["size"] is None else _recv_exactly(sock, header["size"])
+
+    try:
+        new_data = modifier(data)
+    except BaseException as e:
+        with contextlib.suppress(OSError):
+            _send_message(sock, {"error": str(e) or type(e).__name__})
+        raise
+
+    if new_data is None:
+        _send_message(sock, {"size": None})
+    else:
+        _send_message(sock, {"size": len(new_data)}, [new_data])
+
+
+def modify(
+    storage: AgentLoc,
+    locks: tp.Sequence[AgentLoc],
+    modifier: backend_intf.StorageModifier,
+    *,
+    first_timeout: float,
+    timeout_step: float,
+) -> bool:
+    """
+    Have modifier applied by the agent, if it is running, in a group commit, i.e. in order with other
+    modifications of the same blob under the same locks queued meanwhile, followed by a single upload.
+    Return False if the agent is not available, in which case modifier has not been called.
+    """
+    path = socket_path()
+    if not path.exists():
+        return False
+
+    try:
+        sock, header = _connect(path, {
+            "op": "modify",
+            "storage": list(storage),
+            "locks": [list(i) for i in locks],
+            "first_timeout": first_timeout,
+            "timeout_step": timeout_step,
+        })
+    except (OSError, ValueError) as e:
+        logger.debug(f"agent at {path} is not available: {e}")
+        return False
+
+    with sock:
+        try:
+            while header.get("op") in ("apply", "waiting"):
+                if header["op"] == "apply":
+                    _apply(sock, header, modifier)
+
+                header = _recv_header(sock)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # whether the modification has been committed is unknown
+            raise backend_intf.BackendError(f"lost agent at {path}: {e}")
+
+    if "error" in header:
+        raise backend_intf.BackendError(header["error"])
+
+    return True
+
+
+class _PendingModify:
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.done = threading.Event()
+        # modifier failed on the client, which is not waiting for the result any more
+        self.failed = False
+        # keepalives are sent by another thread
+        self._send_lock = threading.Lock()
+
+    def send(self, header: tp.Any, data: tp.Sequence[bytes] = ()) -> None:
+        with self._send_lock:
+            _send_message(self.sock, header, data)
+
+    def keep_alive(self) -> None:
+        while not self.done.wait(_KEEPALIVE_PERIOD):
+            try:
+                self.send({"op": "waiting"})
+            except OSError:
+                return
+
+
+def _cache_key(loc: AgentLoc) -> str:
+    return json.dumps([loc[0], loc[1], sorted(loc[2].items())])
+
+
+class Agent:
+    """
+    Blob loads served by a long-running process, with backends' sessions and connections kept open,
+    and loaded blobs, as stored, kept in memory for non-consistent loads within max_age seconds.
+    """
+
+    def __init__(self, *, max_age: float, cache_size: int) -> None:
+        self._max_age = max_age
+        self._cache_size = cache_size
+        # (loaded at, data) by key of locator, in order of use
+        self._cache: "collections.OrderedDict[str, tp.Tuple[float, bytes]]" = collections.OrderedDict()
+        self._cached_size = 0
+        self._lock = threading.Lock()
+        self._env = _credentials_env()
+        # modifications waiting for the running group commit, by key of blob and locks
+        self._modify_queues: tp.Dict[str, tp.List[_PendingModify]] = {}
+        self._server: tp.Optional[socketserver.ThreadingUnixStreamServer] = None
+        # sessions are pooled per thread, so loads are done by long-lived threads
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=_MAX_LOAD_WORKERS)
+
+        # imported here, so that clients do not pay for importing boto3
+        from .backends import _boto_helpers
+        _boto_helpers.enable_pooling()
+
+    def _get_cached(self, key: str) -> tp.Optional[bytes]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or time.monotonic() - entry[0] >= self._max_age:
+                return None
+
+            self._cache.move_to_end(key)
+            return entry[1]
+
+    def _put_cached(self, key: str, data: bytes) -> None:
+        if len(data) > self._cache_size:
+            return
+
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._cached_size -= len(old[1])
+
+            self._cache[key] = time.monotonic(), data
+            self._cached_size += len(data)
+
+            while self._cached_size > self._cache_size:
+                _, (_, evicted) = self._cache.popitem(last=False)
+                self._cached_size -= len(evicted)
+
+    def _discard_cached(self, key: str) -> None:
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._cached_size -= len(old[1])
+
+    def _load_one(self, loc: AgentLoc) -> tp.Union[bytes, backend_intf.BackendError]:
+        backend_name, backend_loc, opts = loc
+
+        try:
+            return backends.storage_backend(backend_name).load(loc=backend_loc, opts=backend_intf.Options(opts))
+        except backend_intf.BackendError as e:
+            return e
+
+    def _load_consistent(
+        self,
+        backend_name: str,
+        locs: tp.Sequence[AgentLoc],
+    ) -> tp.List[tp.Union[bytes, backend_intf.BackendError]]:
+        try:
+            backend = backends.storage_backend(backend_name)
+        except backend_intf.BackendError as e:
+            return [e] * len(locs)
+
+        return backend.load_consistent(locs=[(i[1], backend_intf.Options(i[2])) for i in locs])
+
+    def load(
+        self,
+        locs: tp.Sequence[AgentLoc],
+        *,
+        consistent: bool,
+    ) -> tp.List[tp.Union[bytes, backend_intf.BackendError]]:
+        keys = [_cache_key(i) for i in locs]
+        result: tp.List[tp.Union[None, bytes, backend_intf.BackendError]] = [None] * len(locs)
+        loaded: tp.List[int] = []
+
+        if consistent:
+            by_backend: tp.Dict[str, tp.List[int]] = {}
+            for i, loc in enumerate(locs):
+                by_backend.setdefault(loc[0], []).append(i)
+
+            futures = {
+                self._executor.submit(self._load_consistent, backend_name, [locs[i] for i in indexes]): indexes
+                for backend_name, indexes in by_backend.items()
+            }
+
+            for batch, indexes in futures.items():
+                for i, batch_result in zip(indexes, batch.result()):
+                    result[i] = batch_result
+                    loaded.append(i)
+        else:
+            pending = {}
+
+            for i, key in enumerate(keys):
+                result[i] = self._get_cached(key)
+                if result[i] is None:
+                    pending[i] = self._executor.submit(self._load_one, locs[i])
+
+            for i, future in pending.items():
+                result[i] = future.result()
+                loaded.append(i)
+
+        for i in loaded:
+            loaded_result = result[i]
+            if isinstance(loaded_result, bytes):
+                self._put_cached(keys[i], loaded_result)
+
+        return tp.cast(tp.List[tp.Union[bytes, backend_intf.BackendError]], result)
+
+    def _commit(self, batch: tp.List[_PendingModify], request: tp.Any) -> tp.Optional[str]:
+        """
+        Apply modifications of batch in order to a single copy of the blob, and upload it once.
+        Return error, which applies to all modifications not failed on their own.
+        """
+        def locator(loc: tp.Any) -> _modify.Locator:
+            return _modify.Locator(backend=str(loc[0]), loc=str(loc[1]), opts=backend_intf.Options(loc[2]))
+
+        def modifier(data: tp.Optional[bytes]) -> tp.Optional[bytes]:
+            for pending in batch:
+                try:
+                    pending.send(
+                        {"op": "apply", "size": None if data is None else len(data)},
+                        [data or b""],
+                    )
+                    header = _recv_header(pending.sock)
+                    if "error" in header:
+                        raise ValueError(header["error"])
+
+                    data = None if header["size"] is None else _recv_exactly(pending.sock, header["size"])
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    # the blob is kept as left by preceding modifications
+                    logger.info(f"modification in group commit failed: {e}")
+                    pending.failed = True
+
+            return data
+
+        try:
+            _modify.modify_with_locks(
+                storage=locator(request["storage"]),
+                locks=[locator(i) for i in request["locks"]],
+                modifier=modifier,
+                first_timeout=float(request["first_timeout"]),
+                timeout_step=float(request["timeout_step"]),
+            )
+        except click.ClickException as e:
+            return e.message
+        except Exception as e:
+            logger.warning(f"group commit failed: {e}")
+            return str(e)
+        finally:
+            # even a failed commit may have replaced the blob, so it is loaded anew by the next read
+            self._discard_cached(_cache_key(request["storage"]))
+
+        return None
+
+    def modify(self, pending: _PendingModify, request: tp.Any) -> None:
+        """
+        Queue modification, and, unless a group commit of the same blob is already running, run it,
+        along with subsequent ones, until the queue is empty.
+        """
+        key = json.dumps([request["storage"], request["locks"]], sort_keys=True)
+        threading.Thread(target=pending.keep_alive, daemon=True).start()
+
+        with self._lock:
+            queue = self._modify_queues.get(key)
+            leader = queue is None
+            self._modify_queues.setdefault(key, []).append(pending)
+
+        if not leader:
+            pending.done.wait()
+            return
+
+        while True:
+            with self._lock:
+                batch = self._modify_queues[key]
+                if not batch:
+                    del self._modify_queues[key]
+                    return
+
+                self._modify_queues[key] = []
+
+            logger.debug(lambda: f"group commit of {len(batch)} modifications")
+            error = self._commit(batch, request)
+
+            for i in batch:
+                if not i.failed:
+                    with contextlib.suppress(OSError):
+                        i.send({"error": error} if error is not None else {"committed": True})
+
+                i.done.set()
+
+    def serve(self, path: pathlib.Path) -> None:
+        """
+        Serve requests on Unix socket at path, accessible to the current user only, until interrupted
+        or shut down.
+        """
+        agent = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self) -> None:
+                try:
+                    request = _recv_header(self.request)
+                    if request.get("env") != agent._env:
+                        # e.g. another AWS profile or credentials, which must not be substituted by agent's own
+                        _send_message(self.request, {"refused": "environment differs from that of the agent"})
+                        return
+
+                    if request.get("op") == "modify":
+                        agent.modify(_PendingModify(self.request), request)
+                        return
+
+                    if request.get("op") != "load":
+                        raise ValueError(f"unknown request: {request.get('op')}")
+
+                    locs = [
+                        (str(i[0]), str(i[1]), {str(k): str(v) for k, v in i[2].items()})
+                        for i in request["locs"]
+                    ]
+                    result = agent.load(locs, consistent=bool(request.get("consistent")))
+                except (OSError, ValueError, KeyError, TypeError, AttributeError, IndexError) as e:
+                    logger.warning(f"bad agent request: {e}")
+                    return
+
+                _send_message(
+                    self.request,
+                    {"results": [{"size": len(i)} if isinstance(i, bytes) else {"error": str(i)} for i in result]},
+                    [i for i in result if isinstance(i, bytes)],
+                )
+
+        if path.exists():
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                try:
+                    sock.connect(str(path))
+                    raise backend_intf.BackendError(f"agent is already running at {path}")
+                except ConnectionRefusedError:
+                    # left over by an agent which has not exited cleanly
+                    path.unlink()
+
+        old_umask = os.umask(0o177)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(str(path), Handler)
+        finally:
+            os.umask(old_umask)
+
+        server.daemon_threads = True
+        self._server = server
+
+        try:
+            logger.info(lambda: f"agent is listening at {path}")
+            server.serve_forever()
+        finally:
+            server.server_close()
+            path.unlink()
+            self._executor.shutdown(wait=False)
+
+    def shutdown(self) -> None:
+        """
+        Make serve() return, may be called from another thread only.
+        """
+        if self._server is not None:
+            self._server.shutdown()
@@ -0,0 +1,219 @@
+import hashlib
+import os
+import pathlib
+import typing as tp
+
+import atomicwrites
+import filelock
+
+
+def cache_dir() -> pathlib.Path:
+    """
+    Per-user directory for state persisted between invocations. Raise OSError if it cannot be created.
+    """
+    env = os.environ.get("WITH_CLOUD_BLOB_CACHE_DIR")
+    if env:
+        result = pathlib.Path(env)
+    else:
+        xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+
+        if xdg_cache_home:
+            result = pathlib.Path(xdg_cache_home)
+        else:
+            try:
+                result = pathlib.Path.home() / ".cache"
+            except (KeyError, RuntimeError) as e:
+                # no HOME, nor a passwd entry, e.g. in a container
+                raise OSError(f"cannot determine home directory: {e}")
+
+        result = result / "with-cloud-blob"
+
+    result.mkdir(parents=True, exist_ok=True)
+    return result
+
+
+# entries are named after sha256 hexdigest of their keys
+_ENTRY_NAME_LENGTH = 64
+_SIDECAR_SUFFIXES = (".validated", ".lock")
+# holds total size of entries, as tracked by put() and discard()
+_SIZE_FILE = "total.size"
+
+
+def _unlink(path: str) -> bool:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        return False
+
+    return True
+
+
+def _file_size(path: str) -> tp.Optional[int]:
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return None
+
+
+class BlobCache:
+    """
+    Size bounded LRU cache of blobs contents along with their versions (e.g. ETags), shared by all invocations.
+
+    Each entry is a single file, written atomically, with the version on the first line.
+    Entries are evicted in order of their mtime, which is updated on every hit.
+    Time of the last check of an entry against its origin is kept as mtime of a ".validated" sidecar file.
+    Total size of entries is tracked in a file, so that the directory is only scanned once it exceeds the limit.
+    """
+
+    def __init__(self, *, size_limit: int) -> None:
+        self._path = cache_dir() / "blobs"
+        self._path.mkdir(mode=0o700, exist_ok=True)
+        self._size_limit = size_limit
+
+    def _entry_path(self, key: str, suffix: str = "") -> pathlib.Path:
+        return self._path / (hashlib.sha256(key.encode()).hexdigest() + suffix)
+
+    def lock(self, key: str, *, timeout: float) -> tp.ContextManager[tp.Any]:
+        """
+        Return a lock to be held by a single process fetching key from its origin, while others wait for it.
+        Entering it raises filelock.Timeout if the lock is not acquired within timeout seconds.
+        """
+        return filelock.FileLock(str(self._entry_path(key, ".lock")), timeout=timeout)
+
+    def validated_at(self, key: str) -> float:
+        """
+        Return time of the last put() or mark_validated() of key, or 0 if unknown.
+        """
+        try:
+            return self._entry_path(key, ".validated").stat().st_mtime
+        except FileNotFoundError:
+            return 0
+
+    def mark_validated(self, key: str) -> None:
+        self._entry_path(key, ".validated").touch()
+
+    def get(self, key: str) -> tp.Optional[tp.Tuple[str, bytes]]:
+        """
+        Return (version, data) cached for key, if any.
+        """
+        path = self._entry_path(key)
+
+        try:
+            with path.open("rb") as f:
+                version = f.readline().rstrip(b"\n").decode()
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        return version, data
+
+    def put(self, key: str, version: str, data: bytes) -> None:
+        if len(data) > self._size_limit:
+            self.discard(key)
+            return
+
+        path = self._entry_path(key)
+        old_size = _file_size(str(path)) or 0
+
+        with atomicwrites.atomic_write(str(path), overwrite=True, mode="wb") as f:
+            f.write(version.encode() + b"\n")
+            f.write(data)
+
+        self.mark_validated(key)
+        self._add_size(path.stat().st_size - old_size)
+
+    def discard(self, key: str) -> None:
+        size = self._remove(str(self._entry_path(key)), if_unlocked=False)
+
+        if size is not None:
+            self._add_size(-size)
+
+    def _remove(self, path: str, *, if_unlocked: bool) -> tp.Optional[int]:
+        """
+        Remove entry at path along with its sidecar files, returning its size if it existed.
+        Lock file is kept while held by a concurrent fetch, and so is the whole entry if if_unlocked.
+        """
+        lock = filelock.FileLock(path + ".lock", timeout=0)
+
+        try:
+            lock.acquire()
+            locked = True
+        except filelock.Timeout:
+            if if_unlocked:
+                return None
+
+            locked = False
+
+        try:
+            size = _file_size(path)
+            if not _unlink(path):
+                size = None
+
+            _unlink(path + ".validated")
+
+            if locked:
+                # removed while held, so that a process already waiting for it may only fetch needlessly
+                _unlink(path + ".lock")
+        finally:
+            if locked:
+                lock.release()
+
+        return size
+
+    def _add_size(self, delta: int) -> None:
+        """
+        Account for entries growing by delta bytes, evicting them if over the limit.
+        Tracked size may drift due to concurrent puts of the same key, which is corrected by eviction.
+        """
+        path = self._path / _SIZE_FILE
+
+        with filelock.FileLock(str(path) + ".lock"):
+            try:
+                size: tp.Optional[int] = int(path.read_text()) + delta
+            except (FileNotFoundError, ValueError):
+                size = None
+
+            if size is None or size > self._size_limit:
+                size = self._evict()
+
+            with atomicwrites.atomic_write(str(path), overwrite=True) as f:
+                f.write(str(size))
+
+    def _evict(self) -> int:
+        """
+        Evict least recently used entries until within the limit, returning their remaining total size.
+        """
+        entries = []
+        sidecars = []
+        total_size = 0
+
+        with os.scandir(self._path) as it:
+            for i in it:
+                if len(i.name) != _ENTRY_NAME_LENGTH:
+                    if i.name[_ENTRY_NAME_LENGTH:] in _SIDECAR_SUFFIXES:
+                        sidecars.append(os.path.join(self._path, i.name[:_ENTRY_NAME_LENGTH]))
+
+                    # size and temporary files are not accounted for
+                    continue
+
+                try:
+                    st = i.stat()
+                except FileNotFoundError:
+                    continue
+
+                entries.append((st.st_mtime, st.st_size, i.path))
+                total_size += st.st_size
+
+        for mtime, size, path in sorted(entries):
+            if total_size <= self._size_limit:
+                break
+
+            if self._remove(path, if_unlocked=True) is not None:
+                total_size -= size
+
+        # left behind by discard() while locked, or by fetches of blobs which were not cached
+        for path in set(sidecars).difference(i[2] for i in entries):
+            self._remove(path, if_unlocked=True)
+
+        return total_size
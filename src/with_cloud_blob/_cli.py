@@ -1,10 +1,19 @@
+import base64
+import concurrent.futures
 import contextlib
 import functools
+import hashlib
+import json
+import os
 import pathlib
+import random
+import shutil
+import signal
 import subprocess
 import sys
+import tarfile
 import tempfile
-import time
+import threading
 import typing as tp
 from dataclasses import dataclass
 
@@ -12,25 +21,92 @@ import click
 import click_log
 import nacl.encoding
 
+from . import _agent
 from . import _crypto
+from . import _modify
 from . import backend_intf
 from . import backends
+from ._cache import cache_dir
 from ._log import logger
+from ._modify import LOCK_OPTIONS
+from ._modify import Locator
+from ._modify import acquire_lock
+from ._modify import short_locator_descr
 
 # TODO extrypoints conditional on extras
 # TODO proper errors on str to int/float casts
 # TODO test: time before lock timeout exception is approximately equal to requested timeout
 
+MAX_LOAD_WORKERS = 16
+# relative random deviation of read --watch polling intervals
+WATCH_JITTER = 0.2
+# maximum ratio of read --watch polling interval after failures to the requested one
+WATCH_MAX_BACKOFF = 16
 
-def tempdir() -> tp.ContextManager[str]:
-    return tempfile.TemporaryDirectory(prefix="with-cloud-blob-")
 
+class Workspace:
+    """
+    Temp directory for files passed to commands, within root directory, if given, or a persistent into directory.
+    Keeps count of bytes written into it, which is reported on exit.
+    """
 
-@dataclass
-class Locator:
-    backend: str
-    opts: backend_intf.Options
-    loc: str
+    def __init__(self, root: tp.Optional[str] = None, *, into: tp.Optional[str] = None) -> None:
+        self._root = root
+        self._td: tp.Optional["tempfile.TemporaryDirectory[str]"] = None
+        self._state_td: tp.Optional["tempfile.TemporaryDirectory[str]"] = None
+
+        try:
+            if into is None:
+                self._td = tempfile.TemporaryDirectory(prefix="with-cloud-blob-", dir=root)
+                self.path = pathlib.Path(self._td.name)
+            else:
+                self.path = pathlib.Path(into)
+                self.path.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            raise click.ClickException(f"creating workspace: {e}")
+
+        self.bytes_written = 0
+
+    def reserve(self, size: int) -> None:
+        """
+        Check that size bytes about to be written fit into the workspace, and count them.
+        """
+        free = shutil.disk_usage(self.path).free
+        if size > free:
+            raise click.ClickException(f"{size} bytes do not fit into workspace {self.path} with {free} bytes free")
+
+        self.bytes_written += size
+
+    def sync_state_path(self, rel: str) -> pathlib.Path:
+        """
+        Return path of the state of syncing into rel path within workspace, which is kept outside of it,
+        so that commands do not see it. State of a persistent into directory is kept in the cache directory.
+        """
+        try:
+            if self._td is None:
+                state_dir = cache_dir() / "sync"
+                state_dir.mkdir(parents=True, exist_ok=True)
+            else:
+                if self._state_td is None:
+                    self._state_td = tempfile.TemporaryDirectory(prefix="with-cloud-blob-state-", dir=self._root)
+
+                state_dir = pathlib.Path(self._state_td.name)
+        except OSError as e:
+            raise click.ClickException(f"creating sync state directory: {e}")
+
+        return state_dir / hashlib.sha256(str(self.path.resolve() / rel).encode()).hexdigest()
+
+    def __enter__(self) -> "Workspace":
+        return self
+
+    def __exit__(self, *a: tp.Any) -> None:
+        logger.debug(lambda: f"{self.bytes_written} bytes written to workspace {self.path}")
+
+        if self._td is not None:
+            self._td.cleanup()
+
+        if self._state_td is not None:
+            self._state_td.cleanup()
 
 
 def parse_locator(s: str) -> Locator:
@@ -58,14 +134,6 @@ def parse_locator(s: str) -> Locator:
     )
 
 
-def short_locator_descr(loc: Locator) -> str:
-    for delim in ":~!@#$%^&*()_-+=[{}]\\|;'\"<>,.?/":
-        if delim not in loc.backend and delim not in loc.loc:
-            return f"{delim}{loc.backend}{delim}{loc.loc}"
-
-    return f"{loc.backend} {loc.loc}"
-
-
 @dataclass
 class ReaderKey:
     key_id: int
@@ -88,61 +156,160 @@ def modify_blob_with_locks(
     *,
     storage: Locator,
     locks: tp.Iterable[Locator],
-    modifier: backend_intf.StorageModifier,
+    modifier: tp.Union[backend_intf.StorageModifier, backend_intf.StorageFileModifier],
     first_timeout: float,
     timeout_step: float,
+    shared: bool = False,
+    prefetch: bool = False,
+    path: tp.Optional[pathlib.Path] = None,
+    group_commit: bool = False,
 ) -> None:
-    try:
-        storage_backend = backends.storage_backend(storage.backend)
-        lock_backends = [backends.lock_backend(lock.backend) for lock in locks]
-    except backend_intf.BackendError as e:
-        raise click.ClickException(str(e))
+    """
+    Same as _modify.modify_with_locks(), but with group_commit=True modification is made by the agent,
+    if it is running.
+    """
+    if group_commit and group_commit_with_agent(
+        storage=storage,
+        locks=locks,
+        modifier=modifier,
+        first_timeout=first_timeout,
+        timeout_step=timeout_step,
+        path=path,
+    ):
+        return
+
+    _modify.modify_with_locks(
+        storage=storage,
+        locks=locks,
+        modifier=modifier,
+        first_timeout=first_timeout,
+        timeout_step=timeout_step,
+        shared=shared,
+        prefetch=prefetch,
+        path=path,
+    )
 
-    with contextlib.ExitStack() as es:
-        for lock_backend, lock in zip(lock_backends, locks):
-            loc_prefix = lock.opts.get("prefix") or ""
-            total_timeout = float(lock.opts.get("timeout") or "0")
-            deadline = time.time() + total_timeout
 
-            lock.loc = loc_prefix + (lock.loc or storage.loc)
-            lock_descr = short_locator_descr(lock)
+def agent_loc(loc: Locator) -> _agent.AgentLoc:
+    """
+    Return locator as passed to the agent, which has its own current directory.
+    """
+    if loc.backend == "file" and loc.loc:
+        return loc.backend, os.path.abspath(loc.loc), loc.opts.as_dict()
 
-            attempt = 0
+    return loc.backend, loc.loc, loc.opts.as_dict()
 
-            while True:
-                remaining = deadline - time.time()
 
-                if attempt > 0 and remaining < 0:
-                    raise click.ClickException(f"timed out waiting for {lock_descr}")
-                else:
-                    try:
-                        if attempt > 0:
-                            logger.info(lambda: f"waiting for lock {lock_descr}, deadline in {remaining:1.0f}s")
-
-                        attempt += 1
-
-                        es.enter_context(
-                            lock_backend.make_lock(
-                                loc=lock.loc,
-                                opts=lock.opts,
-                                timeout=max(0, min(remaining, timeout_step if attempt > 1 else first_timeout)),
-                            ),
-                        )
-                    except backend_intf.TimeoutError:
-                        continue
-                    except backend_intf.BackendError as e:
-                        raise click.ClickException(f"{lock_descr}: {e}")
+def agent_lock_loc(lock: Locator, storage: Locator) -> _agent.AgentLoc:
+    """
+    Return lock locator as passed to the agent, with its prefix and default location applied.
+    """
+    opts = lock.opts.as_dict()
+    prefix = opts.pop("prefix", "")
+    return agent_loc(
+        Locator(backend=lock.backend, opts=backend_intf.Options(opts), loc=prefix + (lock.loc or storage.loc)),
+    )
 
-                break
 
+def group_commit_with_agent(
+    *,
+    storage: Locator,
+    locks: tp.Iterable[Locator],
+    modifier: tp.Union[backend_intf.StorageModifier, backend_intf.StorageFileModifier],
+    first_timeout: float,
+    timeout_step: float,
+    path: tp.Optional[pathlib.Path],
+) -> bool:
+    """
+    Have modifier applied by the agent in a group commit, return False if the agent is not running.
+    """
+    if path is None:
+        memory_modifier = tp.cast(backend_intf.StorageModifier, modifier)
+    else:
+        file_path = path
+
+        def memory_modifier(data: tp.Optional[bytes]) -> tp.Optional[bytes]:
+            if data is not None:
+                file_path.write_bytes(data)
+            elif file_path.exists():
+                file_path.unlink()
+
+            tp.cast(backend_intf.StorageFileModifier, modifier)(file_path)
+            return file_path.read_bytes() if file_path.exists() else None
+
+    try:
+        return _agent.modify(
+            agent_loc(storage),
+            [agent_lock_loc(i, storage) for i in locks],
+            memory_modifier,
+            first_timeout=first_timeout,
+            timeout_step=timeout_step,
+        )
+    except backend_intf.BackendError as e:
+        raise click.ClickException(f"{short_locator_descr(storage)}: {e}")
+
+
+def load_blobs(
+    locs: tp.Mapping[str, Locator],
+    *,
+    consistent: bool,
+) -> tp.Dict[str, tp.Union[bytes, backend_intf.BackendError]]:
+    """
+    Load blobs in parallel, grouping them by backend, so that consistent loads may batch their lookups.
+    Loads are made by the agent, if it is running.
+    """
+    if locs:
+        via_agent = _agent.load([agent_loc(i) for i in locs.values()], consistent=consistent)
+        if via_agent is not None:
+            return dict(zip(locs, via_agent))
+
+    result: tp.Dict[str, tp.Union[bytes, backend_intf.BackendError]] = {}
+    by_backend: tp.Dict[str, tp.List[str]] = {}
+
+    for name, loc in locs.items():
+        by_backend.setdefault(loc.backend, []).append(name)
+
+    for backend_name, names in by_backend.items():
         try:
-            storage_backend.modify(
-                loc=storage.loc,
-                opts=storage.opts,
-                modifier=modifier,
-            )
+            backend = backends.storage_backend(backend_name)
         except backend_intf.BackendError as e:
-            raise click.ClickException(f"{short_locator_descr(storage)}: {e}")
+            result.update((i, e) for i in names)
+            continue
+
+        if consistent:
+            result.update(zip(names, backend.load_consistent(locs=[(locs[i].loc, locs[i].opts) for i in names])))
+        else:
+            def load(name: str, backend: tp.Any = backend) -> None:
+                try:
+                    result[name] = backend.load(loc=locs[name].loc, opts=locs[name].opts)
+                except backend_intf.BackendError as e:
+                    result[name] = e
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(names), MAX_LOAD_WORKERS)) as tpe:
+                list(tpe.map(load, names))
+
+    return result
+
+
+def glob_blobs(loc: Locator) -> tp.Dict[str, Locator]:
+    """
+    Return existing blobs matching wildcards in loc, by their paths relative to the directory part of loc
+    preceding the first wildcard.
+    """
+    backend = backends.storage_backend(loc.backend)
+    prefix = backend_intf.glob_prefix(loc.loc)
+    base = prefix[:prefix.rfind("/") + 1]
+    result: tp.Dict[str, Locator] = {}
+
+    for i in backend.glob(loc=loc.loc, opts=loc.opts):
+        rel = i[len(base):]
+
+        if not i.startswith(base) or any(j in ("", ".", "..") for j in rel.split("/")):
+            raise backend_intf.BackendError(f"{i} cannot be stored as a file")
+
+        result[rel] = Locator(backend=loc.backend, opts=loc.opts, loc=i)
+
+    return result
 
 
 # class PathType(click.Path):
@@ -161,6 +328,38 @@ def click_wrapper(wrapper: tp.Callable[..., None], wrapped: tp.Callable[..., Non
 g_own_errors_error_code = 1
 
 
+def workspace_option(func: tp.Callable[..., None]) -> tp.Callable[..., None]:
+    return click.option(
+        "--workspace",
+        metavar="<dir>",
+        envvar="WITH_CLOUD_BLOB_WORKSPACE",
+        help="Directory to create the temp directory for the command in, e.g. /dev/shm to keep blobs contents "
+        + "in RAM. Defaults to the system temp directory.",
+    )(func)
+
+
+def group_commit_option(func: tp.Callable[..., None]) -> tp.Callable[..., None]:
+    return click.option(
+        "--group-commit/--no-group-commit",
+        help="Have the modification made by the agent, if it is running, in a single read-modify-write "
+        "together with other ones of the same <blob> under the same locks queued meanwhile.",
+    )(func)
+
+
+def blob_version_option(func: tp.Callable[..., None]) -> tp.Callable[..., None]:
+    return click.option(
+        "--blob-version",
+        type=click.IntRange(min(_crypto.BLOB_VERSIONS), max(_crypto.BLOB_VERSIONS)),
+        default=_crypto.BLOB_VERSION,
+        envvar="WITH_CLOUD_BLOB_BLOB_VERSION",
+        metavar="<version>",
+        help="Version of written encrypted blob, unless it already has a newer one. Version 2 lets "
+        + "'read --into' skip unchanged tenants without parsing the whole blob, but cannot be read by releases "
+        + "preceding it.",
+        show_default=True,
+    )(func)
+
+
 def base_command(func: tp.Callable[..., None]) -> tp.Callable[..., None]:
     def error_code_cb(
         ctx: tp.Any,
@@ -232,8 +431,7 @@ def modify_validate_blob(
     return parse_locator(value)
 
 
-def modify_command(func: tp.Callable[..., None]) -> tp.Callable[..., None]:
-    @base_command
+def lock_options(func: tp.Callable[..., None]) -> tp.Callable[..., None]:
     @click.option(
         "--lock",
         multiple=True,
@@ -255,6 +453,19 @@ def modify_command(func: tp.Callable[..., None]) -> tp.Callable[..., None]:
         help="Time in seconds between periodic reports about waiting for lock acquisition.",
         show_default=True,
     )
+    def wrapper(**opts: tp.Any) -> None:
+        func(**opts)
+
+    return click_wrapper(wrapper, func)
+
+
+def modify_command(func: tp.Callable[..., None]) -> tp.Callable[..., None]:
+    @base_command
+    @lock_options
+    @click.option(
+        "--prefetch/--no-prefetch",
+        help="Download <blob> while waiting for locks, and only revalidate it once they are acquired.",
+    )
     @click.argument(
         "blob",
         callback=modify_validate_blob,
@@ -265,8 +476,32 @@ def modify_command(func: tp.Callable[..., None]) -> tp.Callable[..., None]:
     return click_wrapper(wrapper, func)
 
 
+def stdio_filter(args: tp.List[str], path: pathlib.Path) -> None:
+    """
+    Run a command with contents of path, if it exists, as its stdin, and on success replace them with its stdout.
+    """
+    out_path = path.with_name(path.name + ".out")
+
+    with (path.open("rb") if path.exists() else open(os.devnull, "rb")) as stdin, out_path.open("wb") as stdout:
+        try:
+            rc = subprocess.call(args, stdin=stdin, stdout=stdout)
+        except Exception as e:
+            raise click.ClickException(str(e))
+
+    if rc:
+        sys.exit(rc)
+
+    os.replace(out_path, path)
+
+
 @root.command(name="modify")
 @modify_command
+@group_commit_option
+@workspace_option
+@click.option(
+    "--stdio/--no-stdio",
+    help="Pass <blob> as stdin of the command, and replace it with the command's stdout.",
+)
 @click.argument("command", nargs=1, metavar="-- COMMAND")
 @click.argument("command_args", metavar="[ARGS]...", nargs=-1)
 def cmd_modify(**opts: tp.Any) -> None:
@@ -278,39 +513,198 @@ def cmd_modify(**opts: tp.Any) -> None:
     If <blob> exists, its contents will be accessible as a file named "blob"
     in the temp directory used as the current working directory for running
     the command. If command deletes the file, <blob> will be deleted.
+    With --stdio, the command is run in the current directory, and <blob> cannot be deleted.
     """
+    args = [opts["command"]] + list(opts["command_args"])
 
-    def modifier(blob: tp.Optional[bytes]) -> tp.Optional[bytes]:
-        with tempdir() as td:
-            tdp = pathlib.Path(td)
-            blob_path = tdp / "blob"
+    with Workspace(opts["workspace"]) as ws:
+        td = str(ws.path)
+        # blob is passed through this file, without being read into memory
+        blob_path = ws.path / "blob"
 
-            if blob is not None:
-                blob_path.write_bytes(blob)
+        def modifier(path: pathlib.Path) -> None:
+            if path.exists():
+                ws.bytes_written += path.stat().st_size
+
+            if opts["stdio"]:
+                stdio_filter(args, path)
+                return
 
             try:
-                rc = subprocess.call(
-                    [opts["command"]] + list(opts["command_args"]),
-                    cwd=td,
-                )
+                rc = subprocess.call(args, cwd=td)
             except Exception as e:
                 raise click.ClickException(str(e))
 
             if rc:
                 sys.exit(rc)
 
-            if blob_path.exists():
-                return blob_path.read_bytes()
-            else:
-                return None
+        modify_blob_with_locks(
+            storage=opts["blob"],
+            locks=opts["lock"],
+            modifier=modifier,
+            first_timeout=opts["first_timeout"],
+            timeout_step=opts["timeout_step"],
+            prefetch=opts["prefetch"],
+            path=blob_path,
+            group_commit=opts["group_commit"],
+        )
 
-    modify_blob_with_locks(
-        storage=opts["blob"],
-        locks=opts["lock"],
-        modifier=modifier,
-        first_timeout=opts["first_timeout"],
-        timeout_step=opts["timeout_step"],
-    )
+
+def validate_blob_name(name: str, param_hint: tp.Optional[str] = None) -> None:
+    # blob is stored as a file at its name within the workspace, which it must not escape
+    if any(i in ("", ".", "..") for i in name.split("/")):
+        raise click.BadParameter(f"\"{name}\" is not a valid blob name", param_hint=param_hint)
+
+
+def read_validate_blob(
+    ctx: tp.Any,
+    param: tp.Any,
+    values: tp.Tuple[str, ...],
+) -> tp.Dict[str, Locator]:
+    result: tp.Dict[str, Locator] = {}
+
+    for i in values:
+        fields = i.split("=", 1)
+
+        if len(fields) != 2:
+            raise click.BadParameter("missing a required equals sign")
+
+        validate_blob_name(fields[0])
+
+        if fields[0] in result:
+            raise click.BadParameter(f"\"{fields[0]}\" blob name is specified multiple times")
+
+        result[fields[0]] = parse_locator(fields[1])
+
+    return result
+
+
+class ModifyAborted(Exception):
+    pass
+
+
+@root.command(name="mmodify")
+@base_command
+@lock_options
+@workspace_option
+@click.option(
+    "--blob",
+    multiple=True,
+    required=True,
+    callback=read_validate_blob,
+    metavar="<name>=<blob-locator>",
+    help="Read <blob-locator> and store it as <name> in the temp directory used as the current working "
+    + "directory for running the command. May be specified multiple times.",
+)
+@click.argument("command", nargs=1, metavar="-- COMMAND")
+@click.argument("command_args", metavar="[ARGS]...", nargs=-1)
+def cmd_mmodify(**opts: tp.Any) -> None:
+    """
+    Modify several blobs together.
+
+    Acquire locks of all blobs, in a canonical order, so that concurrent invocations cannot deadlock,
+    read blobs in parallel, execute given <command>, and, in case of success, update changed blobs in parallel.
+    Each --lock without a location is acquired for every blob, at its location, other ones once.
+    If command deletes a blob's file, the blob will be deleted.
+    Note: updates of different blobs are not atomic as a whole, i.e. if one of them fails, others may still be made.
+    """
+    args = [opts["command"]] + list(opts["command_args"])
+    blobs: tp.Dict[str, Locator] = opts["blob"]
+
+    try:
+        storage_backends = {name: backends.storage_backend(blob.backend) for name, blob in blobs.items()}
+        lock_backends = {i.backend: backends.lock_backend(i.backend) for i in opts["lock"]}
+    except backend_intf.BackendError as e:
+        raise click.ClickException(str(e))
+
+    # locks by canonical key, along with names of blobs they are acquired for
+    locks: tp.Dict[str, tp.Tuple[Locator, tp.List[str]]] = {}
+
+    for name, blob in blobs.items():
+        for lock in opts["lock"]:
+            lock_loc = (lock.opts.get("prefix") or "") + (lock.loc or blob.loc)
+            key = json.dumps([lock.backend, lock_loc, sorted(lock.opts.as_dict().items())])
+            locks.setdefault(key, (Locator(backend=lock.backend, opts=lock.opts, loc=lock_loc), []))[1].append(name)
+
+    digest_stores: tp.Dict[str, backend_intf.IDigestStore] = {}
+
+    with Workspace(opts["workspace"]) as ws, contextlib.ExitStack() as es:
+        for key in sorted(locks):
+            lock, names = locks[key]
+            digest_store = acquire_lock(
+                es,
+                lock_backends[lock.backend],
+                lock,
+                first_timeout=opts["first_timeout"],
+                timeout_step=opts["timeout_step"],
+                shared=False,
+            )
+
+            if digest_store is not None:
+                if len(names) > 1 or names[0] in digest_stores:
+                    raise click.ClickException(f"{short_locator_descr(lock)}: only one lock may carry blob digest")
+
+                digest_stores[names[0]] = digest_store
+
+        # modifiers of all blobs are called once all of them are downloaded, and return once command completes
+        downloaded = threading.Barrier(len(blobs) + 1)
+        completed = threading.Event()
+        succeeded = threading.Event()
+        errors: tp.Dict[str, backend_intf.BackendError] = {}
+
+        def modifier(path: pathlib.Path) -> None:
+            downloaded.wait()
+            completed.wait()
+
+            if not succeeded.is_set():
+                raise ModifyAborted()
+
+        def modify(name: str, blob: Locator) -> None:
+            path = ws.path / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+            try:
+                storage_backends[name].modify_file(
+                    loc=blob.loc,
+                    path=path,
+                    opts=blob.opts,
+                    modifier=modifier,
+                    digest_store=digest_stores.get(name),
+                )
+            except (ModifyAborted, threading.BrokenBarrierError):
+                pass
+            except backend_intf.BackendError as e:
+                errors[name] = e
+            finally:
+                # lets others know, if this one has failed before being downloaded
+                downloaded.abort()
+
+        rc = None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(blobs)) as tpe:
+            futures = [tpe.submit(modify, name, blob) for name, blob in blobs.items()]
+
+            try:
+                downloaded.wait()
+                rc = subprocess.call(args, cwd=str(ws.path))
+            except threading.BrokenBarrierError:
+                pass
+            except Exception as e:
+                raise click.ClickException(str(e))
+            finally:
+                if rc == 0:
+                    succeeded.set()
+
+                completed.set()
+
+        for i in futures:
+            i.result()
+
+    if errors:
+        raise click.ClickException("; ".join(f"{short_locator_descr(blobs[k])}: {v}" for k, v in errors.items()))
+
+    if rc:
+        sys.exit(rc)
 
 
 def xmodify_validate_key(
@@ -324,8 +718,26 @@ def xmodify_validate_key(
         raise click.BadParameter(str(e))
 
 
+def path_selector(paths: tp.Iterable[str]) -> tp.Callable[[str], bool]:
+    """
+    Return predicate matching file names equal to any of paths, or under any of them.
+    """
+    prefixes = [i.strip("/") for i in paths]
+    return lambda name: any(name == i or name.startswith(i + "/") for i in prefixes)
+
+
 @root.command(name="xmodify")
 @modify_command
+@group_commit_option
+@workspace_option
+@blob_version_option
+@click.option(
+    "--only",
+    multiple=True,
+    metavar="<path>",
+    help="Write out only files under <path>, e.g. 'tenants/<name>', and carry the rest of <blob> over as is. "
+    + "May be specified multiple times.",
+)
 @click.argument(
     "key",
     callback=xmodify_validate_key,
@@ -345,11 +757,57 @@ def cmd_xmodify(**opts: tp.Any) -> None:
     If command deletes 'master' directory, <blob> will be deleted.
     If command deletes any of '.keep-tenant-key-<name>' or 'tenants/<name>/', existing reader keys for correcponding
     tenants will be forgotten, and new ones will be generated as necessary.
+    With --only, files deleted by command are removed from <blob>, which is never deleted as a whole,
+    and command may not create files outside of the selected paths. Reader keys of tenants are forgotten
+    only if all their files are removed.
     """
 
+    def sparse_modifier(blob: tp.Optional[bytes]) -> tp.Optional[bytes]:
+        select = path_selector(opts["only"])
+
+        with Workspace(opts["workspace"]) as ws:
+            cb = _crypto.CryptoBlob()
+            master_data = None
+
+            if blob is not None:
+                cb.load_from_blob(blob)
+
+                master_data = cb.unseal_master(opts["key"])
+                cb.writeout_master(master_data, ws.path, reserve=ws.reserve, select=select)
+
+            try:
+                rc = subprocess.call(
+                    [opts["command"]] + list(opts["command_args"]),
+                    cwd=str(ws.path),
+                )
+            except Exception as e:
+                raise click.ClickException(str(e))
+
+            if rc:
+                sys.exit(rc)
+
+            collection = _crypto.collect_files(ws.path)
+            outside = sorted(i for i in collection.files if not select(i))
+            if outside:
+                raise click.ClickException(f"files outside of --only paths: {', '.join(outside)}")
+
+            try:
+                cb.patch(
+                    master_key=opts["key"],
+                    master_data=master_data,
+                    remove=select,
+                    add=collection,
+                    version=opts["blob_version"],
+                )
+            except _crypto.Error as e:
+                raise click.ClickException(str(e))
+
+            return cb.dump_to_blob()
+
     def modifier(blob: tp.Optional[bytes]) -> tp.Optional[bytes]:
-        with tempdir() as td:
-            tdp = pathlib.Path(td)
+        with Workspace(opts["workspace"]) as ws:
+            td = str(ws.path)
+            tdp = ws.path
 
             cb = _crypto.CryptoBlob()
 
@@ -357,7 +815,7 @@ def cmd_xmodify(**opts: tp.Any) -> None:
                 cb.load_from_blob(blob)
 
                 master_data = cb.unseal_master(opts["key"])
-                cb.writeout_master(master_data, tdp)
+                cb.writeout_master(master_data, tdp, reserve=ws.reserve)
                 existing_tenants_keys = {i.tenant_name: i for i in cb.get_tenants_keys(master_data)}
                 keep_keys_paths = {i: tdp.joinpath(f".keep-tenant-key-{i}") for i in existing_tenants_keys}
             else:
@@ -391,20 +849,174 @@ def cmd_xmodify(**opts: tp.Any) -> None:
                     tdp,
                     master_key=opts["key"],
                     existing_tenants_keys=existing_tenants_keys.values(),
+                    version=opts["blob_version"],
                 )
                 return cb.dump_to_blob()
             else:
                 return None
 
+    modify_blob_with_locks(
+        storage=opts["blob"],
+        locks=opts["lock"],
+        modifier=sparse_modifier if opts["only"] else modifier,
+        first_timeout=opts["first_timeout"],
+        timeout_step=opts["timeout_step"],
+        prefetch=opts["prefetch"],
+        group_commit=opts["group_commit"],
+    )
+
+
+def patch_xblob(opts: tp.Dict[str, tp.Any], *, add: _crypto.FilesCollection, remove: tp.Iterable[str]) -> None:
+    """
+    Apply changes to encrypted blob without writing it out, re-encrypting only what they affect.
+    """
+    remove_selector = path_selector(remove)
+
+    def modifier(blob: tp.Optional[bytes]) -> tp.Optional[bytes]:
+        cb = _crypto.CryptoBlob()
+        master_data = None
+
+        if blob is not None:
+            cb.load_from_blob(blob)
+            master_data = cb.unseal_master(opts["key"])
+
+        try:
+            cb.patch(
+                master_key=opts["key"],
+                master_data=master_data,
+                remove=remove_selector,
+                add=add,
+                version=opts["blob_version"],
+            )
+        except _crypto.Error as e:
+            raise click.ClickException(str(e))
+
+        return cb.dump_to_blob()
+
     modify_blob_with_locks(
         storage=opts["blob"],
         locks=opts["lock"],
         modifier=modifier,
         first_timeout=opts["first_timeout"],
         timeout_step=opts["timeout_step"],
+        prefetch=opts["prefetch"],
+        group_commit=opts["group_commit"],
     )
 
 
+def files_from_tar(f: tp.BinaryIO, add: _crypto.FilesCollection) -> None:
+    try:
+        with tarfile.open(fileobj=f, mode="r|*") as tf:
+            for member in tf:
+                name = member.name[2:] if member.name.startswith("./") else member.name
+
+                if member.isdir():
+                    continue
+                elif member.isfile():
+                    body = tf.extractfile(member)
+                    assert body is not None
+                    add.add_file(name, body.read())
+                elif member.issym() and not member.linkname.startswith("/"):
+                    add.add_file(name, member.linkname.encode(), symlink=True)
+                else:
+                    raise click.ClickException(f"{member.name}: unsupported tar member type")
+    except (tarfile.TarError, _crypto.Error) as e:
+        raise click.ClickException(str(e))
+
+
+@root.command(name="xput")
+@modify_command
+@group_commit_option
+@blob_version_option
+@click.option(
+    "--tar",
+    type=click.File("rb"),
+    metavar="<file>",
+    help="Put files from tar archive, '-' for stdin. Member names are full file names, e.g. 'master/a'.",
+)
+@click.argument(
+    "key",
+    callback=xmodify_validate_key,
+)
+@click.argument("files", metavar="[<name>=<file>]...", nargs=-1)
+def cmd_xput(**opts: tp.Any) -> None:
+    """
+    Put files into encrypted blob.
+
+    Put contents of each local <file> into <blob> as file <name>, e.g. 'master/a' or 'tenants/<tenant>/a',
+    replacing existing ones, without writing out the rest of <blob>.
+    """
+    add = _crypto.FilesCollection()
+
+    if opts["tar"] is not None:
+        files_from_tar(opts["tar"], add)
+
+    for i in opts["files"]:
+        name, sep, src = i.partition("=")
+        if not sep:
+            raise click.BadParameter("missing a required equals sign", param_hint="FILES")
+
+        try:
+            add.add_file(name, pathlib.Path(src).read_bytes())
+        except (OSError, _crypto.Error) as e:
+            raise click.ClickException(str(e))
+
+    patch_xblob(opts, add=add, remove=[])
+
+
+@root.command(name="xdel")
+@modify_command
+@group_commit_option
+@blob_version_option
+@click.argument(
+    "key",
+    callback=xmodify_validate_key,
+)
+@click.argument("paths", metavar="[<path>]...", nargs=-1)
+def cmd_xdel(**opts: tp.Any) -> None:
+    """
+    Delete files from encrypted blob.
+
+    Delete files with names equal to any of <path>, or under any of them, e.g. 'tenants/<tenant>',
+    without writing out the rest of <blob>.
+    """
+    patch_xblob(opts, add=_crypto.FilesCollection(), remove=opts["paths"])
+
+
+@root.command(name="xpatch")
+@modify_command
+@group_commit_option
+@blob_version_option
+@click.argument(
+    "key",
+    callback=xmodify_validate_key,
+)
+@click.argument("manifest", type=click.File("rb"))
+def cmd_xpatch(**opts: tp.Any) -> None:
+    """
+    Put and delete files in encrypted blob.
+
+    <manifest> ('-' for stdin) is a JSON object with optional members: "delete", a list of paths as accepted
+    by 'xdel' command; "put", an object mapping file names to their text contents; "put_base64", same as "put",
+    but with base64 encoded contents. Deletions are applied first.
+    """
+    try:
+        manifest = json.load(opts["manifest"])
+        add = _crypto.FilesCollection()
+
+        for name, text in manifest.get("put", {}).items():
+            add.add_file(name, text.encode())
+
+        for name, encoded in manifest.get("put_base64", {}).items():
+            add.add_file(name, base64.b64decode(encoded, validate=True))
+
+        remove = list(manifest.get("delete", []))
+    except (ValueError, AttributeError, _crypto.Error) as e:
+        raise click.ClickException(f"invalid manifest: {e}")
+
+    patch_xblob(opts, add=add, remove=remove)
+
+
 @root.command(name="xgetkeys")
 @modify_command
 @click.argument(
@@ -419,7 +1031,7 @@ def cmd_xgetkeys(**opts: tp.Any) -> None:
     Read <blob>, decrypt it with master <key>, get keys for specified tenants.
     """
 
-    # modifier access semantics is use to do consistent read
+    # with locks, modifier access semantics is used to do consistent read under shared locks
 
     def modifier(blob: tp.Optional[bytes]) -> tp.Optional[bytes]:
         if blob is not None:
@@ -446,48 +1058,158 @@ def cmd_xgetkeys(**opts: tp.Any) -> None:
 
         return blob
 
-    modify_blob_with_locks(
-        storage=opts["blob"],
-        locks=opts["lock"],
-        modifier=modifier,
-        first_timeout=opts["first_timeout"],
-        timeout_step=opts["timeout_step"],
-    )
+    if opts["lock"]:
+        modify_blob_with_locks(
+            storage=opts["blob"],
+            locks=opts["lock"],
+            modifier=modifier,
+            first_timeout=opts["first_timeout"],
+            timeout_step=opts["timeout_step"],
+            shared=True,
+            prefetch=opts["prefetch"],
+        )
+    else:
+        data = load_blobs({"blob": opts["blob"]}, consistent=True)["blob"]
+        if isinstance(data, backend_intf.BackendError):
+            raise click.ClickException(f"{short_locator_descr(opts['blob'])}: {data}")
 
+        modifier(data)
 
-def read_validate_blob(
+
+def xcat_validate_key(
     ctx: tp.Any,
     param: tp.Any,
-    values: tp.Tuple[str, ...],
-) -> tp.Dict[str, Locator]:
-    result: tp.Dict[str, Locator] = {}
+    value: str,
+) -> tp.Union[bytes, ReaderKey]:
+    try:
+        if ":" in value:
+            return parse_reader_key(value)
 
-    for i in values:
-        fields = i.split("=", 1)
+        return tp.cast(bytes, nacl.encoding.HexEncoder.decode(value))
+    except click.BadParameter:
+        raise
+    except Exception as e:
+        raise click.BadParameter(str(e))
 
-        if len(fields) != 2:
-            raise click.BadParameter("missing a required equals sign")
 
-        if fields[0] in result:
-            raise click.BadParameter(f"\"{fields[0]}\" blob name is specified multiple times")
+def load_xblob(loc: Locator, *, consistent: bool) -> _crypto.CryptoBlob:
+    data = load_blobs({"blob": loc}, consistent=consistent)["blob"]
+    if isinstance(data, backend_intf.BackendError):
+        raise click.ClickException(f"{short_locator_descr(loc)}: {data}")
 
-        result[fields[0]] = parse_locator(fields[1])
+    cb = _crypto.CryptoBlob()
+    cb.load_from_blob(data)
+    return cb
 
-    return result
+
+def xread_command(func: tp.Callable[..., None]) -> tp.Callable[..., None]:
+    @base_command
+    @click.option(
+        "--consistent/--no-consistent",
+        help="Make sure <blob> is not older than its last completed modification, without taking locks.",
+    )
+    @click.argument(
+        "blob",
+        callback=modify_validate_blob,
+    )
+    @click.argument(
+        "key",
+        callback=xcat_validate_key,
+    )
+    def wrapper(**opts: tp.Any) -> None:
+        func(**opts)
+
+    return click_wrapper(wrapper, func)
+
+
+@root.command(name="xcat")
+@xread_command
+@click.argument("path")
+def cmd_xcat(**opts: tp.Any) -> None:
+    """
+    Write a file from encrypted blob to stdout.
+
+    With master <key>, <path> is a full file name, e.g. 'master/a' or 'tenants/<tenant>/a'. With reader <key>,
+    given as '<key_id>:<key>', <path> is relative to the tenant's view, as written out by 'read --xblob'.
+    Only the partition holding the file is decrypted.
+    """
+    cb = load_xblob(opts["blob"], consistent=opts["consistent"])
+    key = opts["key"]
+    path = opts["path"].strip("/")
+
+    try:
+        if isinstance(key, ReaderKey):
+            body = cb.read_tenant_file(path, key_id=key.key_id, tenant_key=key.key)
+        else:
+            body = cb.read_master_file(cb.unseal_master(key), path)
+    except _crypto.Error as e:
+        raise click.ClickException(str(e))
+
+    sys.stdout.buffer.write(body)
+    sys.stdout.buffer.flush()
+
+
+@root.command(name="xtar")
+@xread_command
+@click.argument("paths", metavar="[<path>]...", nargs=-1)
+def cmd_xtar(**opts: tp.Any) -> None:
+    """
+    Write files from encrypted blob to stdout as tar archive.
+
+    <key> and <path> are as with 'xcat' command. If any <path> is given, only files equal to any of them,
+    or under any of them, are written. Nothing is written to disk, and only one partition is decrypted at a time.
+    """
+    cb = load_xblob(opts["blob"], consistent=opts["consistent"])
+    key = opts["key"]
+    select = path_selector(opts["paths"]) if opts["paths"] else None
+
+    try:
+        if isinstance(key, ReaderKey):
+            cb.write_tenant_tar(sys.stdout.buffer, key_id=key.key_id, tenant_key=key.key, select=select)
+        else:
+            cb.write_master_tar(cb.unseal_master(key), sys.stdout.buffer, select=select)
+    except _crypto.Error as e:
+        raise click.ClickException(str(e))
+
+    sys.stdout.buffer.flush()
+
+
+def read_validate_signal(
+    ctx: tp.Any,
+    param: tp.Any,
+    value: tp.Optional[str],
+) -> tp.Optional[signal.Signals]:
+    if value is None:
+        return None
+
+    name = value.upper()
+
+    try:
+        return signal.Signals[name if name.startswith("SIG") else "SIG" + name]
+    except KeyError:
+        raise click.BadParameter(f"unknown signal {value}")
 
 
 @root.command(name="read")
 @base_command
+@workspace_option
 @click.option(
     "--allow-errors/--disallow-errors",
     help="Run command even if some blobs cannot be read.",
 )
+@click.option(
+    "--consistent/--no-consistent",
+    help="Make sure blobs are not older than their last completed modification, "
+    + "without taking locks. Applicable to eventually consistent storage backends, e.g. s3.",
+)
 @click.option(
     "--blob",
     multiple=True,
     metavar="<name>=<blob-locator>",
     help="Read <blob-locator> and store it as <name> in the temp "
     + "directory used as the current working directory for running the command. "
+    + "If <blob-locator> contains wildcards (*, ?, [...]), all matching blobs are stored in <name> directory, "
+    + "under their paths relative to the one preceding the first wildcard. "
     + "May be specified multiple times.",
 )
 @click.option(
@@ -499,6 +1221,32 @@ def read_validate_blob(
     + "in the temp directory used as the current working directory for running the command. "
     + "May be specified multiple times.",
 )
+@click.option(
+    "--into",
+    metavar="<dir>",
+    help="Use <dir>, kept between invocations, instead of the temp directory. Blobs are only written if changed. "
+    + "Contents of --xblob directories are synced: only changed files are replaced, atomically, "
+    + "and files no longer in the blob are removed, with state kept in the cache directory.",
+)
+@click.option(
+    "--stdio/--no-stdio",
+    help="Pass the only <blob-locator>, which must be given with --blob, as stdin of the command "
+    + "run in the current directory, instead of storing it in the temp directory.",
+)
+@click.option(
+    "--watch",
+    type=float,
+    metavar="<T>",
+    help="Keep the command running, and check blobs for changes about every <T> seconds until it exits, "
+    + "updating changed files atomically. Use with conditional requests enabled, e.g. 'cache_size' option "
+    + "of s3 backend, to avoid downloading unchanged blobs.",
+)
+@click.option(
+    "--watch-signal",
+    callback=read_validate_signal,
+    metavar="<signal>",
+    help="Signal, e.g. HUP, to send to the command running with --watch when files have changed.",
+)
 # TODO key_id > max_id retries
 @click.argument("command", nargs=1)
 @click.argument("command_args", metavar="[ARGS]...", nargs=-1)
@@ -516,6 +1264,8 @@ def cmd_read(**opts: tp.Any) -> None:
         if len(fields) != 2:
             raise click.BadParameter("missing a required equals sign", param_hint=param_hint)
 
+        validate_blob_name(fields[0], param_hint)
+
         if fields[0] in blobs:
             raise click.BadParameter(f"\"{fields[0]}\" blob name is specified multiple times", param_hint=param_hint)
 
@@ -531,53 +1281,373 @@ def cmd_read(**opts: tp.Any) -> None:
     for i, j in opts["xblob"]:
         xblobs[validate_blob(i, "--xblob")] = parse_reader_key(j)
 
-    with tempdir() as td:
-        tdp = pathlib.Path(td)
+    if opts["watch"] is not None and opts["watch"] <= 0:
+        raise click.BadParameter("must be positive", param_hint="--watch")
 
-        errors = False
+    if opts["watch_signal"] is not None and opts["watch"] is None:
+        raise click.BadParameter("requires --watch", param_hint="--watch-signal")
 
-        for name, loc in blobs.items():
-            reader_key = xblobs.get(name)
+    if opts["stdio"]:
+        if xblobs or len(blobs) != 1 or any(backend_intf.is_glob(i.loc) for i in blobs.values()):
+            raise click.BadParameter("requires a single --blob without wildcards", param_hint="--stdio")
 
-            try:
-                backend = backends.storage_backend(loc.backend)
-                data = backend.load(
-                    loc=loc.loc,
-                    opts=loc.opts,
-                )
+        if opts["into"] is not None or opts["watch"] is not None:
+            raise click.BadParameter("cannot be used with --into or --watch", param_hint="--stdio")
 
-                name_path = tdp / name
+        read_stdio(
+            [opts["command"]] + list(opts["command_args"]),
+            *blobs.values(),
+            consistent=opts["consistent"],
+            workspace=opts["workspace"],
+        )
+        return
+
+    with Workspace(opts["workspace"], into=opts["into"]) as ws:
+        def refresh() -> tp.Tuple[bool, bool]:
+            return read_blobs(
+                ws,
+                blobs,
+                xblobs,
+                consistent=opts["consistent"],
+                allow_errors=opts["allow_errors"],
+                # in watch mode the command may be reading files while they are being updated
+                incremental=opts["into"] is not None or opts["watch"] is not None,
+            )
 
-                if reader_key:
-                    name_path.mkdir()
+        errors, _ = refresh()
+        if errors and not opts["allow_errors"]:
+            sys.exit(1)
+
+        args = [opts["command"]] + list(opts["command_args"])
+
+        try:
+            if opts["watch"] is None:
+                rc = subprocess.call(args, cwd=str(ws.path))
+            else:
+                rc = watch_command(args, ws.path, refresh, interval=opts["watch"], sig=opts["watch_signal"])
+        except OSError as e:
+            raise click.ClickException(str(e))
+
+        if rc:
+            sys.exit(rc)
+
+
+def read_blobs(
+    ws: Workspace,
+    blobs: tp.Mapping[str, Locator],
+    xblobs: tp.Mapping[str, ReaderKey],
+    *,
+    consistent: bool,
+    allow_errors: bool,
+    incremental: bool,
+) -> tp.Tuple[bool, bool]:
+    """
+    Store blobs in workspace, return whether there were errors, and whether any files were changed.
+    Unless allow_errors, stops at the first error. With incremental, only changed files are replaced, atomically.
+    """
+    tdp = ws.path
+    errors = False
+    changed = False
+    # path relative to workspace -> (blob name, locator)
+    targets: tp.Dict[str, tp.Tuple[str, Locator]] = {}
+    # blob name -> paths relative to workspace of matches of its glob, if listed
+    globbed: tp.Dict[str, tp.Set[str]] = {}
+
+    for name, loc in blobs.items():
+        if not backend_intf.is_glob(loc.loc):
+            targets[name] = name, loc
+            continue
+
+        (tdp / name).mkdir(exist_ok=incremental)
+
+        try:
+            matches = glob_blobs(loc)
+        except backend_intf.BackendError as e:
+            logger.error(f"{short_locator_descr(loc)}: {e}")
+            errors = True
+            continue
+
+        globbed[name] = set()
+
+        for rel, match in matches.items():
+            targets[f"{name}/{rel}"] = name, match
+            globbed[name].add(f"{name}/{rel}")
+
+    if errors and not allow_errors:
+        return errors, changed
+
+    loaded = load_blobs({k: v[1] for k, v in targets.items()}, consistent=consistent)
+
+    for target, (name, loc) in targets.items():
+        reader_key = xblobs.get(name)
+
+        try:
+            data = loaded[target]
+            if isinstance(data, backend_intf.BackendError):
+                raise data
+
+            name_path = tdp / target
+            name_path.parent.mkdir(parents=True, exist_ok=True)
+
+            if reader_key:
+                if not incremental:
                     cb = _crypto.CryptoBlob()
                     cb.load_from_blob(data)
+                    name_path.mkdir()
                     cb.writeout_tenant(
                         name_path,
                         key_id=reader_key.key_id,
                         tenant_key=reader_key.key,
+                        reserve=ws.reserve,
                     )
+                    changed = True
                 else:
-                    name_path.write_bytes(data)
-            except backend_intf.BackendError as e:
-                logger.error(f"{short_locator_descr(loc)}: {e}")
-                errors = True
+                    name_path.mkdir(exist_ok=True)
+                    changed |= _crypto.sync_tenant_blob(
+                        data,
+                        name_path,
+                        key_id=reader_key.key_id,
+                        tenant_key=reader_key.key,
+                        state_path=ws.sync_state_path(target),
+                        reserve=ws.reserve,
+                    )
+            elif not incremental:
+                ws.reserve(len(data))
+                name_path.write_bytes(data)
+                changed = True
+            elif not name_path.is_file() or name_path.read_bytes() != data:
+                ws.reserve(len(data))
+                tmp_path = name_path.with_name(f".{name_path.name}.wcb-tmp")
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, name_path)
+                changed = True
+        except backend_intf.BackendError as e:
+            logger.error(f"{short_locator_descr(loc)}: {e}")
+            errors = True
+
+        if errors and not allow_errors:
+            break
+
+    if incremental and not (errors and not allow_errors):
+        for name, name_targets in globbed.items():
+            changed |= prune_glob_matches(ws, name, name_targets)
+
+    return errors, changed
+
+
+def prune_glob_matches(ws: Workspace, name: str, matches: tp.Set[str]) -> bool:
+    """
+    Remove what was synced into workspace from matches of glob of blob name which are gone, as recorded
+    in its sync state, and record current matches there. Return whether anything was removed.
+    """
+    state_path = ws.sync_state_path(name)
+    removed = False
+
+    synced: tp.Set[str] = set()
+
+    try:
+        state = json.loads(state_path.read_text())
+        if isinstance(state, list):
+            synced = {i for i in state if isinstance(i, str) and i.startswith(f"{name}/")}
+    except (FileNotFoundError, ValueError):
+        pass
+
+    for target in sorted(synced - matches):
+        path = ws.path / target
+
+        if path.is_dir() and not path.is_symlink():
+            # tenant of an encrypted blob, along with its own sync state
+            shutil.rmtree(path)
+
+            with contextlib.suppress(FileNotFoundError):
+                ws.sync_state_path(target).unlink()
+        elif path.exists() or path.is_symlink():
+            path.unlink()
+        else:
+            continue
+
+        removed = True
+
+        # directories left empty, up to that of the blob
+        for parent in list(path.relative_to(ws.path / name).parents)[:-1]:
+            try:
+                (ws.path / name / parent).rmdir()
+            except OSError:
+                break
+
+    tmp_state_path = state_path.with_name(state_path.name + ".tmp")
+    tmp_state_path.write_text(json.dumps(sorted(matches)))
+    os.replace(tmp_state_path, state_path)
+
+    return removed
 
-            if errors and not opts["allow_errors"]:
-                sys.exit(1)
+
+def watch_command(
+    args: tp.List[str],
+    cwd: pathlib.Path,
+    refresh: tp.Callable[[], tp.Tuple[bool, bool]],
+    *,
+    interval: float,
+    sig: tp.Optional[signal.Signals],
+) -> int:
+    """
+    Run command, calling refresh about every interval seconds, until it exits, and return its exit code.
+    If refresh has changed any files, command is sent sig, if given. Failed refreshes are retried
+    with exponential backoff.
+    """
+    proc = subprocess.Popen(args, cwd=str(cwd))
+    delay = interval
+
+    try:
+        while True:
+            try:
+                # jitter keeps multiple watchers from polling in lockstep
+                return proc.wait(timeout=delay * random.uniform(1 - WATCH_JITTER, 1 + WATCH_JITTER))
+            except subprocess.TimeoutExpired:
+                pass
+
+            try:
+                errors, changed = refresh()
+            except click.ClickException as e:
+                logger.error(e.format_message())
+                errors, changed = True, False
+            except Exception as e:
+                # e.g. a blob which cannot be decrypted, which may be fixed by the next update of it
+                logger.error(f"refreshing blobs: {e}")
+                errors, changed = True, False
+
+            if errors:
+                delay = min(delay * 2, interval * WATCH_MAX_BACKOFF)
+                logger.warning(lambda: f"refresh failed, next attempt in about {delay:1.0f}s")
+                continue
+
+            delay = interval
+
+            if changed:
+                logger.info("blobs have changed")
+
+                if sig is not None and proc.poll() is None:
+                    proc.send_signal(sig)
+    finally:
+        if proc.poll() is None:
+            proc.terminate()
+            proc.wait()
+
+
+def read_stdio(args: tp.List[str], loc: Locator, *, consistent: bool, workspace: tp.Optional[str]) -> None:
+    with Workspace(workspace) as ws:
+        path = ws.path / "blob"
 
         try:
-            rc = subprocess.call(
-                [opts["command"]] + list(opts["command_args"]),
-                cwd=td,
-            )
-        except Exception as e:
-            raise click.ClickException(str(e))
+            if consistent:
+                data = load_blobs({"blob": loc}, consistent=True)["blob"]
+                if isinstance(data, backend_intf.BackendError):
+                    raise data
+
+                ws.reserve(len(data))
+                path.write_bytes(data)
+            else:
+                backends.storage_backend(loc.backend).load_file(loc=loc.loc, path=path, opts=loc.opts)
+                ws.bytes_written += path.stat().st_size
+        except backend_intf.BackendError as e:
+            logger.error(f"{short_locator_descr(loc)}: {e}")
+            sys.exit(1)
+
+        with path.open("rb") as stdin:
+            try:
+                rc = subprocess.call(args, stdin=stdin)
+            except Exception as e:
+                raise click.ClickException(str(e))
 
         if rc:
             sys.exit(rc)
 
 
+@root.command(name="agent")
+@base_command
+@click.option(
+    "--socket",
+    metavar="<path>",
+    envvar="WITH_CLOUD_BLOB_AGENT_SOCKET",
+    help="Unix socket to listen at. Defaults to 'agent.sock' in the cache directory.",
+)
+@click.option(
+    "--max-age",
+    default=0.0,
+    metavar="<T>",
+    help="Time in seconds for which loaded blobs are served from memory to loads without --consistent.",
+    show_default=True,
+)
+@click.option(
+    "--cache-size",
+    default=256 * 1024 * 1024,
+    metavar="<bytes>",
+    help="Maximum total size of blobs kept in memory.",
+    show_default=True,
+)
+def cmd_agent(**opts: tp.Any) -> None:
+    """
+    Serve loads of blobs for other invocations on this host.
+
+    Commands loading blobs without locks ('read', 'xgetkeys', 'xcat' and 'xtar') make their loads through
+    the agent listening at the same socket, if it is running, saving them on creating sessions and connections.
+    Loads are made with credentials of the agent, so invocations with AWS_* or HOME environment variables
+    differing from those of the agent make their own. Blobs are kept in memory as stored, i.e. encrypted ones
+    are never decrypted by the agent.
+
+    Modifications with --group-commit are queued by blob and locks, and each queue is applied, in order,
+    to a single copy of the blob, downloaded and uploaded by the agent once. Commands are still run
+    by their own invocations, and a failed one leaves the blob as left by the preceding ones.
+    """
+    agent = _agent.Agent(max_age=opts["max_age"], cache_size=opts["cache_size"])
+
+    try:
+        agent.serve(pathlib.Path(opts["socket"]) if opts["socket"] else _agent.socket_path())
+    except backend_intf.BackendError as e:
+        raise click.ClickException(str(e))
+    except KeyboardInterrupt:
+        pass
+
+
+@root.command(name="provision")
+@base_command
+@click.option(
+    "--lock",
+    multiple=True,
+    callback=modify_validate_lock,
+    metavar="<lock-locator>",
+    help="Locator of a lock to provision. May be specified multiple times.",
+)
+@click.argument(
+    "blobs",
+    metavar="[BLOB]...",
+    nargs=-1,
+    callback=modify_validate_lock,
+)
+def cmd_provision(**opts: tp.Any) -> None:
+    """
+    Provision backends resources.
+
+    Create auxiliary resources (e.g. DynamoDB tables) required by given blob and lock locators,
+    and remember them as existing, so that subsequent commands on this host make only data plane calls.
+    Locators are the same as the ones passed to 'modify'.
+    Run again if the resources were deleted.
+    """
+
+    for is_lock, locs in ((False, opts["blobs"]), (True, opts["lock"])):
+        for loc in locs:
+            try:
+                if is_lock:
+                    loc.opts.mark_used(LOCK_OPTIONS)
+                    backend: tp.Any = backends.lock_backend(loc.backend)
+                else:
+                    backend = backends.storage_backend(loc.backend)
+
+                backend.provision(loc=loc.loc, opts=loc.opts)
+            except backend_intf.BackendError as e:
+                raise click.ClickException(f"{short_locator_descr(loc)}: {e}")
+
+
 @root.group(name="backends")
 def cmd_backends(**opts: tp.Any) -> None:
     """
@@ -1,13 +1,20 @@
 import enum
 import functools
+import hashlib
 import io
 import json
 import lzma
 import os
 import pathlib
+import posixpath
+import shutil
+import stat
 import struct
+import tarfile
+import time
 import typing as tp
 from dataclasses import dataclass
+from dataclasses import replace
 
 import fastavro
 import nacl.encoding
@@ -84,6 +91,24 @@ class Error(Exception):
     pass
 
 
+# versions differ only in blob's own layout, not in layouts of encrypted data; version 2 adds tenants digests
+BLOB_VERSIONS = (1, 2)
+# default version of newly written blobs, readable by all releases
+BLOB_VERSION = 1
+
+
+def check_blob_version(version: int) -> int:
+    """
+    Return version, if supported. Code handling blobs relies on it having been checked.
+    """
+    if version not in BLOB_VERSIONS:
+        raise Error(
+            f"unsupported blob version {version}, supported versions are {', '.join(map(str, BLOB_VERSIONS))}",
+        )
+
+    return version
+
+
 def new_key() -> bytes:
     return tp.cast(bytes, nacl.utils.random(nacl.secret.SecretBox.KEY_SIZE))
 
@@ -209,6 +234,22 @@ class FilesCollection:
 
         return result
 
+    def add_file(self, name: str, body: bytes, *, symlink: bool = False) -> None:
+        """
+        Add a file with given full name, or a relative symlink to body, modified now.
+        """
+        components = name.split("/")
+        if any(i in ("", ".", "..") for i in components):
+            raise Error(f"\"{name}\" is not a valid file name")
+
+        self.files[name] = FilesCollectionItem(
+            metadata=FileMetadata(
+                mtime_ns=time.time_ns(),
+                flags=FileMetadataFlag.SYMLINK if symlink else 0,
+            ),
+            body_id=self.add_body(body),
+        )
+
 
 def collect_files(src: pathlib.Path) -> FilesCollection:
     result = FilesCollection()
@@ -270,17 +311,14 @@ class FilesPartitionsItem:
 
     @staticmethod
     def from_data(data: tp.Any, version: int) -> "FilesPartitionsItem":
-        if version == 1:
-            return FilesPartitionsItem(
-                FileMetadata(
-                    mtime_ns=data["mtime_ns"],
-                    flags=data["flags"],
-                ),
-                partition_id=data["partition_id"],
-                body_id=data["body_id"],
-            )
-
-        assert 0
+        return FilesPartitionsItem(
+            FileMetadata(
+                mtime_ns=data["mtime_ns"],
+                flags=data["flags"],
+            ),
+            partition_id=data["partition_id"],
+            body_id=data["body_id"],
+        )
 
 
 @dataclass
@@ -298,6 +336,13 @@ def strip_prefix(s: str, prefixes: tp.Iterable[str]) -> tp.Tuple[int, str]:
     return -1, s
 
 
+def full_file_name(key: str, name: str) -> str:
+    """
+    Return path of a file as seen by xmodify commands, given its partitioning key and name.
+    """
+    return (f"tenants/{key}/" if key else "master/") + name
+
+
 def partition_files(collection: FilesCollection) -> FilesPartitions:
     keys_by_body_id: tp.Dict[int, tp.Set[str]] = {}
 
@@ -412,9 +457,16 @@ def writeout(
     partitions: tp.Union[tp.List[tp.List[bytes]], tp.Mapping[int, tp.List[bytes]]],
     files: tp.Dict[str, tp.Dict[str, FilesPartitionsItem]],
     dest: pathlib.Path,
+    reserve: tp.Optional[tp.Callable[[int], None]] = None,
 ) -> None:
+    """
+    Write files out into dest. If given, reserve is called with their total size beforehand.
+    """
     created_dirs: tp.Set[tp.Tuple[str, ...]] = set()
 
+    if reserve is not None:
+        reserve(sum(len(partitions[f.partition_id][f.body_id]) for pfiles in files.values() for f in pfiles.values()))
+
     for prefix, pfiles in files.items():
         for fname, f in pfiles.items():
             fname_components = (prefix + fname).split("/")
@@ -444,6 +496,285 @@ def writeout(
                 os.utime(dest_path, ns=(f.metadata.mtime_ns, f.metadata.mtime_ns))
 
 
+# as with Linux path resolution
+_MAX_SYMLINK_FOLLOWS = 40
+
+
+def read_file(
+    files: tp.Mapping[str, FilesPartitionsItem],
+    name: str,
+    partition: tp.Callable[[int], tp.List[bytes]],
+) -> bytes:
+    """
+    Return body of file name among files, following symlinks. partition is called to get only partitions
+    holding the file and symlinks leading to it.
+    """
+    for _ in range(_MAX_SYMLINK_FOLLOWS):
+        f = files.get(name)
+        if f is None:
+            raise Error(f"\"{name}\": no such file")
+
+        body = partition(f.partition_id)[f.body_id]
+
+        if not f.metadata.flags & FileMetadataFlag.SYMLINK:
+            return body
+
+        if f.metadata.flags & FileMetadataFlag.SYMLINK_ABS:
+            name = body.decode()
+        else:
+            name = posixpath.normpath(posixpath.join(posixpath.dirname(name), body.decode()))
+
+    raise Error(f"\"{name}\": too many levels of symbolic links")
+
+
+def write_tar(
+    partition: tp.Callable[[int], tp.List[bytes]],
+    files: tp.Dict[str, tp.Dict[str, FilesPartitionsItem]],
+    f: tp.BinaryIO,
+) -> None:
+    """
+    Write files as uncompressed tar stream into f. Files are ordered by their partitions, so that partition
+    is called once for each of them, and only one is held in memory at a time.
+    """
+    entries = sorted(
+        ((prefix + fname, prefix, item) for prefix, pfiles in files.items() for fname, item in pfiles.items()),
+        key=lambda x: (x[2].partition_id, x[0]),
+    )
+    partition_id = -1
+    bodies: tp.List[bytes] = []
+
+    with tarfile.open(fileobj=f, mode="w|", format=tarfile.PAX_FORMAT) as tf:
+        for name, prefix, item in entries:
+            if item.partition_id != partition_id:
+                # the previous partition is released before the next one is decrypted
+                bodies = []
+                partition_id = item.partition_id
+                bodies = partition(partition_id)
+
+            body = bodies[item.body_id]
+            info = tarfile.TarInfo(name)
+            seconds, ns = divmod(item.metadata.mtime_ns, 1_000_000_000)
+            info.mtime = seconds
+            info.pax_headers = {"mtime": f"{seconds}.{ns:09d}"}
+
+            if item.metadata.flags & FileMetadataFlag.SYMLINK:
+                info.type = tarfile.SYMTYPE
+                info.linkname = body.decode()
+
+                if item.metadata.flags & FileMetadataFlag.SYMLINK_ABS:
+                    # absolute symlinks are written out as pointing into dest, which tar stream knows nothing about
+                    info.linkname = posixpath.relpath(prefix + info.linkname, posixpath.dirname(name))
+
+                tf.addfile(info)
+            else:
+                info.size = len(body)
+                tf.addfile(info, io.BytesIO(body))
+
+
+def _disk_signature(path: pathlib.Path) -> tp.Optional[tp.List[tp.Any]]:
+    try:
+        st = path.lstat()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+    if stat.S_ISLNK(st.st_mode):
+        return ["l", os.readlink(path)]
+
+    if stat.S_ISREG(st.st_mode):
+        return ["f", st.st_size, st.st_mtime_ns]
+
+    return None
+
+
+def _make_parent_dirs(dest: pathlib.Path, components: tp.List[str]) -> None:
+    path = dest
+
+    for i in components[:-1]:
+        path = path / i
+        if path.is_symlink() or (path.exists() and not path.is_dir()):
+            path.unlink()
+
+    path.mkdir(parents=True, exist_ok=True)
+
+
+def _replace_path(tmp_path: pathlib.Path, path: pathlib.Path) -> None:
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+
+    os.replace(tmp_path, path)
+
+
+def _load_sync_state(state_path: pathlib.Path) -> tp.Dict[str, tp.Any]:
+    try:
+        result = json.loads(state_path.read_text())
+        if isinstance(result, dict) and isinstance(result.get("files"), dict):
+            return result
+    except (FileNotFoundError, ValueError):
+        pass
+
+    return {"files": {}}
+
+
+def _walk_files(dest: pathlib.Path) -> tp.Iterator[tp.Tuple[str, pathlib.Path, bool]]:
+    """
+    Yield relative names and paths of everything under dest, children first, along with whether it is a directory.
+    """
+    for root, dirnames, filenames in os.walk(dest, topdown=False):
+        rel_root = os.path.relpath(root, dest)
+
+        for i in filenames + dirnames:
+            path = pathlib.Path(root, i)
+            yield i if rel_root == "." else f"{rel_root}/{i}", path, path.is_dir() and not path.is_symlink()
+
+
+def sync_is_current(dest: pathlib.Path, state_path: pathlib.Path, tag: str) -> bool:
+    """
+    Return whether the last sync() into dest was given tag, and dest has not been changed since.
+    """
+    state = _load_sync_state(state_path)
+    files = state["files"]
+
+    if state.get("tag") != tag:
+        return False
+
+    for name, recorded in files.items():
+        if recorded[2] != _disk_signature(dest.joinpath(*name.split("/"))):
+            return False
+
+    return all(is_dir or name in files for name, _, is_dir in _walk_files(dest))
+
+
+def sync(
+    partition: tp.Callable[[int], tp.List[bytes]],
+    files: tp.Dict[str, tp.Dict[str, FilesPartitionsItem]],
+    dest: pathlib.Path,
+    state_path: pathlib.Path,
+    reserve: tp.Optional[tp.Callable[[int], None]] = None,
+    tag: tp.Optional[str] = None,
+) -> bool:
+    """
+    Make existing dest contain files as written out by writeout(), and nothing else, return whether anything
+    was changed. Changed files are replaced atomically, ones with the same contents only get their mtimes updated.
+
+    state_path keeps metadata of files as of the last sync along with signatures of what was written on disk,
+    and tag, if given, for sync_is_current(). Files with both unchanged are skipped without calling partition,
+    which is called once for each partition holding other files.
+    """
+    state = _load_sync_state(state_path)["files"]
+
+    entries = {prefix + fname: (prefix, item) for prefix, pfiles in files.items() for fname, item in pfiles.items()}
+    new_state: tp.Dict[str, tp.Any] = {}
+    todo = []
+    changed = False
+
+    for name, (prefix, item) in entries.items():
+        path = dest.joinpath(*name.split("/"))
+        recorded = state.get(name)
+
+        if recorded is not None and recorded[:2] == [item.metadata.mtime_ns, item.metadata.flags] \
+                and recorded[2] == _disk_signature(path):
+            new_state[name] = recorded
+        else:
+            todo.append((name, prefix, item, path))
+
+    partition_id = -1
+    bodies: tp.List[bytes] = []
+
+    for name, prefix, item, path in sorted(todo, key=lambda x: (x[2].partition_id, x[0])):
+        if item.partition_id != partition_id:
+            # the previous partition is released before the next one is decrypted
+            bodies = []
+            partition_id = item.partition_id
+            bodies = partition(partition_id)
+
+        body = bodies[item.body_id]
+        signature = _disk_signature(path)
+        _make_parent_dirs(dest, name.split("/"))
+        tmp_path = path.with_name(f".{path.name}.wcb-tmp")
+
+        try:
+            # left over by an interrupted sync
+            tmp_path.unlink()
+        except FileNotFoundError:
+            pass
+
+        if item.metadata.flags & FileMetadataFlag.SYMLINK:
+            target = body.decode()
+            if item.metadata.flags & FileMetadataFlag.SYMLINK_ABS:
+                target = str(dest / (prefix + target))
+
+            if signature != ["l", target]:
+                tmp_path.symlink_to(target)
+                _replace_path(tmp_path, path)
+                changed = True
+        else:
+            if signature is None or signature[0] != "f" or signature[1] != len(body) or path.read_bytes() != body:
+                if reserve is not None:
+                    reserve(len(body))
+
+                tmp_path.write_bytes(body)
+                os.utime(tmp_path, ns=(item.metadata.mtime_ns, item.metadata.mtime_ns))
+                _replace_path(tmp_path, path)
+                changed = True
+            elif signature[2] != item.metadata.mtime_ns:
+                os.utime(path, ns=(item.metadata.mtime_ns, item.metadata.mtime_ns))
+                changed = True
+
+        new_state[name] = [item.metadata.mtime_ns, item.metadata.flags, _disk_signature(path)]
+
+    wanted_dirs = {"/".join(name.split("/")[:i]) for name in entries for i in range(1, name.count("/") + 1)}
+
+    for rel, path, is_dir in _walk_files(dest):
+        if not is_dir:
+            if rel not in entries:
+                path.unlink()
+                changed = True
+        elif rel not in wanted_dirs:
+            path.rmdir()
+
+    tmp_state_path = state_path.with_name(state_path.name + ".tmp")
+    tmp_state_path.write_text(json.dumps({"files": new_state, "tag": tag}))
+    os.replace(tmp_state_path, state_path)
+
+    return changed
+
+
+def sync_tenant_blob(
+    blob: bytes,
+    dest: pathlib.Path,
+    *,
+    key_id: int,
+    tenant_key: bytes,
+    state_path: pathlib.Path,
+    reserve: tp.Optional[tp.Callable[[int], None]] = None,
+) -> bool:
+    """
+    Same as CryptoBlob.sync_tenant() of blob, but with only its header parsed if it carries tenants digests,
+    and tenant's entry is the same as on the last sync.
+    """
+    digests = read_tenants_digests(blob)
+
+    if digests is not None and key_id in digests and sync_is_current(dest, state_path, digests[key_id].hex()):
+        return False
+
+    cb = CryptoBlob()
+    cb.load_from_blob(blob)
+    return cb.sync_tenant(dest, key_id=key_id, tenant_key=tenant_key, state_path=state_path, reserve=reserve)
+
+
+def read_tenants_digests(blob: bytes) -> tp.Optional[tp.Dict[int, bytes]]:
+    """
+    Return tenants digests, as of CryptoBlob.tenant_digest(), by key ids, parsing only the header of blob,
+    which may be given truncated after it. Return None for blobs of versions without such header.
+    """
+    with io.BytesIO(blob) as f:
+        version = check_blob_version(fastavro.schemaless_reader(f, schemas()["blob_header"]))
+        if version == 1:
+            return None
+
+        return {int(k): v for k, v in fastavro.schemaless_reader(f, schema("tenants_digests", version)).items()}
+
+
 @dataclass
 class TenantKeys:
     tenant_name: str
@@ -461,15 +792,12 @@ class TenantKeys:
 
     @staticmethod
     def from_data(data: tp.Any, version: int) -> "TenantKeys":
-        if version == 1:
-            return TenantKeys(
-                tenant_name=data["tenant_name"],
-                key_id=data["key_id"],
-                writer_key=data["writer_key"],
-                reader_key=data["reader_key"],
-            )
-
-        assert 0
+        return TenantKeys(
+            tenant_name=data["tenant_name"],
+            key_id=data["key_id"],
+            writer_key=data["writer_key"],
+            reader_key=data["reader_key"],
+        )
 
 
 class CryptoBlob:
@@ -486,21 +814,25 @@ class CryptoBlob:
         self.xmaster = b""
         self.xtenants = {}
 
+    def tenant_digest(self, key_id: int) -> bytes:
+        """
+        Return digest of tenant's entry, which is only changed when files in tenant's view may have changed.
+        """
+        return hashlib.sha256(self.xtenants[key_id]).digest()
+
     def load_from_blob(self, blob: bytes) -> None:
         with io.BytesIO(blob) as f:
-            self.version = fastavro.schemaless_reader(f, schemas()["blob_header"])
+            self.version = check_blob_version(fastavro.schemaless_reader(f, schemas()["blob_header"]))
             data = fastavro.schemaless_reader(f, schema("blob", self.version))
 
-        if self.version == 1:
-            self.max_id = data["max_id"]
-            self.xmaster = data["master"]
-            self.xpartitions = data["partitions"]
-            self.xtenants = {int(k): v for k, v in data["tenants"].items()}
-        else:
-            assert 0
+        self.max_id = data["max_id"]
+        self.xmaster = data["master"]
+        self.xpartitions = data["partitions"]
+        self.xtenants = {int(k): v for k, v in data["tenants"].items()}
 
     def dump_to_blob(self) -> bytes:
         data = {
+            "tenants_digests": {str(k): self.tenant_digest(k) for k in self.xtenants},
             "max_id": self.max_id,
             "master": self.xmaster,
             "partitions": self.xpartitions,
@@ -509,6 +841,9 @@ class CryptoBlob:
 
         with io.BytesIO() as f:
             fastavro.schemaless_writer(f, schemas()["blob_header"], self.version)
+            if self.version == 1:
+                del data["tenants_digests"]
+
             fastavro.schemaless_writer(f, schema("blob", self.version), data)
             return f.getvalue()
 
@@ -518,8 +853,12 @@ class CryptoBlob:
         *,
         master_key: bytes,
         existing_tenants_keys: tp.Iterable[TenantKeys],
+        version: int = BLOB_VERSION,
     ) -> None:
-        self.version = 1
+        """
+        Encrypt files from src anew, in blob of given version, or of the version of loaded blob if it is newer.
+        """
+        self.version = max(self.version, check_blob_version(version))
 
         collection = collect_files(src)
         partitioned = partition_files(collection)
@@ -565,23 +904,156 @@ class CryptoBlob:
         )
 
         self.xtenants = {
-            tenants_keys_by_names[tenant_name].key_id: asymm_encrypt(
-                compressed_avro_dump(
-                    {
-                        "partition_keys": [
-                            partition_key if partition_i in partitioned.used_partitions[tenant_name] else b""
-                            for partition_i, partition_key in enumerate(partition_keys)
-                        ],
-                        "files": tenant_files_data,
-                    },
-                    schema_name="tenant",
-                    schema_version=self.version,
-                ),
-                tenants_keys_by_names[tenant_name].writer_key,
+            tenants_keys_by_names[tenant_name].key_id: self._seal_tenant(
+                tenants_keys_by_names[tenant_name],
+                files_data=tenant_files_data,
+                partition_keys=partition_keys,
+                used_partitions=partitioned.used_partitions[tenant_name],
             )
             for tenant_name, tenant_files_data in files_data.items() if tenant_name
         }
 
+    def _seal_tenant(
+        self,
+        tenant_keys: TenantKeys,
+        *,
+        files_data: tp.Any,
+        partition_keys: tp.List[bytes],
+        used_partitions: tp.Collection[int],
+    ) -> bytes:
+        return asymm_encrypt(
+            compressed_avro_dump(
+                {
+                    "partition_keys": [
+                        partition_key if partition_i in used_partitions else b""
+                        for partition_i, partition_key in enumerate(partition_keys)
+                    ],
+                    "files": files_data,
+                },
+                schema_name="tenant",
+                schema_version=self.version,
+            ),
+            tenant_keys.writer_key,
+        )
+
+    def patch(
+        self,
+        *,
+        master_key: bytes,
+        master_data: tp.Any,
+        remove: tp.Callable[[str], bool],
+        add: FilesCollection,
+        version: int = BLOB_VERSION,
+    ) -> None:
+        """
+        Remove files, full names of which are matched by remove, and add the ones from add, which replace
+        existing files with the same names. master_data is the result of unseal_master(), or None for a new blob.
+
+        Only partitions with added files and entries of tenants with added or removed files are encrypted anew,
+        others are carried over as is, keeping their positions. Partitions no longer in use are emptied,
+        and their positions are reused for new ones. Blob is written in given version, or in its own if it is newer.
+        """
+        if master_data is None:
+            master_data = {"partition_keys": [], "files": {}, "tenants_keys": []}
+
+        # carried over encrypted data is the same in all versions
+        self.version = max(self.version, check_blob_version(version))
+
+        partitioned = partition_files(add)
+        added_names = {full_file_name(k, i) for k, v in partitioned.files.items() for i in v}
+        affected_tenants = set(partitioned.files)
+        files: tp.Dict[str, tp.Dict[str, FilesPartitionsItem]] = {}
+
+        for k, v in master_data["files"].items():
+            for name, item_data in v.items():
+                full_name = full_file_name(k, name)
+
+                if full_name in added_names or remove(full_name):
+                    affected_tenants.add(k)
+                else:
+                    files.setdefault(k, {})[name] = FilesPartitionsItem.from_data(item_data, self.version)
+
+        # emptied partitions have empty keys
+        partition_keys = list(master_data["partition_keys"])
+        kept_partitions = {i.partition_id for v in files.values() for i in v.values()}
+        free_partitions = [i for i in range(len(partition_keys)) if i not in kept_partitions]
+
+        for i in free_partitions:
+            partition_keys[i] = b""
+            self.xpartitions[i] = b""
+
+        new_partition_ids: tp.List[int] = []
+
+        for partition in partitioned.partitions:
+            if free_partitions:
+                partition_id = free_partitions.pop(0)
+            else:
+                partition_id = len(partition_keys)
+                partition_keys.append(b"")
+                self.xpartitions.append(b"")
+
+            partition_keys[partition_id] = new_key()
+            self.xpartitions[partition_id] = encrypt(
+                compressed_avro_dump(partition, schema_name="partition", schema_version=self.version),
+                partition_keys[partition_id],
+            )
+            new_partition_ids.append(partition_id)
+
+        while partition_keys and not partition_keys[-1]:
+            partition_keys.pop()
+            self.xpartitions.pop()
+
+        for k, v in partitioned.files.items():
+            for name, item in v.items():
+                files.setdefault(k, {})[name] = replace(item, partition_id=new_partition_ids[item.partition_id])
+
+        tenants_keys_by_names = {i.tenant_name: i for i in self.get_tenants_keys(master_data)}
+
+        # as with collect(), tenants left without files are forgotten
+        for tenant_name, tenant_keys in list(tenants_keys_by_names.items()):
+            if tenant_name not in files:
+                del tenants_keys_by_names[tenant_name]
+                self.xtenants.pop(tenant_keys.key_id, None)
+
+        files_data = {
+            k: {k2: v2.to_data() for k2, v2 in v.items()}
+            for k, v in files.items()
+        }
+
+        for tenant_name in sorted(affected_tenants):
+            if not tenant_name or tenant_name not in files:
+                continue
+
+            if tenant_name not in tenants_keys_by_names:
+                self.max_id += 1
+                writer_key, reader_key = asymm_new_keypair()
+                tenants_keys_by_names[tenant_name] = TenantKeys(
+                    tenant_name=tenant_name,
+                    key_id=self.max_id,
+                    writer_key=writer_key,
+                    reader_key=reader_key,
+                )
+
+            self.xtenants[tenants_keys_by_names[tenant_name].key_id] = self._seal_tenant(
+                tenants_keys_by_names[tenant_name],
+                files_data=files_data[tenant_name],
+                partition_keys=partition_keys,
+                used_partitions={i.partition_id for i in files[tenant_name].values()},
+            )
+
+        self.xmaster = encrypt(
+            compressed_avro_dump(
+                {
+                    "partition_keys": partition_keys,
+                    "files": files_data,
+                    "tenants_keys": [tenants_keys_by_names[i].to_data() for i in files if i],
+                },
+                schema_name="master",
+                schema_version=self.version,
+            ),
+            master_key,
+        )
+
     def unseal_master(self, master_key: bytes) -> tp.Any:
         return compressed_avro_load(
             decrypt(self.xmaster, master_key),
@@ -589,38 +1061,91 @@ class CryptoBlob:
             schema_version=self.version,
         )
 
+    def _partition_loader(self, partition_keys: tp.List[bytes]) -> tp.Callable[[int], tp.List[bytes]]:
+        def load(partition_id: int) -> tp.List[bytes]:
+            return tp.cast(tp.List[bytes], compressed_avro_load(
+                decrypt(self.xpartitions[partition_id], partition_keys[partition_id]),
+                schema_name="partition",
+                schema_version=self.version,
+            ))
+
+        return load
+
+    def read_master_file(self, master_data: tp.Any, name: str) -> bytes:
+        """
+        Return body of file with given full name, e.g. 'master/a', decrypting only the partition holding it.
+        """
+        for k, v in master_data["files"].items():
+            prefix = full_file_name(k, "")
+
+            if name.startswith(prefix) and name[len(prefix):] in v:
+                return read_file(
+                    {k2: FilesPartitionsItem.from_data(v2, self.version) for k2, v2 in v.items()},
+                    name[len(prefix):],
+                    functools.lru_cache()(self._partition_loader(master_data["partition_keys"])),
+                )
+
+        raise Error(f"\"{name}\": no such file")
+
+    def _unseal_tenant(self, key_id: int, tenant_key: bytes) -> tp.Any:
+        if key_id not in self.xtenants:
+            raise Error(f"unknown key id {key_id}")
+
+        tenant_data = compressed_avro_load(
+            asymm_decrypt(self.xtenants[key_id], tenant_key),
+            schema_name="tenant",
+            schema_version=self.version,
+        )
+
+        return tenant_data
+
+    def read_tenant_file(self, name: str, *, key_id: int, tenant_key: bytes) -> bytes:
+        """
+        Return body of file with given name, as written out by writeout_tenant(), decrypting only the partition
+        holding it.
+        """
+        tenant_data = self._unseal_tenant(key_id, tenant_key)
+
+        return read_file(
+            {k: FilesPartitionsItem.from_data(v, self.version) for k, v in tenant_data["files"].items()},
+            name,
+            functools.lru_cache()(self._partition_loader(tenant_data["partition_keys"])),
+        )
+
     def writeout_master(
         self,
         master_data: tp.Any,
         dest: pathlib.Path,
+        reserve: tp.Optional[tp.Callable[[int], None]] = None,
+        select: tp.Optional[tp.Callable[[str], bool]] = None,
     ) -> None:
-        partitions = [
-            compressed_avro_load(
-                decrypt(partition_data, partition_key),
+        """
+        Write out files, or only the ones full names of which are matched by select, decrypting only partitions
+        holding them.
+        """
+        files = {
+            full_file_name(k, ""): {
+                k2: FilesPartitionsItem.from_data(v2, self.version)
+                for k2, v2 in v.items() if select is None or select(full_file_name(k, k2))
+            }
+            for k, v in master_data["files"].items()
+        }
+        partitions = {
+            i: compressed_avro_load(
+                decrypt(self.xpartitions[i], master_data["partition_keys"][i]),
                 schema_name="partition",
                 schema_version=self.version,
             )
-            for partition_key, partition_data in zip(master_data["partition_keys"], self.xpartitions)
-        ]
-        if self.version == 1:
-            files = {
-                (f"tenants/{k}/" if k else "master/"): {
-                    k2: FilesPartitionsItem.from_data(v2, self.version)
-                    for k2, v2 in v.items()
-                }
-                for k, v in master_data["files"].items()
-            }
+            for i in sorted({f.partition_id for pfiles in files.values() for f in pfiles.values()})
+        }
 
-            writeout(partitions, files, dest)
+        writeout(partitions, files, dest, reserve)
 
     def get_tenants_keys(
         self,
         master_data: tp.Any,
     ) -> tp.List[TenantKeys]:
-        if self.version == 1:
-            return [TenantKeys.from_data(i, 1) for i in master_data["tenants_keys"]]
-        else:
-            assert 0
+        return [TenantKeys.from_data(i, self.version) for i in master_data["tenants_keys"]]
 
     def writeout_tenant(
         self,
@@ -628,12 +1153,9 @@ class CryptoBlob:
         *,
         key_id: int,
         tenant_key: bytes,
+        reserve: tp.Optional[tp.Callable[[int], None]] = None,
     ) -> None:
-        tenant_data = compressed_avro_load(
-            asymm_decrypt(self.xtenants[key_id], tenant_key),
-            schema_name="tenant",
-            schema_version=self.version,
-        )
+        tenant_data = self._unseal_tenant(key_id, tenant_key)
         partitions = [
             compressed_avro_load(
                 decrypt(partition_data, partition_key),
@@ -642,12 +1164,81 @@ class CryptoBlob:
             ) if partition_key else []
             for partition_key, partition_data in zip(tenant_data["partition_keys"], self.xpartitions)
         ]
-        if self.version == 1:
-            files = {
-                '': {
-                    k: FilesPartitionsItem.from_data(v, self.version)
-                    for k, v in tenant_data["files"].items()
-                },
+        files = {
+            '': {
+                k: FilesPartitionsItem.from_data(v, self.version)
+                for k, v in tenant_data["files"].items()
+            },
+        }
+
+        writeout(partitions, files, dest, reserve)
+
+    def sync_tenant(
+        self,
+        dest: pathlib.Path,
+        *,
+        key_id: int,
+        tenant_key: bytes,
+        state_path: pathlib.Path,
+        reserve: tp.Optional[tp.Callable[[int], None]] = None,
+    ) -> bool:
+        """
+        Incremental version of writeout_tenant() into existing dest, see sync(). Nothing is decrypted if tenant's
+        entry is the same as on the last sync, and dest has not been changed since.
+        """
+        if key_id not in self.xtenants:
+            raise Error(f"unknown key id {key_id}")
+
+        tag = self.tenant_digest(key_id).hex()
+        if sync_is_current(dest, state_path, tag):
+            return False
+
+        tenant_data = self._unseal_tenant(key_id, tenant_key)
+        files = {
+            "": {
+                k: FilesPartitionsItem.from_data(v, self.version)
+                for k, v in tenant_data["files"].items()
+            },
+        }
+
+        return sync(self._partition_loader(tenant_data["partition_keys"]), files, dest, state_path, reserve, tag)
+
+    def write_master_tar(
+        self,
+        master_data: tp.Any,
+        f: tp.BinaryIO,
+        select: tp.Optional[tp.Callable[[str], bool]] = None,
+    ) -> None:
+        """
+        Write files, or only the ones full names of which are matched by select, as tar stream into f.
+        """
+        files = {
+            full_file_name(k, ""): {
+                k2: FilesPartitionsItem.from_data(v2, self.version)
+                for k2, v2 in v.items() if select is None or select(full_file_name(k, k2))
             }
+            for k, v in master_data["files"].items()
+        }
+
+        write_tar(self._partition_loader(master_data["partition_keys"]), files, f)
+
+    def write_tenant_tar(
+        self,
+        f: tp.BinaryIO,
+        *,
+        key_id: int,
+        tenant_key: bytes,
+        select: tp.Optional[tp.Callable[[str], bool]] = None,
+    ) -> None:
+        """
+        Write files as written out by writeout_tenant(), or only the ones matched by select, as tar stream into f.
+        """
+        tenant_data = self._unseal_tenant(key_id, tenant_key)
+        files = {
+            "": {
+                k: FilesPartitionsItem.from_data(v, self.version)
+                for k, v in tenant_data["files"].items() if select is None or select(k)
+            },
+        }
 
-            writeout(partitions, files, dest)
+        write_tar(self._partition_loader(tenant_data["partition_keys"]), files, f)
@@ -0,0 +1,142 @@
+import contextlib
+import pathlib
+import threading
+import typing as tp
+from dataclasses import dataclass
+
+import click
+
+from . import backend_intf
+from . import backends
+from ._log import logger
+
+# options of lock locators handled by modify_with_locks() rather than by lock backends
+LOCK_OPTIONS = ("prefix", "timeout")
+
+
+@dataclass
+class Locator:
+    backend: str
+    opts: backend_intf.Options
+    loc: str
+
+
+def short_locator_descr(loc: Locator) -> str:
+    for delim in ":~!@#$%^&*()_-+=[{}]\\|;'\"<>,.?/":
+        if delim not in loc.backend and delim not in loc.loc:
+            return f"{delim}{loc.backend}{delim}{loc.loc}"
+
+    return f"{loc.backend} {loc.loc}"
+
+
+def acquire_lock(
+    es: contextlib.ExitStack,
+    lock_backend: backend_intf.ILockBackend,
+    lock: Locator,
+    *,
+    first_timeout: float,
+    timeout_step: float,
+    shared: bool,
+) -> tp.Optional[backend_intf.IDigestStore]:
+    """
+    Acquire lock, with its prefix already applied, until es is closed. Return digest store it carries, if any.
+    """
+    total_timeout = float(lock.opts.get("timeout") or "0")
+    lock_descr = short_locator_descr(lock)
+
+    def report(remaining: float) -> None:
+        logger.info(lambda: f"waiting for lock {lock_descr}, deadline in {remaining:1.0f}s")
+
+    try:
+        return es.enter_context(
+            lock_backend.make_lock(
+                loc=lock.loc,
+                opts=lock.opts,
+                wait=backend_intf.LockWait(
+                    timeout=total_timeout,
+                    first_report=first_timeout,
+                    report_period=timeout_step,
+                    report=report,
+                ),
+                shared=shared,
+            ),
+        )
+    except backend_intf.TimeoutError:
+        raise click.ClickException(f"timed out waiting for {lock_descr}")
+    except backend_intf.BackendError as e:
+        raise click.ClickException(f"{lock_descr}: {e}")
+
+
+def modify_with_locks(
+    *,
+    storage: Locator,
+    locks: tp.Iterable[Locator],
+    modifier: tp.Union[backend_intf.StorageModifier, backend_intf.StorageFileModifier],
+    first_timeout: float,
+    timeout_step: float,
+    shared: bool = False,
+    prefetch: bool = False,
+    path: tp.Optional[pathlib.Path] = None,
+) -> None:
+    """
+    Acquire locks and call modify() of storage backend.
+    With shared=True locks are acquired in shared mode, and modifier must return blob unchanged.
+    With prefetch=True the blob is downloaded while waiting for locks.
+    With path, modify_file() is called instead, and modifier is a StorageFileModifier.
+    """
+    try:
+        storage_backend = backends.storage_backend(storage.backend)
+        lock_backends = [backends.lock_backend(lock.backend) for lock in locks]
+    except backend_intf.BackendError as e:
+        raise click.ClickException(str(e))
+
+    digest_store: tp.Optional[backend_intf.IDigestStore] = None
+    prefetch_thread: tp.Optional[threading.Thread] = None
+
+    if prefetch:
+        prefetch_thread = threading.Thread(
+            target=storage_backend.prefetch,
+            kwargs=dict(loc=storage.loc, opts=storage.opts),
+            daemon=True,
+        )
+        prefetch_thread.start()
+
+    with contextlib.ExitStack() as es:
+        for lock_backend, lock in zip(lock_backends, locks):
+            lock.loc = (lock.opts.get("prefix") or "") + (lock.loc or storage.loc)
+            lock_digest_store = acquire_lock(
+                es,
+                lock_backend,
+                lock,
+                first_timeout=first_timeout,
+                timeout_step=timeout_step,
+                shared=shared,
+            )
+
+            if lock_digest_store is not None:
+                if digest_store is not None:
+                    raise click.ClickException(f"{short_locator_descr(lock)}: only one lock may carry blob digest")
+
+                digest_store = lock_digest_store
+
+        if prefetch_thread is not None:
+            prefetch_thread.join()
+
+        try:
+            if path is None:
+                storage_backend.modify(
+                    loc=storage.loc,
+                    opts=storage.opts,
+                    modifier=tp.cast(backend_intf.StorageModifier, modifier),
+                    digest_store=digest_store,
+                )
+            else:
+                storage_backend.modify_file(
+                    loc=storage.loc,
+                    path=path,
+                    opts=storage.opts,
+                    modifier=tp.cast(backend_intf.StorageFileModifier, modifier),
+                    digest_store=digest_store,
+                )
+        except backend_intf.BackendError as e:
+            raise click.ClickException(f"{short_locator_descr(storage)}: {e}")
@@ -1,9 +1,39 @@
+import pathlib
+import time
 import typing as tp
 
 import implements
 
 
 StorageModifier = tp.Callable[[tp.Optional[bytes]], tp.Optional[bytes]]
+# called with a path holding current contents of the blob, if it exists, and expected to leave new contents
+# at the same path, or to remove it to delete the blob
+StorageFileModifier = tp.Callable[[pathlib.Path], None]
+
+GLOB_CHARS = "*?["
+
+
+def is_glob(loc: str) -> bool:
+    return any(i in loc for i in GLOB_CHARS)
+
+
+def glob_prefix(loc: str) -> str:
+    """
+    Return part of glob pattern preceding the first wildcard.
+    """
+    return loc[:min((loc.index(i) for i in GLOB_CHARS if i in loc), default=len(loc))]
+
+
+def file_signature(path: pathlib.Path) -> tp.Optional[tp.Tuple[int, int, int]]:
+    """
+    Return a value which changes whenever file at path is replaced or written to, or None if it does not exist.
+    """
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+
+    return st.st_ino, st.st_size, st.st_mtime_ns
 
 
 class BackendError(RuntimeError):
@@ -42,12 +72,75 @@ class Options:
 
         return d
 
+    def mark_used(self, keys: tp.Iterable[str]) -> None:
+        """
+        Accept keys without reading them, e.g. ones used by other operations of the same backend.
+        """
+        self._used.update(keys)
+
+    def as_dict(self) -> tp.Dict[str, str]:
+        """
+        Return all options, without marking them as used.
+        """
+        return dict(self._opts)
+
     def fail_on_unused(self) -> None:
         unused = [f"{k}={v}" for k, v in sorted(self._opts.items()) if k not in self._used]
         if unused:
             raise UnsupportedOptionsError(f"unsupported options passed: {', '.join(unused)}")
 
 
+class LockWait:
+    """
+    Deadline of a lock acquisition, with periodic reports about waiting for it.
+
+    Lock backends are expected to call step() each time an attempt to acquire the lock fails,
+    and then block for at most the returned number of seconds before trying again.
+    """
+
+    def __init__(
+        self,
+        *,
+        timeout: float,
+        first_report: float,
+        report_period: float,
+        report: tp.Callable[[float], None],
+    ) -> None:
+        now = time.monotonic()
+        self._deadline = now + timeout
+        self._next_report = now + first_report
+        self._report_period = report_period
+        self._report = report
+
+    def step(self) -> float:
+        """
+        Report waiting if due, and return time until the next report or the deadline.
+        Raise TimeoutError if the deadline has passed.
+        """
+        now = time.monotonic()
+
+        if now >= self._deadline:
+            raise TimeoutError()
+
+        if now >= self._next_report:
+            self._report(self._deadline - now)
+            self._next_report = max(self._next_report + self._report_period, now)
+
+        return min(self._deadline, self._next_report) - now
+
+
+class IDigestStore(implements.Interface):
+    def get(self) -> tp.Optional[bytes]:
+        """
+        Return digest of the current blob contents, or None if it is unknown or expired.
+        """
+
+    def put(self, digest: bytes, *, ttl: int) -> None:
+        """
+        Record digest of the new blob contents, valid for ttl seconds.
+        """
+
+
 class IStorageBackend(implements.Interface):
     @staticmethod
     def modify(
@@ -55,8 +148,47 @@ class IStorageBackend(implements.Interface):
         loc: str,
         modifier: StorageModifier,
         opts: Options,
+        digest_store: tp.Optional[IDigestStore] = None,
+    ) -> None:
+        """
+        """
+
+    @staticmethod
+    def modify_file(
+        *,
+        loc: str,
+        path: pathlib.Path,
+        modifier: StorageFileModifier,
+        opts: Options,
+        digest_store: tp.Optional[IDigestStore] = None,
+    ) -> None:
+        """
+        Same as modify(), but with contents of the blob passed through a file at path, which must not exist,
+        so that they need not be held in memory. The file may be moved or removed by the backend afterwards.
+        """
+
+    @staticmethod
+    def store(
+        *,
+        loc: str,
+        data: tp.Optional[bytes],
+        opts: Options,
+    ) -> None:
+        """
+        Write data to loc, or delete the blob there if data is None, without reading it first or keeping
+        its digest. Meant for immutable objects under unique locations, which are never modified.
+        """
+
+    @staticmethod
+    def prefetch(
+        *,
+        loc: str,
+        opts: Options,
     ) -> None:
         """
+        Speculatively download the blob for a subsequent modify() in this process, which will then only
+        revalidate it. Called while locks are being acquired, so must not have any effects visible
+        to other processes. Errors are ignored.
         """
 
     @staticmethod
@@ -68,6 +200,48 @@ class IStorageBackend(implements.Interface):
         """
         """
 
+    @staticmethod
+    def load_file(
+        *,
+        loc: str,
+        path: pathlib.Path,
+        opts: Options,
+    ) -> None:
+        """
+        Same as load(), but storing the blob into a file at path, so that it need not be held in memory.
+        """
+
+    @staticmethod
+    def glob(
+        *,
+        loc: str,
+        opts: Options,
+    ) -> tp.List[str]:
+        """
+        Return locations of existing blobs matching loc, which is a pattern as understood by fnmatch,
+        i.e. "*" matches "/" as well.
+        """
+
+    @staticmethod
+    def load_consistent(
+        *,
+        locs: tp.Sequence[tp.Tuple[str, Options]],
+    ) -> tp.List[tp.Union[bytes, BackendError]]:
+        """
+        Load blobs without taking locks, making sure the data is not older than the last completed modify().
+        Return data or error for each of locs. Backends should batch auxiliary lookups for all locs.
+        """
+
+    @staticmethod
+    def provision(
+        *,
+        loc: str,
+        opts: Options,
+    ) -> None:
+        """
+        Create auxiliary resources used by modify() and load(), so that these make only data plane calls.
+        """
+
 
 class ILockBackend(implements.Interface):
     @staticmethod
@@ -75,7 +249,22 @@ class ILockBackend(implements.Interface):
         *,
         loc: str,
         opts: Options,
-        timeout: float,
-    ) -> tp.ContextManager[None]:
+        wait: LockWait,
+        shared: bool = False,
+    ) -> tp.ContextManager[tp.Optional[IDigestStore]]:
+        """
+        Return a context manager which acquires the lock on entering, raising TimeoutError if
+        this is not possible until the deadline of wait.
+        Shared lock may be held by any number of owners at once, but never together with an exclusive one.
+        Shared lock holders must not modify the protected resource.
+        """
+
+    @staticmethod
+    def provision(
+        *,
+        loc: str,
+        opts: Options,
+    ) -> None:
         """
+        Create auxiliary resources used by make_lock(), so that it makes only data plane calls.
         """
@@ -4,6 +4,9 @@ import typing as _tp
 import pkg_resources as _pkg_resources
 import with_cloud_blob.backend_intf as intf
 
+from ._compression import compressing as _compressing
+from ._delta_log import delta_logging as _delta_logging
+
 
 @_functools.lru_cache()
 def _backends() -> _tp.Dict[str, _tp.Dict[str, _tp.Callable[[], _tp.Any]]]:
@@ -26,10 +29,13 @@ def list_backends() -> _tp.Dict[str, _tp.List[str]]:
 @_functools.lru_cache()
 def storage_backend(name: str) -> intf.IStorageBackend:
     try:
-        return _tp.cast(intf.IStorageBackend, _backends()["storage"][name]())
+        backend = _tp.cast(intf.IStorageBackend, _backends()["storage"][name]())
     except KeyError:
         raise intf.BackendError(f"unknown storage backend: {name}")
 
+    # deltas are computed before compression, which is applied to base snapshots and deltas alike
+    return _delta_logging(_compressing(backend))
+
 
 @_functools.lru_cache()
 def lock_backend(name: str) -> intf.ILockBackend:
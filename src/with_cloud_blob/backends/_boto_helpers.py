@@ -1,8 +1,40 @@
+import pathlib as _pathlib
+import threading as _threading
+import time as _time
 import typing as _tp
 
 import boto3 as _boto3
 import with_cloud_blob.backend_intf as _intf
 
+from .._cache import cache_dir
+from .._log import logger
+
+_known_dynamodb_tables: _tp.Optional[_tp.Set[str]] = None
+# sessions and resources by their arguments, kept per thread, as they are not thread-safe
+_pool: _tp.Optional[_threading.local] = None
+
+
+def enable_pooling() -> None:
+    """
+    Make sessions and resources reused by later calls with the same arguments in the same thread, keeping
+    their connections open. Meant for long-running processes, which make their calls from long-lived threads.
+    """
+    global _pool
+    _pool = _threading.local()
+
+
+def _pooled(key: _tp.Tuple[_tp.Any, ...], factory: _tp.Callable[[], _tp.Any]) -> _tp.Any:
+    if _pool is None:
+        return factory()
+
+    entries = _pool.__dict__.setdefault("entries", {})
+    result = entries.get(key)
+
+    if result is None:
+        result = entries[key] = factory()
+
+    return result
+
 
 def boto_session(
     opts: _intf.Options,
@@ -10,7 +42,7 @@ def boto_session(
     kw = opts.mapped_update({
         "profile": "profile_name",
     })
-    return _boto3.Session(**kw)
+    return _pooled(("session",) + tuple(sorted(kw.items())), lambda: _boto3.Session(**kw))
 
 
 def boto_resource_s3(
@@ -21,7 +53,7 @@ def boto_resource_s3(
         "region": "region_name",
         "endpoint": "endpoint_url",
     })
-    return session.resource("s3", **kw)
+    return _pooled(("s3", id(session)) + tuple(sorted(kw.items())), lambda: session.resource("s3", **kw))
 
 
 def boto_resource_dynamodb(
@@ -32,4 +64,113 @@ def boto_resource_dynamodb(
         "region": "region_name",
         "dynamodb_endpoint": "endpoint_url",
     })
-    return session.resource("dynamodb", **kw)
+    return _pooled(("dynamodb", id(session)) + tuple(sorted(kw.items())), lambda: session.resource("dynamodb", **kw))
+
+
+def _wait_for_dynamodb_table_active(
+    resource: _tp.Any,
+    table_name: str,
+) -> None:
+    while True:
+        response = resource.meta.client.describe_table(TableName=table_name)
+        status = response.get("Table", {}).get("TableStatus", "UNKNOWN")
+        if status == "ACTIVE":
+            break
+        else:
+            logger.debug(lambda: f"waiting for {table_name} dynamodb table to become active")
+            _time.sleep(1)
+
+
+def _known_dynamodb_tables_path() -> _pathlib.Path:
+    return cache_dir() / "dynamodb-tables"
+
+
+def _dynamodb_table_id(resource: _tp.Any, table_name: str) -> str:
+    return f"{resource.meta.client.meta.endpoint_url} {table_name}"
+
+
+def _is_dynamodb_table_known(table_id: str) -> bool:
+    global _known_dynamodb_tables
+
+    if _known_dynamodb_tables is None:
+        try:
+            _known_dynamodb_tables = set(_known_dynamodb_tables_path().read_text().splitlines())
+        except FileNotFoundError:
+            _known_dynamodb_tables = set()
+        except OSError as e:
+            # e.g. read-only or missing home directory, which only costs a control plane call
+            logger.debug(f"reading known dynamodb tables: {e}")
+            _known_dynamodb_tables = set()
+
+    return table_id in _known_dynamodb_tables
+
+
+def _remember_dynamodb_table(table_id: str) -> None:
+    if _known_dynamodb_tables is not None:
+        _known_dynamodb_tables.add(table_id)
+
+    # single short append is atomic enough for concurrent invocations, duplicates are harmless
+    try:
+        with _known_dynamodb_tables_path().open("a") as f:
+            f.write(table_id + "\n")
+    except OSError as e:
+        logger.debug(f"remembering known dynamodb table: {e}")
+
+
+def ensure_dynamodb_table(
+    resource: _tp.Any,
+    *,
+    table_name: str,
+    keys: _tp.Mapping[str, str],
+    ttl_attribute: str,
+    force: bool = False,
+) -> _tp.Any:
+    """
+    Create dynamodb table with string keys (name -> key type) and TTL enabled, unless it already exists.
+
+    Tables known to exist are remembered in the cache directory, so that control plane calls
+    are made once per host rather than on every invocation, unless force is set.
+    """
+    table_id = _dynamodb_table_id(resource, table_name)
+
+    if not force and _is_dynamodb_table_known(table_id):
+        return resource.Table(table_name)
+
+    try:
+        resource.create_table(
+            AttributeDefinitions=[
+                {
+                    "AttributeName": name,
+                    "AttributeType": "S",
+                }
+                for name in keys
+            ],
+            KeySchema=[
+                {
+                    "AttributeName": name,
+                    "KeyType": key_type,
+                }
+                for name, key_type in keys.items()
+            ],
+            BillingMode="PAY_PER_REQUEST",
+            TableName=table_name,
+        )
+
+        _wait_for_dynamodb_table_active(resource, table_name)
+
+        resource.meta.client.update_time_to_live(
+            TableName=table_name,
+            TimeToLiveSpecification={
+                "Enabled": True,
+                "AttributeName": ttl_attribute,
+            },
+        )
+
+        _wait_for_dynamodb_table_active(resource, table_name)
+    except resource.meta.client.exceptions.ResourceInUseException:
+        # table already exists, but may still be being created by someone else
+        _wait_for_dynamodb_table_active(resource, table_name)
+
+    _remember_dynamodb_table(table_id)
+
+    return resource.Table(table_name)
@@ -0,0 +1,346 @@
+import contextlib
+import hashlib
+import lzma
+import pathlib
+import shutil
+import tempfile
+import typing as tp
+import zlib
+
+import implements
+import with_cloud_blob.backend_intf as intf
+
+# compressed blobs start with this, followed by codec name and a newline
+_MAGIC = b"\x89WCB\r\n\x1a\n"
+_MAX_CODEC_NAME_LENGTH = 16
+
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+class _Codec(tp.NamedTuple):
+    # objects with compress() and flush() methods, taking compression level
+    compressor: tp.Callable[[int], tp.Any]
+    # objects with decompress() method and eof attribute
+    decompressor: tp.Callable[[], tp.Any]
+    default_level: int
+
+
+_CODECS = {
+    "zlib": _Codec(
+        compressor=lambda level: zlib.compressobj(level),
+        decompressor=zlib.decompressobj,
+        default_level=6,
+    ),
+    "lzma": _Codec(
+        compressor=lambda level: lzma.LZMACompressor(preset=level),
+        decompressor=lzma.LZMADecompressor,
+        default_level=6,
+    ),
+}
+
+
+class _Compression(tp.NamedTuple):
+    header: bytes
+    compressor: tp.Callable[[], tp.Any]
+
+    def compress(self, data: bytes) -> bytes:
+        c = self.compressor()
+        return self.header + c.compress(data) + c.flush()
+
+    def compress_file(self, src: pathlib.Path, dst: pathlib.Path) -> None:
+        c = self.compressor()
+
+        with src.open("rb") as fin, dst.open("wb") as fout:
+            fout.write(self.header)
+
+            for chunk in iter(lambda: fin.read(_CHUNK_SIZE), b""):
+                fout.write(c.compress(chunk))
+
+            fout.write(c.flush())
+
+
+def _compression(opts: intf.Options) -> tp.Optional[_Compression]:
+    # <codec>[:<level>], e.g. zlib:9 or lzma
+    spec = opts.get("compress")
+    if not spec:
+        return None
+
+    name, _, level = spec.partition(":")
+    codec = _CODECS.get(name)
+    if codec is None:
+        raise intf.BackendError(f"unsupported compression codec: {name}")
+
+    try:
+        level_value = int(level or codec.default_level)
+    except ValueError:
+        raise intf.BackendError(f"invalid compression level: {level}")
+
+    codec_compressor = codec.compressor
+    return _Compression(
+        header=_MAGIC + name.encode() + b"\n",
+        compressor=lambda: codec_compressor(level_value),
+    )
+
+
+def _parse_header(data: bytes) -> tp.Optional[tp.Tuple[_Codec, int]]:
+    """
+    Return codec and size of the header data starts with, or None if data is not compressed with a known codec,
+    so that uncompressed data which merely happens to start with the magic is left alone.
+    """
+    if not data.startswith(_MAGIC):
+        return None
+
+    name_end = data.find(b"\n", len(_MAGIC), len(_MAGIC) + _MAX_CODEC_NAME_LENGTH + 1)
+    codec = _CODECS.get(data[len(_MAGIC):name_end].decode(errors="replace")) if name_end > 0 else None
+    if codec is None:
+        return None
+
+    return codec, name_end + 1
+
+
+def _decompressed(decompressor: tp.Any, chunks: tp.Iterable[bytes]) -> tp.Iterator[bytes]:
+    try:
+        for chunk in chunks:
+            yield decompressor.decompress(chunk)
+    except (zlib.error, lzma.LZMAError) as e:
+        raise intf.BackendError(f"decompressing blob: {e}")
+
+    if not decompressor.eof:
+        raise intf.BackendError("decompressing blob: truncated data")
+
+
+def decompress(data: bytes) -> bytes:
+    """
+    Decompress data if it has a compression header of a known codec, regardless of options,
+    return it as is otherwise.
+    """
+    header = _parse_header(data)
+    if header is None:
+        return data
+
+    codec, offset = header
+    return b"".join(_decompressed(codec.decompressor(), [data[offset:]]))
+
+
+def _file_header(path: pathlib.Path) -> tp.Optional[tp.Tuple[_Codec, int]]:
+    try:
+        with path.open("rb") as f:
+            return _parse_header(f.read(len(_MAGIC) + _MAX_CODEC_NAME_LENGTH + 1))
+    except FileNotFoundError:
+        return None
+
+
+def _decompress_file(src: pathlib.Path, dst: pathlib.Path, codec: _Codec, offset: int) -> bytes:
+    """
+    Decompress src into dst, returning digest of the decompressed contents.
+    """
+    h = hashlib.sha256()
+
+    with src.open("rb") as fin, dst.open("wb") as fout:
+        fin.seek(offset)
+
+        for chunk in _decompressed(codec.decompressor(), iter(lambda: fin.read(_CHUNK_SIZE), b"")):
+            h.update(chunk)
+            fout.write(chunk)
+
+    return h.digest()
+
+
+def _file_digest(path: pathlib.Path) -> tp.Optional[bytes]:
+    try:
+        with path.open("rb") as f:
+            h = hashlib.sha256()
+
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                h.update(chunk)
+
+            return h.digest()
+    except FileNotFoundError:
+        return None
+
+
+@contextlib.contextmanager
+def _raw_path() -> tp.Iterator[pathlib.Path]:
+    """
+    Path of a private temp file for stored contents, kept outside of the workspace, where commands can see it.
+    """
+    with tempfile.TemporaryDirectory(prefix="with-cloud-blob-raw-") as td:
+        yield pathlib.Path(td) / "raw"
+
+
+def compressing(backend: intf.IStorageBackend) -> intf.IStorageBackend:
+    """
+    Wrap storage backend, so that blobs are transparently compressed as requested by "compress" option
+    and decompressed when loaded. Digests and caches of the wrapped backend see compressed data.
+    """
+
+    @implements.implements(intf.IStorageBackend)
+    class Backend:
+        @staticmethod
+        def modify(
+            *,
+            loc: str,
+            modifier: intf.StorageModifier,
+            opts: intf.Options,
+            digest_store: tp.Optional[intf.IDigestStore] = None,
+        ) -> None:
+            compression = _compression(opts)
+
+            def raw_modifier(raw: tp.Optional[bytes]) -> tp.Optional[bytes]:
+                data = None if raw is None else decompress(raw)
+                new_data = modifier(data)
+
+                if new_data == data:
+                    # not recompressed, even if compression options have changed, to avoid a needless write
+                    return raw
+
+                if new_data is None or compression is None:
+                    return new_data
+
+                return compression.compress(new_data)
+
+            backend.modify(loc=loc, modifier=raw_modifier, opts=opts, digest_store=digest_store)
+
+        @staticmethod
+        def modify_file(
+            *,
+            loc: str,
+            path: pathlib.Path,
+            modifier: intf.StorageFileModifier,
+            opts: intf.Options,
+            digest_store: tp.Optional[intf.IDigestStore] = None,
+        ) -> None:
+            compression = _compression(opts)
+
+            def raw_modifier(path: pathlib.Path) -> None:
+                header = _file_header(path)
+
+                # stored contents are kept aside, so that they are put back if left unchanged
+                with _raw_path() as raw_path:
+                    # with coarse timestamps, a quick rewrite of the same size may keep the signature,
+                    # which is why contents are compared too, unless left to the wrapped backend
+                    digest = None
+
+                    if header is not None:
+                        shutil.move(str(path), str(raw_path))
+                        digest = _decompress_file(raw_path, path, *header)
+                    elif compression is not None:
+                        digest = _file_digest(path)
+
+                    signature = intf.file_signature(path)
+                    modifier(path)
+
+                    if intf.file_signature(path) == signature and (digest is None or _file_digest(path) == digest):
+                        if header is not None:
+                            shutil.move(str(raw_path), str(path))
+
+                        return
+
+                    if compression is not None and path.exists():
+                        shutil.move(str(path), str(raw_path))
+                        compression.compress_file(raw_path, path)
+
+            backend.modify_file(loc=loc, path=path, modifier=raw_modifier, opts=opts, digest_store=digest_store)
+
+        @staticmethod
+        def store(
+            *,
+            loc: str,
+            data: tp.Optional[bytes],
+            opts: intf.Options,
+        ) -> None:
+            compression = _compression(opts)
+
+            if data is not None and compression is not None:
+                data = compression.compress(data)
+
+            backend.store(loc=loc, data=data, opts=opts)
+
+        @staticmethod
+        def prefetch(
+            *,
+            loc: str,
+            opts: intf.Options,
+        ) -> None:
+            backend.prefetch(loc=loc, opts=opts)
+
+        @staticmethod
+        def load(
+            *,
+            loc: str,
+            opts: intf.Options,
+        ) -> bytes:
+            _compression(opts)
+            return decompress(backend.load(loc=loc, opts=opts))
+
+        @staticmethod
+        def load_file(
+            *,
+            loc: str,
+            path: pathlib.Path,
+            opts: intf.Options,
+        ) -> None:
+            _compression(opts)
+
+            with _raw_path() as raw_path:
+                backend.load_file(loc=loc, path=raw_path, opts=opts)
+
+                header = _file_header(raw_path)
+                if header is None:
+                    shutil.move(str(raw_path), str(path))
+                else:
+                    _decompress_file(raw_path, path, *header)
+
+        @staticmethod
+        def glob(
+            *,
+            loc: str,
+            opts: intf.Options,
+        ) -> tp.List[str]:
+            return backend.glob(loc=loc, opts=opts)
+
+        @staticmethod
+        def load_consistent(
+            *,
+            locs: tp.Sequence[tp.Tuple[str, intf.Options]],
+        ) -> tp.List[tp.Union[bytes, intf.BackendError]]:
+            result: tp.List[tp.Union[bytes, intf.BackendError, None]] = []
+            valid_locs = []
+
+            # bad options of one blob fail only that blob, as any other error of it would
+            for loc, opts in locs:
+                try:
+                    _compression(opts)
+                except intf.BackendError as e:
+                    result.append(e)
+                else:
+                    result.append(None)
+                    valid_locs.append((loc, opts))
+
+            loaded = iter(backend.load_consistent(locs=valid_locs) if valid_locs else [])
+
+            for n, i in enumerate(result):
+                if i is None:
+                    data = next(loaded)
+
+                    if isinstance(data, bytes):
+                        try:
+                            data = decompress(data)
+                        except intf.BackendError as e:
+                            data = e
+
+                    result[n] = data
+
+            return tp.cast(tp.List[tp.Union[bytes, intf.BackendError]], result)
+
+        @staticmethod
+        def provision(
+            *,
+            loc: str,
+            opts: intf.Options,
+        ) -> None:
+            _compression(opts)
+            backend.provision(loc=loc, opts=opts)
+
+    return tp.cast(intf.IStorageBackend, Backend)
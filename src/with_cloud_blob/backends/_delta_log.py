@@ -0,0 +1,340 @@
+import dataclasses
+import glob
+import json
+import pathlib
+import re
+import secrets
+import struct
+import typing as tp
+
+import implements
+import with_cloud_blob.backend_intf as intf
+
+# manifest, stored at blob's own location, starts with this, followed by JSON
+_MAGIC = b"\x89WCB-DLOG\n"
+_DEFAULT_MAX_DELTAS = 16
+# side objects may be removed by compaction while being read without a lock
+_LOAD_ATTEMPTS = 3
+_DELTA_HEADER = struct.Struct(">QQ")
+_SIDE_OBJECT_RE = re.compile(r"\.wcb-(base|delta)-[0-9a-f]+(-[0-9]+)?$")
+
+
+@dataclasses.dataclass
+class _Manifest:
+    gen: str
+    base_size: int
+    deltas: tp.List[int]
+
+    @staticmethod
+    def parse(raw: tp.Optional[bytes]) -> tp.Optional["_Manifest"]:
+        if raw is None or not raw.startswith(_MAGIC):
+            return None
+
+        try:
+            return _Manifest(**json.loads(raw[len(_MAGIC):]))
+        except (ValueError, TypeError) as e:
+            raise intf.BackendError(f"invalid delta log manifest: {e}")
+
+    def dump(self) -> bytes:
+        return _MAGIC + json.dumps(dataclasses.asdict(self)).encode()
+
+    def base_loc(self, loc: str) -> str:
+        return f"{loc}.wcb-base-{self.gen}"
+
+    def delta_loc(self, loc: str, index: int) -> str:
+        return f"{loc}.wcb-delta-{self.gen}-{index}"
+
+
+@dataclasses.dataclass
+class _Params:
+    # None means default: keep existing delta log, but do not start a new one
+    max_deltas: tp.Optional[int]
+    max_size: tp.Optional[int]
+
+    @staticmethod
+    def from_opts(opts: intf.Options) -> "_Params":
+        max_deltas = opts.get("delta_log")
+        max_size = opts.get("delta_log_size")
+
+        try:
+            return _Params(
+                max_deltas=None if max_deltas is None else int(max_deltas),
+                max_size=None if max_size is None else int(max_size),
+            )
+        except ValueError as e:
+            raise intf.BackendError(f"invalid delta log options: {e}")
+
+
+def _common_length(a: memoryview, b: memoryview, limit: int, *, suffix: bool) -> int:
+    # binary search, so that comparisons are done by C code
+    lo, hi = 0, limit
+
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if suffix:
+            same = a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]
+        else:
+            same = a[lo:mid] == b[lo:mid]
+
+        if same:
+            lo = mid
+        else:
+            hi = mid - 1
+
+    return lo
+
+
+def _diff(old: bytes, new: bytes) -> bytes:
+    """
+    Return delta replacing the part of old between common prefix and suffix with that of new.
+    """
+    old_view, new_view = memoryview(old), memoryview(new)
+    limit = min(len(old), len(new))
+    prefix = _common_length(old_view, new_view, limit, suffix=False)
+    suffix = _common_length(old_view, new_view, limit - prefix, suffix=True)
+
+    return _DELTA_HEADER.pack(prefix, suffix) + new[prefix:len(new) - suffix]
+
+
+def _patch(old: bytes, delta: bytes) -> bytes:
+    prefix, suffix = _DELTA_HEADER.unpack_from(delta)
+    if prefix + suffix > len(old):
+        raise intf.BackendError("delta does not match its base")
+
+    return old[:prefix] + delta[_DELTA_HEADER.size:] + old[len(old) - suffix:]
+
+
+def _is_manifest_file(path: pathlib.Path) -> bool:
+    try:
+        with path.open("rb") as f:
+            return f.read(len(_MAGIC)) == _MAGIC
+    except FileNotFoundError:
+        return False
+
+
+def _write_file(path: pathlib.Path, data: tp.Optional[bytes]) -> None:
+    if data is not None:
+        path.write_bytes(data)
+    elif path.exists():
+        path.unlink()
+
+
+def delta_logging(backend: intf.IStorageBackend) -> intf.IStorageBackend:
+    """
+    Wrap storage backend, so that blobs may be kept as a base snapshot along with a log of deltas, as
+    requested by "delta_log" option, which is the number of deltas triggering compaction.
+    "delta_log_size" limits total size of deltas, defaulting to the size of the base.
+
+    Blob's location holds a small manifest naming immutable side objects, which makes its updates atomic.
+    """
+
+    def replay(loc: str, manifest: _Manifest, opts: intf.Options) -> bytes:
+        data = backend.load(loc=manifest.base_loc(loc), opts=opts)
+
+        for i in range(len(manifest.deltas)):
+            data = _patch(data, backend.load(loc=manifest.delta_loc(loc, i), opts=opts))
+
+        return data
+
+    def side_objects(loc: str, opts: intf.Options) -> tp.List[str]:
+        # also finds ones left behind by modifications which failed after putting them
+        return [i for i in backend.glob(loc=f"{glob.escape(loc)}.wcb-*", opts=opts) if _SIDE_OBJECT_RE.search(i)]
+
+    def put(loc: str, data: tp.Optional[bytes], opts: intf.Options) -> None:
+        # side objects are immutable and uniquely named, so are neither read before writing, nor digested
+        backend.store(loc=loc, data=data, opts=opts)
+
+    def make_raw_modifier(
+        loc: str,
+        modifier: intf.StorageModifier,
+        params: _Params,
+        opts: intf.Options,
+        stale_locs: tp.List[str],
+    ) -> intf.StorageModifier:
+        """
+        Return modifier of contents stored at loc, adding side objects no longer used after it to stale_locs.
+        """
+
+        def raw_modifier(raw: tp.Optional[bytes]) -> tp.Optional[bytes]:
+            stale_locs.clear()
+            manifest = _Manifest.parse(raw)
+            data = raw if manifest is None else replay(loc, manifest, opts)
+            new_data = modifier(data)
+
+            if new_data == data:
+                return raw
+
+            max_deltas = params.max_deltas
+            if max_deltas is None:
+                max_deltas = 0 if manifest is None else _DEFAULT_MAX_DELTAS
+
+            if new_data is not None and manifest is not None and len(manifest.deltas) < max_deltas:
+                assert data is not None
+                delta = _diff(data, new_data)
+                max_size = manifest.base_size if params.max_size is None else params.max_size
+
+                if sum(manifest.deltas) + len(delta) <= max_size:
+                    put(manifest.delta_loc(loc, len(manifest.deltas)), delta, opts)
+                    manifest.deltas.append(len(delta))
+                    return manifest.dump()
+
+            # compaction, also of a plain blob into a new log and of a log into a plain blob
+            if manifest is not None or max_deltas:
+                stale_locs.extend(side_objects(loc, opts))
+
+            if new_data is None or max_deltas == 0:
+                return new_data
+
+            new_manifest = _Manifest(gen=secrets.token_hex(8), base_size=len(new_data), deltas=[])
+            put(new_manifest.base_loc(loc), new_data, opts)
+            return new_manifest.dump()
+
+        return raw_modifier
+
+    @implements.implements(intf.IStorageBackend)
+    class Backend:
+        @staticmethod
+        def modify(
+            *,
+            loc: str,
+            modifier: intf.StorageModifier,
+            opts: intf.Options,
+            digest_store: tp.Optional[intf.IDigestStore] = None,
+        ) -> None:
+            stale_locs: tp.List[str] = []
+            raw_modifier = make_raw_modifier(loc, modifier, _Params.from_opts(opts), opts, stale_locs)
+            backend.modify(loc=loc, modifier=raw_modifier, opts=opts, digest_store=digest_store)
+
+            for i in stale_locs:
+                put(i, None, opts)
+
+        @staticmethod
+        def modify_file(
+            *,
+            loc: str,
+            path: pathlib.Path,
+            modifier: intf.StorageFileModifier,
+            opts: intf.Options,
+            digest_store: tp.Optional[intf.IDigestStore] = None,
+        ) -> None:
+            params = _Params.from_opts(opts)
+            stale_locs: tp.List[str] = []
+
+            def modifier_in_memory(data: tp.Optional[bytes]) -> tp.Optional[bytes]:
+                _write_file(path, data)
+                modifier(path)
+                return path.read_bytes() if path.exists() else None
+
+            raw_modifier = make_raw_modifier(loc, modifier_in_memory, params, opts, stale_locs)
+
+            def raw_file_modifier(path: pathlib.Path) -> None:
+                if not params.max_deltas and not _is_manifest_file(path):
+                    # plain blob stays plain, without passing through memory
+                    modifier(path)
+                    return
+
+                _write_file(path, raw_modifier(path.read_bytes() if path.exists() else None))
+
+            backend.modify_file(loc=loc, path=path, modifier=raw_file_modifier, opts=opts, digest_store=digest_store)
+
+            for i in stale_locs:
+                put(i, None, opts)
+
+        @staticmethod
+        def store(
+            *,
+            loc: str,
+            data: tp.Optional[bytes],
+            opts: intf.Options,
+        ) -> None:
+            _Params.from_opts(opts)
+            backend.store(loc=loc, data=data, opts=opts)
+
+        @staticmethod
+        def prefetch(
+            *,
+            loc: str,
+            opts: intf.Options,
+        ) -> None:
+            backend.prefetch(loc=loc, opts=opts)
+
+        @staticmethod
+        def load(
+            *,
+            loc: str,
+            opts: intf.Options,
+        ) -> bytes:
+            _Params.from_opts(opts)
+
+            for attempt in range(_LOAD_ATTEMPTS):
+                raw = backend.load(loc=loc, opts=opts)
+                manifest = _Manifest.parse(raw)
+
+                if manifest is None:
+                    return raw
+
+                try:
+                    return replay(loc, manifest, opts)
+                except intf.BackendError:
+                    if attempt == _LOAD_ATTEMPTS - 1:
+                        raise
+
+            assert False  # pragma: no cover
+
+        @staticmethod
+        def load_file(
+            *,
+            loc: str,
+            path: pathlib.Path,
+            opts: intf.Options,
+        ) -> None:
+            _Params.from_opts(opts)
+            backend.load_file(loc=loc, path=path, opts=opts)
+
+            if _is_manifest_file(path):
+                # deltas are replayed in memory
+                path.write_bytes(Backend.load(loc=loc, opts=opts))
+
+        @staticmethod
+        def glob(
+            *,
+            loc: str,
+            opts: intf.Options,
+        ) -> tp.List[str]:
+            _Params.from_opts(opts)
+            return [i for i in backend.glob(loc=loc, opts=opts) if not _SIDE_OBJECT_RE.search(i)]
+
+        @staticmethod
+        def load_consistent(
+            *,
+            locs: tp.Sequence[tp.Tuple[str, intf.Options]],
+        ) -> tp.List[tp.Union[bytes, intf.BackendError]]:
+            result: tp.List[tp.Union[bytes, intf.BackendError]] = []
+
+            for _, opts in locs:
+                _Params.from_opts(opts)
+
+            # side objects are immutable, so manifests are all that needs to be consistent
+            for (loc, opts), i in zip(locs, backend.load_consistent(locs=locs)):
+                if isinstance(i, bytes):
+                    try:
+                        manifest = _Manifest.parse(i)
+                        if manifest is not None:
+                            i = replay(loc, manifest, opts)
+                    except intf.BackendError as e:
+                        i = e
+
+                result.append(i)
+
+            return result
+
+        @staticmethod
+        def provision(
+            *,
+            loc: str,
+            opts: intf.Options,
+        ) -> None:
+            _Params.from_opts(opts)
+            backend.provision(loc=loc, opts=opts)
+
+    return tp.cast(intf.IStorageBackend, Backend)
@@ -1,43 +1,520 @@
-import datetime
+import decimal
+import math
+import random
+import socket
+import threading
+import time
 import typing as tp
+import uuid
+from dataclasses import dataclass
 
+import botocore
 import implements
-import python_dynamodb_lock.python_dynamodb_lock as dlock
 import with_cloud_blob.backend_intf as intf
 
 from . import _boto_helpers as bh
+from .._log import logger
+
+# table layout and lock item columns are compatible with python_dynamodb_lock
+_TABLE_NAME = "DynamoDBLockTable"
+_PARTITION_KEY_NAME = "lock_key"
+_SORT_KEY_NAME = "sort_key"
+_SORT_KEY_VALUE = "-"
+_COL_OWNER_NAME = "owner_name"
+_COL_LEASE_DURATION = "lease_duration"
+_COL_RECORD_VERSION_NUMBER = "record_version_number"
+_COL_EXPIRY_TIME = "expiry_time"
+_COL_DIGEST = "digest"
+_COL_DIGEST_EXPIRY_TIME = "digest_expiry_time"
+# map of owner names of shared lock holders to "<record version number> <lease duration>" entries
+_COL_READERS = "readers"
+# time until which an exclusive locker waits for the lock, during which no new shared locks are granted
+_COL_WRITER_WAITING = "writer_waiting"
+
+_EXPIRY_PERIOD = 3600
+# writer_waiting is set this many max_retry_period ahead on every poll, so that it lapses soon after the writer
+# stops polling without clearing it
+_WRITER_WAITING_RETRY_PERIODS = 3
+
+
+def _update_expression(clauses: tp.Mapping[str, tp.Sequence[str]]) -> str:
+    return " ".join(f"{k} {', '.join(v)}" for k, v in clauses.items() if v)
+
+
+def _is_conditional_check_failed(e: botocore.exceptions.ClientError) -> bool:
+    return tp.cast(bool, e.response["Error"]["Code"] == "ConditionalCheckFailedException")
+
+
+@implements.implements(intf.IDigestStore)
+class _DigestStore:
+    """
+    Digest carried by the lock item: read on acquisition, published on release.
+    """
+
+    def __init__(self, item: tp.Mapping[str, tp.Any]) -> None:
+        digest = item.get(_COL_DIGEST)
+        self._digest = None if digest is None else bytes(digest.value)
+        self._expiry_time = int(item.get(_COL_DIGEST_EXPIRY_TIME) or 0)
+        self.new_digest: tp.Optional[tp.Tuple[bytes, int]] = None
+
+    def get(self) -> tp.Optional[bytes]:
+        if self._digest is not None and self._expiry_time > time.time():
+            return self._digest
+        else:
+            return None
+
+    def put(self, digest: bytes, *, ttl: int) -> None:
+        self.new_digest = digest, int(time.time() + ttl)
+
+
+@dataclass
+class _LockParams:
+    carry_digest: bool
+    lease_duration: float
+    heartbeat_period: float
+    retry_period: float
+    max_retry_period: float
+
+    @staticmethod
+    def from_opts(opts: intf.Options) -> "_LockParams":
+        result = _LockParams(
+            # keep blob digest in the lock item, to be used by storage backends instead of a separate table
+            carry_digest=bool(int(opts.get("carry_digest") or "0")),
+            # lock held by an owner which stopped sending heartbeats is considered abandoned after this time
+            lease_duration=float(opts.get("lease_duration") or "30"),
+            heartbeat_period=float(opts.get("heartbeat_period") or "5"),
+            # while waiting, polling period starts at retry_period and doubles up to max_retry_period
+            retry_period=float(opts.get("retry_period") or "0.1"),
+            max_retry_period=float(opts.get("max_retry_period") or "5"),
+        )
+
+        if not 0 < result.heartbeat_period < result.lease_duration:
+            raise intf.BackendError("heartbeat_period must be positive and less than lease_duration")
+
+        return result
+
+
+def _reader_lease_duration(entry: str) -> float:
+    return float(entry.rsplit(" ", 1)[1])
 
 
 class _Lock:
     def __init__(
         self,
         *,
-        lock_client: dlock.DynamoDBLockClient,
+        table: tp.Any,
         key: str,
-        timeout: float,
+        wait: intf.LockWait,
+        shared: bool,
+        params: _LockParams,
     ) -> None:
-        self._lock_client = lock_client
-        self._key = key
-        self._timeout = timeout
-        self._lock: tp.Optional[dlock.DynamoDBLock] = None
+        self._table = table
+        self._loc = key
+        self._key = {
+            _PARTITION_KEY_NAME: key,
+            _SORT_KEY_NAME: _SORT_KEY_VALUE,
+        }
+        self._wait = wait
+        self._shared = shared
+        self._params = params
+        self._owner_name = socket.getfqdn() + uuid.uuid4().hex
+        self._record_version_number = ""
+        self._rvn_lock = threading.Lock()
+        self._stop_heartbeat = threading.Event()
+        self._heartbeat_thread: tp.Optional[threading.Thread] = None
+        self._digest_store: tp.Optional[_DigestStore] = None
+        # last writer_waiting deadline set by us
+        self._writer_waiting: tp.Optional[int] = None
+
+    def _reader_entry(self, record_version_number: str) -> str:
+        return f"{record_version_number} {self._params.lease_duration}"
+
+    def _expiry_clauses(self, values: tp.Dict[str, tp.Any]) -> tp.Dict[str, tp.List[str]]:
+        """
+        Return clauses of update expression of the lock item, which refresh its expiry time, used by TTL to delete
+        abandoned items, except for items carrying a digest, which must outlive lock sessions, so that TTL never
+        deletes them.
+        """
+        if self._params.carry_digest:
+            return {"SET": [], "REMOVE": ["#expiry_time"]}
+
+        values[":expiry_time"] = int(time.time() + _EXPIRY_PERIOD)
+        return {"SET": ["#expiry_time = :expiry_time"], "REMOVE": []}
+
+    def _try_acquire(self, stale_record_version_number: tp.Optional[str]) -> tp.Optional[tp.Any]:
+        record_version_number = uuid.uuid4().hex
+        condition = "attribute_not_exists(#owner_name)"
+        names = {
+            "#owner_name": _COL_OWNER_NAME,
+            "#lease_duration": _COL_LEASE_DURATION,
+            "#rvn": _COL_RECORD_VERSION_NUMBER,
+            "#expiry_time": _COL_EXPIRY_TIME,
+            "#readers": _COL_READERS,
+            "#writer_waiting": _COL_WRITER_WAITING,
+        }
+        values: tp.Dict[str, tp.Any] = {}
+        clauses = self._expiry_clauses(values)
+
+        if stale_record_version_number is not None:
+            condition = f"({condition} OR #rvn = :stale_rvn)"
+            values[":stale_rvn"] = stale_record_version_number
+
+        if self._shared:
+            # join the readers, discarding the abandoned exclusive lease, if any, unless a writer waits for them
+            condition += " AND attribute_exists(#readers)" \
+                " AND (attribute_not_exists(#writer_waiting) OR #writer_waiting < :now)"
+            clauses["SET"].append("#readers.#reader = :entry")
+            clauses["REMOVE"] += ["#owner_name", "#lease_duration", "#rvn"]
+            names["#reader"] = self._owner_name
+            values.update({
+                ":entry": self._reader_entry(record_version_number),
+                ":now": int(time.time()),
+            })
+        else:
+            condition += " AND (attribute_not_exists(#readers) OR size(#readers) = :zero)"
+            clauses["SET"] += ["#owner_name = :owner_name", "#lease_duration = :lease_duration", "#rvn = :rvn"]
+            clauses["REMOVE"].append("#writer_waiting")
+            values.update({
+                ":owner_name": self._owner_name,
+                ":lease_duration": decimal.Decimal(str(self._params.lease_duration)),
+                ":rvn": record_version_number,
+                ":zero": 0,
+            })
+
+        try:
+            response = self._table.update_item(
+                Key=self._key,
+                UpdateExpression=_update_expression(clauses),
+                ConditionExpression=condition,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                ReturnValues="ALL_NEW",
+            )
+        except botocore.exceptions.ClientError as e:
+            if _is_conditional_check_failed(e):
+                return None
+            raise
+
+        self._record_version_number = record_version_number
+        return response["Attributes"]
+
+    def _update_if(self, **kwargs: tp.Any) -> None:
+        """
+        Update lock item, unless the condition has been invalidated by somebody else in the meantime.
+        """
+        try:
+            self._table.update_item(Key=self._key, **kwargs)
+        except botocore.exceptions.ClientError as e:
+            if not _is_conditional_check_failed(e):
+                raise
+
+    def _create_readers(self) -> None:
+        values: tp.Dict[str, tp.Any] = {":empty": {}}
+        clauses = self._expiry_clauses(values)
+        clauses["SET"].append("#readers = :empty")
+        self._update_if(
+            UpdateExpression=_update_expression(clauses),
+            ConditionExpression="attribute_not_exists(#readers)",
+            ExpressionAttributeNames={
+                "#readers": _COL_READERS,
+                "#expiry_time": _COL_EXPIRY_TIME,
+            },
+            ExpressionAttributeValues=values,
+        )
+
+    def _discard_readers(self, entries: tp.Set[str]) -> None:
+        for i in entries:
+            owner_name, entry = i.split(" ", 1)
+            self._update_if(
+                UpdateExpression="REMOVE #readers.#reader",
+                ConditionExpression="#readers.#reader = :entry",
+                ExpressionAttributeNames={
+                    "#readers": _COL_READERS,
+                    "#reader": owner_name,
+                },
+                ExpressionAttributeValues={
+                    ":entry": entry,
+                },
+            )
+
+    def _mark_writer_waiting(self) -> None:
+        deadline = math.ceil(time.time() + _WRITER_WAITING_RETRY_PERIODS * self._params.max_retry_period)
+        self._update_if(
+            UpdateExpression="SET #writer_waiting = :deadline",
+            ConditionExpression="attribute_exists(#readers)",
+            ExpressionAttributeNames={
+                "#writer_waiting": _COL_WRITER_WAITING,
+                "#readers": _COL_READERS,
+            },
+            ExpressionAttributeValues={
+                ":deadline": deadline,
+            },
+        )
+        self._writer_waiting = deadline
+
+    def _clear_writer_waiting(self) -> None:
+        """
+        Let readers in right away after giving up, unless another writer has marked itself waiting since.
+        """
+        if self._writer_waiting is None:
+            return
 
-    def __enter__(self) -> None:
         try:
-            self._lock = self._lock_client.acquire_lock(
-                self._key,
-                retry_timeout=datetime.timedelta(seconds=self._timeout),
+            self._update_if(
+                UpdateExpression="REMOVE #writer_waiting",
+                ConditionExpression="#writer_waiting = :deadline",
+                ExpressionAttributeNames={
+                    "#writer_waiting": _COL_WRITER_WAITING,
+                },
+                ExpressionAttributeValues={
+                    ":deadline": self._writer_waiting,
+                },
             )
-        except dlock.DynamoDBLockError as e:
-            if e.code == dlock.DynamoDBLockError.ACQUIRE_TIMEOUT:
-                raise intf.TimeoutError()
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+            # it lapses soon anyway
+            logger.debug(f"clearing writer waiting for lock on {self._loc}: {e}")
+
+    def _acquire(self) -> tp.Any:
+        stale_record_version_number = None
+        last_owner_name = None
+        last_record_version_number = None
+        last_record_version_number_time = 0.0
+        readers_first_seen: tp.Dict[str, float] = {}
+        retry_period = self._params.retry_period
+
+        while True:
+            item = self._try_acquire(stale_record_version_number)
+            if item is not None:
+                return item
+
+            existing = self._table.get_item(Key=self._key, ConsistentRead=True).get("Item") or {}
+
+            if self._shared and _COL_READERS not in existing:
+                self._create_readers()
+                continue
+
+            # readers only block exclusive lock
+            readers = set() if self._shared else {f"{k} {v}" for k, v in (existing.get(_COL_READERS) or {}).items()}
+            now = time.monotonic()
+            delay = random.uniform(retry_period / 2, retry_period)
+            retry_period = min(retry_period * 2, self._params.max_retry_period)
+
+            if _COL_OWNER_NAME in existing:
+                if existing[_COL_RECORD_VERSION_NUMBER] != last_record_version_number:
+                    # heartbeat of the current owner renews its lease
+                    last_record_version_number = existing[_COL_RECORD_VERSION_NUMBER]
+                    last_record_version_number_time = now
+
+                    if existing[_COL_OWNER_NAME] != last_owner_name:
+                        # lock has changed hands, the next release may be soon
+                        last_owner_name = existing[_COL_OWNER_NAME]
+                        retry_period = self._params.retry_period
+                elif now - last_record_version_number_time > float(existing[_COL_LEASE_DURATION]):
+                    logger.warning(lambda: f"lease of {existing[_COL_OWNER_NAME]} on {self._loc} has expired")
+                    stale_record_version_number = last_record_version_number
+                    delay = 0
+            elif readers:
+                # heartbeats of readers replace their entries, so an entry which stays for longer
+                # than its lease duration belongs to an abandoned reader
+                readers_first_seen = {i: readers_first_seen.get(i, now) for i in readers}
+                stale_readers = {
+                    i for i, first_seen in readers_first_seen.items()
+                    if now - first_seen > _reader_lease_duration(i)
+                }
+
+                if stale_readers:
+                    logger.warning(lambda: f"leases of {len(stale_readers)} readers on {self._loc} have expired")
+                    self._discard_readers(stale_readers)
+                    delay = 0
+                else:
+                    # writers queued behind an owner need not, as it keeps new readers out anyway
+                    self._mark_writer_waiting()
+            elif self._shared and int(existing.get(_COL_WRITER_WAITING) or 0) >= time.time():
+                # let the waiting writer go first, so that a stream of readers cannot starve it
+                pass
             else:
+                # released in between our calls
+                delay = 0
+
+            try:
+                step = self._wait.step()
+            except intf.TimeoutError:
+                self._clear_writer_waiting()
                 raise
 
-    def __exit__(self, *a: tp.Any) -> bool:
-        self._lock_client.release_lock(self._lock)
+            time.sleep(min(delay, step))
+
+    def _send_heartbeat(self, new_record_version_number: str) -> None:
+        values: tp.Dict[str, tp.Any] = {}
+        clauses = self._expiry_clauses(values)
+
+        if self._shared:
+            # replace own entry in a single update, so that it is never missing nor duplicated
+            clauses["SET"].append("#readers.#reader = :new_entry")
+            values.update({
+                ":old_entry": self._reader_entry(self._record_version_number),
+                ":new_entry": self._reader_entry(new_record_version_number),
+            })
+            self._table.update_item(
+                Key=self._key,
+                UpdateExpression=_update_expression(clauses),
+                ConditionExpression="#readers.#reader = :old_entry",
+                ExpressionAttributeNames={
+                    "#readers": _COL_READERS,
+                    "#reader": self._owner_name,
+                    "#expiry_time": _COL_EXPIRY_TIME,
+                },
+                ExpressionAttributeValues=values,
+            )
+        else:
+            clauses["SET"].append("#rvn = :new_rvn")
+            values.update({
+                ":old_rvn": self._record_version_number,
+                ":new_rvn": new_record_version_number,
+            })
+            self._table.update_item(
+                Key=self._key,
+                UpdateExpression=_update_expression(clauses),
+                ConditionExpression="#rvn = :old_rvn",
+                ExpressionAttributeNames={
+                    "#rvn": _COL_RECORD_VERSION_NUMBER,
+                    "#expiry_time": _COL_EXPIRY_TIME,
+                },
+                ExpressionAttributeValues=values,
+            )
+
+    def _heartbeat(self) -> None:
+        while not self._stop_heartbeat.wait(self._params.heartbeat_period):
+            with self._rvn_lock:
+                new_record_version_number = uuid.uuid4().hex
+                try:
+                    self._send_heartbeat(new_record_version_number)
+                except botocore.exceptions.ClientError as e:
+                    if _is_conditional_check_failed(e):
+                        logger.error(lambda: f"lock on {self._loc} was taken over by another owner")
+                        return
+
+                    logger.warning(f"sending heartbeat for lock on {self._loc}: {e}")
+                    continue
+                except botocore.exceptions.BotoCoreError as e:
+                    logger.warning(f"sending heartbeat for lock on {self._loc}: {e}")
+                    continue
+
+                self._record_version_number = new_record_version_number
+
+    def _release(self, *, failed: bool) -> None:
+        if self._shared:
+            self._table.update_item(
+                Key=self._key,
+                UpdateExpression="REMOVE #readers.#reader",
+                ConditionExpression="#readers.#reader = :entry",
+                ExpressionAttributeNames={
+                    "#readers": _COL_READERS,
+                    "#reader": self._owner_name,
+                },
+                ExpressionAttributeValues={
+                    ":entry": self._reader_entry(self._record_version_number),
+                },
+            )
+            return
+
+        names = {
+            "#rvn": _COL_RECORD_VERSION_NUMBER,
+        }
+        values: tp.Dict[str, tp.Any] = {
+            ":rvn": self._record_version_number,
+        }
+
+        if self._digest_store is None:
+            self._table.delete_item(
+                Key=self._key,
+                ConditionExpression="#rvn = :rvn",
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+            )
+            return
+
+        # keep the item, so that the digest outlives the lock session
+        clauses: tp.Dict[str, tp.List[str]] = {"SET": [], "REMOVE": ["#owner_name", "#lease_duration", "#rvn"]}
+        names.update({
+            "#owner_name": _COL_OWNER_NAME,
+            "#lease_duration": _COL_LEASE_DURATION,
+        })
+
+        if self._digest_store.new_digest is not None:
+            names.update({
+                "#digest": _COL_DIGEST,
+                "#digest_expiry_time": _COL_DIGEST_EXPIRY_TIME,
+            })
+
+            if failed:
+                # the blob may or may not have been written, so neither digest can be trusted
+                clauses["REMOVE"] += ["#digest", "#digest_expiry_time"]
+            else:
+                clauses["SET"] += ["#digest = :digest", "#digest_expiry_time = :digest_expiry_time"]
+                digest, digest_expiry_time = self._digest_store.new_digest
+                values.update({
+                    ":digest": digest,
+                    ":digest_expiry_time": digest_expiry_time,
+                })
+
+        self._table.update_item(
+            Key=self._key,
+            UpdateExpression=_update_expression(clauses),
+            ConditionExpression="#rvn = :rvn",
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+        )
+
+    def __enter__(self) -> tp.Optional[intf.IDigestStore]:
+        try:
+            item = self._acquire()
+        except botocore.exceptions.ClientError as e:
+            raise intf.BackendError(e)
+        except botocore.exceptions.BotoCoreError as e:
+            raise intf.BackendError(e)
+
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._heartbeat_thread.start()
+
+        if self._params.carry_digest:
+            # readers use the digest to verify what they read, and never publish a new one
+            self._digest_store = _DigestStore(item)
+
+        return tp.cast(tp.Optional[intf.IDigestStore], self._digest_store)
+
+    def __exit__(self, exc_type: tp.Any, *a: tp.Any) -> bool:
+        assert self._heartbeat_thread is not None
+        self._stop_heartbeat.set()
+        self._heartbeat_thread.join()
+
+        with self._rvn_lock:
+            try:
+                self._release(failed=exc_type is not None)
+            except botocore.exceptions.ClientError as e:
+                if _is_conditional_check_failed(e):
+                    logger.warning(lambda: f"lock on {self._loc} was taken over by another owner before release")
+                else:
+                    logger.warning(f"releasing lock on {self._loc}: {e}")
+            except botocore.exceptions.BotoCoreError as e:
+                logger.warning(f"releasing lock on {self._loc}: {e}")
+
         return False
 
 
+def _ensure_table(dynamodb_resource: tp.Any, *, force: bool) -> tp.Any:
+    return bh.ensure_dynamodb_table(
+        dynamodb_resource,
+        table_name=_TABLE_NAME,
+        keys={
+            _PARTITION_KEY_NAME: "HASH",
+            _SORT_KEY_NAME: "RANGE",
+        },
+        ttl_attribute=_COL_EXPIRY_TIME,
+        force=force,
+    )
+
+
 @implements.implements(intf.ILockBackend)
 class Backend:
     @staticmethod
@@ -45,21 +522,36 @@ class Backend:
         *,
         loc: str,
         opts: intf.Options,
-        timeout: float,
-    ) -> tp.ContextManager[None]:
+        wait: intf.LockWait,
+        shared: bool = False,
+    ) -> tp.ContextManager[tp.Optional[intf.IDigestStore]]:
         session = bh.boto_session(opts)
         dynamodb_resource = bh.boto_resource_dynamodb(session, opts)
-        lock_client = dlock.DynamoDBLockClient(dynamodb_resource)
+        params = _LockParams.from_opts(opts)
         opts.fail_on_unused()
 
-        try:
-            dlock.DynamoDBLockClient.create_dynamodb_table(dynamodb_resource.meta.client)
-        except dynamodb_resource.meta.client.exceptions.ResourceInUseException:
-            # table already exists
-            pass
-
         return _Lock(
-            lock_client=lock_client,
+            table=_ensure_table(dynamodb_resource, force=False),
             key=loc,
-            timeout=timeout,
+            wait=wait,
+            shared=shared,
+            params=params,
         )
+
+    @staticmethod
+    def provision(
+        *,
+        loc: str,
+        opts: intf.Options,
+    ) -> None:
+        session = bh.boto_session(opts)
+        dynamodb_resource = bh.boto_resource_dynamodb(session, opts)
+        _LockParams.from_opts(opts)
+        opts.fail_on_unused()
+
+        try:
+            _ensure_table(dynamodb_resource, force=True)
+        except botocore.exceptions.ClientError as e:
+            raise intf.BackendError(e)
+        except botocore.exceptions.BotoCoreError as e:
+            raise intf.BackendError(e)
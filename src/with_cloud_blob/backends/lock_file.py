@@ -1,16 +1,149 @@
+import os
+import threading
+import time
 import typing as tp
 
 import filelock
 import implements
 import with_cloud_blob.backend_intf as intf
 
+try:
+    import fcntl
+    import signal
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+# used by flock engine outside of the main thread, where SIGALRM cannot interrupt a blocking wait
+_POLL_PERIOD = 0.05
+# delay of a restored timer of the caller, which would have expired while it was replaced by ours
+_MIN_TIMER_DELAY = 1e-6
+
+_LockFactory = tp.Callable[[str, intf.LockWait, bool], tp.ContextManager[None]]
+
+
+class _Interrupted(Exception):
+    pass
+
+
+def _raise_interrupted(signum: int, frame: tp.Any) -> None:
+    raise _Interrupted()
+
+
+def _flock(fd: int, operation: int, timeout: float) -> bool:
+    """
+    Try to flock() fd for at most timeout seconds. Return whether the lock was acquired.
+    """
+    if (
+        timeout > 0
+        and threading.current_thread() is threading.main_thread()
+        # handler installed outside of Python could not be restored
+        and signal.getsignal(signal.SIGALRM) is not None
+    ):
+        # block in the kernel, so that we are woken up as soon as the lock is released,
+        # and use SIGALRM to interrupt the wait when the timeout expires. Timer and handler of the caller,
+        # if any, are put back afterwards, and its timer is not delayed by our wait.
+        old_delay, old_interval = signal.getitimer(signal.ITIMER_REAL)
+        if old_delay:
+            timeout = min(timeout, old_delay)
+
+        start = time.monotonic()
+        old_handler = signal.signal(signal.SIGALRM, _raise_interrupted)
+        try:
+            try:
+                signal.setitimer(signal.ITIMER_REAL, timeout)
+                fcntl.flock(fd, operation)
+                return True
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        except _Interrupted:
+            # if interrupted right after flock() has succeeded, the next call acquires the lock immediately,
+            # as flock() is idempotent for the same open file description
+            return False
+        finally:
+            signal.signal(signal.SIGALRM, old_handler)
+
+            if old_delay:
+                remaining = old_delay - (time.monotonic() - start)
+                signal.setitimer(signal.ITIMER_REAL, max(remaining, _MIN_TIMER_DELAY), old_interval)
+
+    deadline = time.monotonic() + timeout
+
+    while True:
+        try:
+            fcntl.flock(fd, operation | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            time.sleep(min(remaining, _POLL_PERIOD))
+
+
+class _FlockLock:
+    def __init__(self, lock_file: str, wait: intf.LockWait, shared: bool) -> None:
+        self._lock_file = lock_file
+        self._wait = wait
+        self._operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        self._fd: tp.Optional[int] = None
 
-class _Lock(filelock.FileLock):
     def __enter__(self) -> None:
+        fd = os.open(self._lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+
         try:
-            filelock.FileLock.__enter__(self)
-        except filelock.Timeout:
-            raise intf.TimeoutError()
+            timeout = 0.0
+
+            while not _flock(fd, self._operation, timeout):
+                timeout = self._wait.step()
+        except BaseException:
+            os.close(fd)
+            raise
+
+        self._fd = fd
+
+    def __exit__(self, *a: tp.Any) -> None:
+        assert self._fd is not None
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+class _FileLock:
+    # filelock has no shared locks, so these are taken as exclusive ones
+    def __init__(self, lock_file: str, wait: intf.LockWait, shared: bool) -> None:
+        self._lock = filelock.FileLock(lock_file)
+        self._wait = wait
+
+    def __enter__(self) -> None:
+        timeout = 0.0
+
+        while True:
+            try:
+                self._lock.acquire(timeout=timeout)
+                return
+            except filelock.Timeout:
+                timeout = self._wait.step()
+
+    def __exit__(self, *a: tp.Any) -> None:
+        self._lock.release()
+
+
+_ENGINES: tp.Dict[str, _LockFactory] = {
+    "filelock": _FileLock,
+}
+
+if fcntl is not None:
+    _ENGINES["flock"] = _FlockLock
+
+
+def _engine(opts: intf.Options) -> _LockFactory:
+    # "flock" blocks in the kernel and wakes up immediately on release, "filelock" polls and is portable
+    engine_name = opts.get("engine") or ("flock" if "flock" in _ENGINES else "filelock")
+
+    try:
+        return _ENGINES[engine_name]
+    except KeyError:
+        raise intf.BackendError(f"unsupported lock engine: {engine_name}")
 
 
 @implements.implements(intf.ILockBackend)
@@ -20,6 +153,19 @@ class Backend:
         *,
         loc: str,
         opts: intf.Options,
-        timeout: float,
-    ) -> tp.ContextManager[None]:
-        return _Lock(loc + ".lock", timeout=timeout)
+        wait: intf.LockWait,
+        shared: bool = False,
+    ) -> tp.ContextManager[tp.Optional[intf.IDigestStore]]:
+        engine = _engine(opts)
+        opts.fail_on_unused()
+
+        return engine(loc + ".lock", wait, shared)
+
+    @staticmethod
+    def provision(
+        *,
+        loc: str,
+        opts: intf.Options,
+    ) -> None:
+        _engine(opts)
+        opts.fail_on_unused()
@@ -1,4 +1,10 @@
+import errno
+import filecmp
+import fnmatch
+import os
 import pathlib
+import shutil
+import stat
 import typing as tp
 
 import atomicwrites
@@ -14,6 +20,7 @@ class Backend:
         loc: str,
         modifier: intf.StorageModifier,
         opts: intf.Options,
+        digest_store: tp.Optional[intf.IDigestStore] = None,
     ) -> None:
         opts.fail_on_unused()
         path = pathlib.Path(loc)
@@ -32,6 +39,84 @@ class Backend:
                 with atomicwrites.atomic_write(str(path), overwrite=True, mode="wb") as f:
                     f.write(new_data)
 
+    @staticmethod
+    def modify_file(
+        *,
+        loc: str,
+        path: pathlib.Path,
+        modifier: intf.StorageFileModifier,
+        opts: intf.Options,
+        digest_store: tp.Optional[intf.IDigestStore] = None,
+    ) -> None:
+        opts.fail_on_unused()
+
+        # new blobs get the same mode as written by atomicwrites
+        mode = 0o600
+
+        try:
+            # done by the kernel, without passing the data through user space
+            shutil.copyfile(loc, path)
+            mode = stat.S_IMODE(os.stat(loc).st_mode)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            raise intf.BackendError(e)
+
+        signature = intf.file_signature(path)
+        modifier(path)
+        new_signature = intf.file_signature(path)
+
+        # with coarse timestamps, a quick rewrite of the same size may keep the signature
+        if new_signature == signature and (signature is None or filecmp.cmp(path, loc, shallow=False)):
+            return
+
+        try:
+            if new_signature is None:
+                os.unlink(loc)
+                return
+
+            try:
+                os.chmod(path, mode)
+                os.replace(path, loc)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+
+                with atomicwrites.atomic_write(loc, overwrite=True, mode="wb") as f, path.open("rb") as src:
+                    os.chmod(f.fileno(), mode)
+                    shutil.copyfileobj(src, f)
+        except OSError as e:
+            raise intf.BackendError(e)
+
+    @staticmethod
+    def store(
+        *,
+        loc: str,
+        data: tp.Optional[bytes],
+        opts: intf.Options,
+    ) -> None:
+        opts.fail_on_unused()
+
+        try:
+            if data is None:
+                try:
+                    os.unlink(loc)
+                except FileNotFoundError:
+                    pass
+            else:
+                with atomicwrites.atomic_write(loc, overwrite=True, mode="wb") as f:
+                    f.write(data)
+        except OSError as e:
+            raise intf.BackendError(e)
+
+    @staticmethod
+    def prefetch(
+        *,
+        loc: str,
+        opts: intf.Options,
+    ) -> None:
+        pass
+
     @staticmethod
     def load(
         *,
@@ -43,3 +128,65 @@ class Backend:
             return pathlib.Path(loc).read_bytes()
         except OSError as e:
             raise intf.BackendError(e)
+
+    @staticmethod
+    def load_file(
+        *,
+        loc: str,
+        path: pathlib.Path,
+        opts: intf.Options,
+    ) -> None:
+        opts.fail_on_unused()
+        try:
+            shutil.copyfile(loc, path)
+        except OSError as e:
+            raise intf.BackendError(e)
+
+    @staticmethod
+    def glob(
+        *,
+        loc: str,
+        opts: intf.Options,
+    ) -> tp.List[str]:
+        opts.fail_on_unused()
+        result: tp.List[str] = []
+
+        def scan(path: str) -> None:
+            with os.scandir(path or ".") as it:
+                for i in it:
+                    child = os.path.join(path, i.name)
+
+                    if i.is_dir(follow_symlinks=False):
+                        scan(child)
+                    elif fnmatch.fnmatchcase(child, loc):
+                        result.append(child)
+
+        try:
+            scan(os.path.dirname(intf.glob_prefix(loc)))
+        except OSError as e:
+            raise intf.BackendError(e)
+
+        return sorted(result)
+
+    @staticmethod
+    def load_consistent(
+        *,
+        locs: tp.Sequence[tp.Tuple[str, intf.Options]],
+    ) -> tp.List[tp.Union[bytes, intf.BackendError]]:
+        result: tp.List[tp.Union[bytes, intf.BackendError]] = []
+
+        for loc, opts in locs:
+            try:
+                result.append(Backend.load(loc=loc, opts=opts))
+            except intf.BackendError as e:
+                result.append(e)
+
+        return result
+
+    @staticmethod
+    def provision(
+        *,
+        loc: str,
+        opts: intf.Options,
+    ) -> None:
+        opts.fail_on_unused()
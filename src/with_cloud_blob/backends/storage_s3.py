@@ -1,15 +1,20 @@
 import binascii
+import concurrent.futures
+import fnmatch
 import hashlib
 import io
+import pathlib
 import threading
 import time
 import typing as tp
 
 import botocore
+import filelock
 import implements
 import with_cloud_blob.backend_intf as intf
 
 from . import _boto_helpers as bh
+from .._cache import BlobCache
 from .._log import logger
 
 
@@ -26,92 +31,121 @@ class _BucketKey:
             )
 
 
-class _DynamoDbKeyValueStore:
+_BATCH_GET_MAX_KEYS = 100
+_MAX_DOWNLOAD_WORKERS = 16
+_COALESCE_LOCK_TIMEOUT = 60
+_CHUNK_SIZE = 1024 * 1024
+# accepted by every operation, even if used by some of them only, so that the same locator fits all of them
+_OPTIONS = (
+    "profile",
+    "region",
+    "endpoint",
+    "dynamodb_table",
+    "dynamodb_endpoint",
+    "cache_size",
+    # used by load() only, as coalesced downloads may be stale
+    "coalesce_period",
+    "max_lag",
+    "lag_retry_period",
+    "digest_in_lock",
+    # used by modify() only
+    "_delay_put",
+)
+
+
+@implements.implements(intf.IDigestStore)
+class _DynamoDbDigestStore:
     def __init__(
         self,
         boto_session: tp.Any,
         opts: intf.Options,
-        ttl: int,
+        key: str,
     ) -> None:
         self._table_name = opts.get("dynamodb_table") or "with-cloud-blob"
         self._resource = bh.boto_resource_dynamodb(boto_session, opts)
         self._table: tp.Any = None
-        self._ttl = ttl
+        self._key = key
 
-    def _ensure_table(self) -> tp.Any:
-        if self._table:
+    def ensure_table(self, force: bool = False) -> None:
+        if self._table and not force:
             return
 
-        try:
-            self._resource.create_table(
-                AttributeDefinitions=[
-                    {
-                        "AttributeName": "key",
-                        "AttributeType": "S",
-                    },
-                ],
-                KeySchema=[
-                    {
-                        "AttributeName": "key",
-                        "KeyType": "HASH",
-                    },
-                ],
-                BillingMode="PAY_PER_REQUEST",
-                TableName=self._table_name,
-            )
-
-            self._wait_for_table_active()
-
-            self._resource.meta.client.update_time_to_live(
-                TableName=self._table_name,
-                TimeToLiveSpecification={
-                    "Enabled": True,
-                    "AttributeName": "expiry_time",
-                },
-            )
-
-            self._wait_for_table_active()
-        except self._resource.meta.client.exceptions.ResourceInUseException:
-            # table already exists
-            pass
-
-        self._table = self._resource.Table(self._table_name)
+        self._table = bh.ensure_dynamodb_table(
+            self._resource,
+            table_name=self._table_name,
+            keys={"key": "HASH"},
+            ttl_attribute="expiry_time",
+            force=force,
+        )
 
-    def _wait_for_table_active(self) -> None:
-        while True:
-            response = self._resource.meta.client.describe_table(TableName=self._table_name)
-            status = response.get("Table", {}).get("TableStatus", "UNKNOWN")
-            if status == "ACTIVE":
-                break
-            else:
-                logger.debug(lambda: f"waiting for {self._table_name} dynamodb table to become active")
-                time.sleep(1)
+    @property
+    def batch_id(self) -> tp.Tuple[str, str]:
+        """
+        Stores with equal batch_id may be queried by a single batch_get().
+        """
+        return self._resource.meta.client.meta.endpoint_url, self._table_name
 
-    def get(self, key: str) -> tp.Optional[bytes]:
-        self._ensure_table()
-        response = self._table.get_item(
-            Key={"key": key},
-            ConsistentRead=True,
-        )
-        item = response.get("Item")
+    @staticmethod
+    def _item_digest(item: tp.Optional[tp.Mapping[str, tp.Any]]) -> tp.Optional[bytes]:
         if item and item["expiry_time"] > time.time():
             return tp.cast(bytes, item["value"].value)
         else:
             return None
 
-    def put(self, key: str, value: bytes) -> None:
-        self._ensure_table()
+    def get(self) -> tp.Optional[bytes]:
+        self.ensure_table()
+        response = self._table.get_item(
+            Key={"key": self._key},
+            ConsistentRead=True,
+        )
+        return self._item_digest(response.get("Item"))
+
+    @staticmethod
+    def batch_get(stores: tp.Sequence["_DynamoDbDigestStore"]) -> tp.List[tp.Optional[bytes]]:
+        """
+        Same as get() of each of stores, which must have the same batch_id, using BatchGetItem.
+        """
+        if not stores:
+            return []
+
+        stores[0].ensure_table()
+        table_name = stores[0]._table_name
+        resource = stores[0]._resource
+        keys = sorted({i._key for i in stores})
+        items: tp.Dict[str, tp.Any] = {}
+
+        for chunk_start in range(0, len(keys), _BATCH_GET_MAX_KEYS):
+            request: tp.Any = {
+                table_name: {
+                    "Keys": [{"key": i} for i in keys[chunk_start:chunk_start + _BATCH_GET_MAX_KEYS]],
+                    "ConsistentRead": True,
+                },
+            }
+            retry_period = 0.05
+
+            while request:
+                response = resource.batch_get_item(RequestItems=request)
+                items.update((i["key"], i) for i in response["Responses"].get(table_name, []))
+                request = response.get("UnprocessedKeys")
+
+                if request:
+                    time.sleep(retry_period)
+                    retry_period = min(retry_period * 2, 1)
+
+        return [_DynamoDbDigestStore._item_digest(items.get(i._key)) for i in stores]
+
+    def put(self, digest: bytes, *, ttl: int) -> None:
+        self.ensure_table()
         self._table.update_item(
-            TableName=self._table_name,
-            Key={"key": key},
+            Key={"key": self._key},
             UpdateExpression="SET #value = :value, #expiry_time = :expiry_time",
             ExpressionAttributeNames={
                 "#value": "value",
                 "#expiry_time": "expiry_time",
             },
             ExpressionAttributeValues={
-                ":value": value,
-                ":expiry_time": int(time.time() + self._ttl),
+                ":value": digest,
+                ":expiry_time": int(time.time() + ttl),
             },
         )
 
@@ -127,6 +161,341 @@ def _bytes2hex(s: bytes) -> str:
     return binascii.hexlify(s).decode()
 
 
+def _fail_on_unused(opts: intf.Options) -> None:
+    opts.mark_used(_OPTIONS)
+    opts.fail_on_unused()
+
+
+def _blob_cache(opts: intf.Options) -> tp.Optional[BlobCache]:
+    # size limit in bytes of the local cache of blobs shared by all invocations on this host, 0 disables it
+    size_limit = int(opts.get("cache_size") or "0")
+    return BlobCache(size_limit=size_limit) if size_limit else None
+
+
+def _cache_key(s3: tp.Any, bk: _BucketKey) -> str:
+    return f"{s3.meta.client.meta.endpoint_url} {bk.bucket}/{bk.key}"
+
+
+def _handle_download_error(s3: tp.Any, bk: _BucketKey, e: botocore.exceptions.ClientError) -> None:
+    """
+    Return if e means the blob does not exist, raise otherwise.
+    """
+    try:
+        s3.meta.client.head_bucket(Bucket=bk.bucket)
+    except botocore.exceptions.ClientError as e2:
+        raise intf.BackendError(f"accessing bucket: {e2}")
+
+    if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+        raise intf.BackendError(e)
+
+
+def _get_object(
+    s3: tp.Any,
+    bk: _BucketKey,
+    *,
+    if_none_match: tp.Optional[str] = None,
+) -> tp.Union[None, bool, tp.Tuple[str, bytes]]:
+    """
+    Return (ETag, data), None if the blob does not exist, or False if its ETag is equal to if_none_match.
+    """
+    kw = {} if if_none_match is None else {"IfNoneMatch": if_none_match}
+
+    try:
+        response = s3.meta.client.get_object(Bucket=bk.bucket, Key=bk.key, **kw)
+        return response["ETag"], response["Body"].read()
+    except botocore.exceptions.ClientError as e:
+        if if_none_match is not None and e.response["Error"]["Code"] == "304":
+            return False
+
+        _handle_download_error(s3, bk, e)
+        return None
+    except botocore.exceptions.BotoCoreError as e:
+        raise intf.BackendError(e)
+
+
+def _download(
+    s3: tp.Any,
+    bk: _BucketKey,
+    cache: tp.Optional[BlobCache],
+    prefetched: tp.Optional[tp.Tuple[str, bytes]] = None,
+) -> tp.Optional[bytes]:
+    """
+    Download blob, revalidating its copy from the cache or prefetched (ETag, data), if any.
+    """
+    if cache is None and prefetched is None:
+        bucket = s3.Bucket(bk.bucket)
+
+        with io.BytesIO() as f:
+            try:
+                bucket.download_fileobj(bk.key, f)
+                return f.getvalue()
+            except botocore.exceptions.ClientError as e:
+                _handle_download_error(s3, bk, e)
+                return None
+            except botocore.exceptions.BotoCoreError as e:
+                raise intf.BackendError(e)
+
+    cache_key = _cache_key(s3, bk)
+    cached = (cache.get(cache_key) if cache is not None else None) or prefetched
+
+    response = _get_object(s3, bk, if_none_match=None if cached is None else cached[0])
+
+    if response is None:
+        if cache is not None:
+            cache.discard(cache_key)
+
+        return None
+
+    if response is False:
+        assert cached is not None
+        logger.debug(lambda: f"{bk.bucket}/{bk.key} is not modified, using local copy")
+
+        if cache is not None:
+            cache.mark_validated(cache_key)
+
+        return cached[1]
+
+    etag, data = tp.cast(tp.Tuple[str, bytes], response)
+
+    if cache is not None:
+        cache.put(cache_key, etag, data)
+
+    return data
+
+
+# (ETag, data) by cache key, downloaded by prefetch() for modify() in this process
+_prefetched: tp.Dict[str, tp.Tuple[str, bytes]] = {}
+_prefetched_lock = threading.Lock()
+
+
+def _pop_prefetched(cache_key: str) -> tp.Optional[tp.Tuple[str, bytes]]:
+    with _prefetched_lock:
+        return _prefetched.pop(cache_key, None)
+
+
+def _download_coalesced(
+    s3: tp.Any,
+    bk: _BucketKey,
+    cache: BlobCache,
+    coalesce_period: float,
+) -> tp.Optional[bytes]:
+    """
+    Download blob, unless it was done by any process on this host within coalesce_period seconds.
+    Concurrent calls wait for the one doing the download instead of making their own requests.
+    """
+    cache_key = _cache_key(s3, bk)
+
+    try:
+        with cache.lock(cache_key, timeout=_COALESCE_LOCK_TIMEOUT):
+            if time.time() - cache.validated_at(cache_key) < coalesce_period:
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    logger.debug(lambda: f"{bk.bucket}/{bk.key} was recently downloaded, using cached copy")
+                    return cached[1]
+
+            return _download(s3, bk, cache)
+    except filelock.Timeout:
+        logger.warning(f"timed out waiting for concurrent download of {bk.bucket}/{bk.key}")
+        return _download(s3, bk, cache)
+
+
+def _download_consistent(
+    s3: tp.Any,
+    bk: _BucketKey,
+    *,
+    cache: tp.Optional[BlobCache],
+    expected_digest: tp.Optional[bytes],
+    max_lag: int,
+    lag_retry_period: float,
+    prefetched: tp.Optional[tp.Tuple[str, bytes]] = None,
+) -> tp.Optional[bytes]:
+    """
+    Download blob, retrying for up to max_lag seconds until its digest matches expected_digest, if known.
+    """
+    if expected_digest is None:
+        return _download(s3, bk, cache, prefetched)
+
+    attempts = int(max_lag / lag_retry_period) + 1
+    logger.debug(
+        lambda: f"will make {attempts} attempts {lag_retry_period:1.1f}s each "
+        f"waiting for digest {_bytes2hex(expected_digest)}",
+    )
+
+    for attempt in range(attempts):
+        data = _download(s3, bk, cache, prefetched)
+        got_digest = _digest(data)
+        if got_digest == expected_digest:
+            break
+
+        logger.debug(lambda: f"attemp {attempt}, got digest {_bytes2hex(got_digest)}")
+        time.sleep(lag_retry_period)
+
+    return data
+
+
+# actions postponed by _delay_put, to be waited for by tests
+_postponed_threads: tp.List[threading.Thread] = []
+
+
+def _join_postponed() -> None:
+    while _postponed_threads:
+        _postponed_threads.pop().join()
+
+
+def _digest_in_lock(opts: intf.Options) -> bool:
+    # digest is carried by the lock of the blob, instead of being kept in a table of the storage backend
+    return bool(int(opts.get("digest_in_lock") or "0"))
+
+
+class _Modification:
+    """
+    Options and state of a single modify() or modify_file() call.
+    """
+
+    def __init__(self, loc: str, opts: intf.Options, digest_store: tp.Optional[intf.IDigestStore]) -> None:
+        self.opts = opts
+        session = bh.boto_session(opts)
+        self.s3 = bh.boto_resource_s3(session, opts)
+
+        # delay_put is used simulate eventual consistency of S3 in tests
+        self.delay_put = float(opts.get("_delay_put") or "0")
+        self.max_lag = int(opts.get("max_lag") or "30")
+        self.lag_retry_period = float(opts.get("lag_retry_period") or "1")
+        self.cache = _blob_cache(opts)
+
+        if _digest_in_lock(opts) and digest_store is None:
+            raise intf.BackendError("digest_in_lock requires a lock carrying blob digest, e.g. with carry_digest=1")
+
+        if self.max_lag and digest_store is None:
+            digest_store = tp.cast(intf.IDigestStore, _DynamoDbDigestStore(session, opts, loc))
+
+        self.digest_store = digest_store
+        self.bk = _BucketKey(loc)
+        _fail_on_unused(opts)
+
+    def download(self) -> tp.Optional[bytes]:
+        return _download_consistent(
+            self.s3,
+            self.bk,
+            cache=self.cache,
+            expected_digest=self.expected_digest(),
+            max_lag=self.max_lag,
+            lag_retry_period=self.lag_retry_period,
+            prefetched=_pop_prefetched(_cache_key(self.s3, self.bk)),
+        )
+
+    def expected_digest(self) -> tp.Optional[bytes]:
+        return self.digest_store.get() if self.max_lag and self.digest_store is not None else None
+
+    def commit(self, new_data: tp.Union[None, bytes, pathlib.Path], new_digest: bytes) -> None:
+        """
+        Store new_data, which is either contents of the blob, a path to a file holding them, or None to delete it.
+        """
+        bk = self.bk
+        cache = self.cache
+
+        if self.max_lag:
+            assert self.digest_store is not None
+            self.digest_store.put(new_digest, ttl=self.max_lag)
+
+        if self.delay_put and isinstance(new_data, pathlib.Path):
+            # the file may be gone by the time of postponed action
+            new_data = new_data.read_bytes()
+
+        def action(s3: tp.Any) -> None:
+            if new_data is None:
+                s3.meta.client.delete_object(Bucket=bk.bucket, Key=bk.key)
+
+                if cache is not None:
+                    cache.discard(_cache_key(s3, bk))
+            elif isinstance(new_data, pathlib.Path):
+                # multipart upload, streamed from the file
+                s3.meta.client.upload_file(str(new_data), bk.bucket, bk.key)
+
+                if cache is not None:
+                    cache.discard(_cache_key(s3, bk))
+            else:
+                response = s3.meta.client.put_object(Bucket=bk.bucket, Key=bk.key, Body=new_data)
+
+                # write through, so that subsequent reads on this host need no download
+                if cache is not None:
+                    cache.put(_cache_key(s3, bk), response["ETag"], new_data)
+
+        def postponed() -> None:
+            time.sleep(self.delay_put)
+            session = bh.boto_session(self.opts)
+            action(bh.boto_resource_s3(session, self.opts))
+
+        if self.delay_put:
+            thread = threading.Thread(target=postponed, daemon=True)
+            thread.start()
+            _postponed_threads.append(thread)
+        else:
+            action(self.s3)
+
+
+def _file_digest(path: pathlib.Path) -> bytes:
+    """
+    Same as _digest() of contents of file at path, or of None if it does not exist.
+    """
+    try:
+        f = path.open("rb")
+    except FileNotFoundError:
+        return _digest(None)
+
+    h = hashlib.sha1()
+    with f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            h.update(chunk)
+
+    return h.digest()
+
+
+def _download_file(m: _Modification, path: pathlib.Path) -> bytes:
+    """
+    Same as _download_consistent(), but streaming the blob into a file at path. Return its digest.
+    """
+    prefetched = _pop_prefetched(_cache_key(m.s3, m.bk))
+
+    if m.cache is not None or prefetched is not None:
+        # local copy is revalidated in memory
+        data = _download_consistent(
+            m.s3,
+            m.bk,
+            cache=m.cache,
+            expected_digest=m.expected_digest(),
+            max_lag=m.max_lag,
+            lag_retry_period=m.lag_retry_period,
+            prefetched=prefetched,
+        )
+
+        if data is not None:
+            path.write_bytes(data)
+
+        return _digest(data)
+
+    expected_digest = m.expected_digest()
+    attempts = int(m.max_lag / m.lag_retry_period) + 1 if expected_digest is not None else 1
+
+    for attempt in range(attempts):
+        try:
+            m.s3.meta.client.download_file(m.bk.bucket, m.bk.key, str(path))
+        except botocore.exceptions.ClientError as e:
+            _handle_download_error(m.s3, m.bk, e)
+
+            if path.exists():
+                path.unlink()
+
+        digest = _file_digest(path)
+        if expected_digest is None or digest == expected_digest:
+            break
+
+        logger.debug(lambda: f"attemp {attempt}, got digest {_bytes2hex(digest)}")
+        time.sleep(m.lag_retry_period)
+
+    return digest
+
+
 @implements.implements(intf.IStorageBackend)
 class Backend:
     @staticmethod
@@ -135,85 +504,122 @@ class Backend:
         loc: str,
         modifier: intf.StorageModifier,
         opts: intf.Options,
+        digest_store: tp.Optional[intf.IDigestStore] = None,
+    ) -> None:
+        try:
+            m = _Modification(loc, opts, digest_store)
+            data = m.download()
+            new_data = modifier(data)
+
+            if new_data != data:
+                m.commit(new_data, _digest(new_data))
+        except botocore.exceptions.ClientError as e:
+            raise intf.BackendError(e)
+        except botocore.exceptions.BotoCoreError as e:
+            raise intf.BackendError(e)
+
+    @staticmethod
+    def modify_file(
+        *,
+        loc: str,
+        path: pathlib.Path,
+        modifier: intf.StorageFileModifier,
+        opts: intf.Options,
+        digest_store: tp.Optional[intf.IDigestStore] = None,
+    ) -> None:
+        try:
+            m = _Modification(loc, opts, digest_store)
+            digest = _download_file(m, path)
+            modifier(path)
+            new_digest = _file_digest(path)
+
+            if new_digest != digest:
+                m.commit(path if path.exists() else None, new_digest)
+        except botocore.exceptions.ClientError as e:
+            raise intf.BackendError(e)
+        except botocore.exceptions.BotoCoreError as e:
+            raise intf.BackendError(e)
+
+    @staticmethod
+    def store(
+        *,
+        loc: str,
+        data: tp.Optional[bytes],
+        opts: intf.Options,
     ) -> None:
         try:
             session = bh.boto_session(opts)
             s3 = bh.boto_resource_s3(session, opts)
+            cache = _blob_cache(opts)
+            bk = _BucketKey(loc)
+            # digests are not kept for stored objects
+            _fail_on_unused(opts)
 
-            # delay_put is used simulate eventual consistency of S3 in tests
-            delay_put = float(opts.get("_delay_put") or "0")
-            max_lag = int(opts.get("max_lag") or "30")
-            lag_retry_period = float(opts.get("lag_retry_period") or "1")
-
-            if max_lag:
-                dynamo = _DynamoDbKeyValueStore(session, opts, ttl=max_lag)
-                expected_digest = dynamo.get(loc)
-                if expected_digest is None:
-                    attempts = 1
-                else:
-                    attempts = int(max_lag / lag_retry_period) + 1
-                    logger.debug(
-                        lambda: f"will make {attempts} attempts {lag_retry_period:1.1f}s each "
-                        f"waiting for digest {_bytes2hex(expected_digest)}",
-                    )
+            if data is None:
+                s3.meta.client.delete_object(Bucket=bk.bucket, Key=bk.key)
+
+                if cache is not None:
+                    cache.discard(_cache_key(s3, bk))
             else:
-                attempts = 1
+                response = s3.meta.client.put_object(Bucket=bk.bucket, Key=bk.key, Body=data)
+
+                if cache is not None:
+                    cache.put(_cache_key(s3, bk), response["ETag"], data)
+        except botocore.exceptions.ClientError as e:
+            raise intf.BackendError(e)
+        except botocore.exceptions.BotoCoreError as e:
+            raise intf.BackendError(e)
 
+    @staticmethod
+    def prefetch(
+        *,
+        loc: str,
+        opts: intf.Options,
+    ) -> None:
+        try:
+            session = bh.boto_session(opts)
+            s3 = bh.boto_resource_s3(session, opts)
+            cache = _blob_cache(opts)
             bk = _BucketKey(loc)
-            opts.fail_on_unused()
-
-            bucket = s3.Bucket(bk.bucket)
-
-            for attempt in range(attempts):
-                with io.BytesIO() as f:
-                    try:
-                        bucket.download_fileobj(bk.key, f)
-                        data: tp.Optional[bytes] = f.getvalue()
-                    except botocore.exceptions.ClientError as e:
-                        try:
-                            s3.meta.client.head_bucket(Bucket=bk.bucket)
-                        except botocore.exceptions.ClientError as e2:
-                            raise intf.BackendError(f"accessing bucket: {e2}")
-
-                        if e.response["Error"]["Code"] == "404":
-                            data = None
-                        else:
-                            raise intf.BackendError(e)
-                    except botocore.exceptions.BotoCoreError as e:
-                        raise intf.BackendError(e)
 
-                if max_lag:
-                    got_digest = _digest(data)
-                    if got_digest == expected_digest:
-                        break
+            if cache is not None:
+                # modify() will revalidate the cached copy
+                _download(s3, bk, cache)
+                return
 
-                    logger.debug(lambda: f"attemp {attempt}, got digest {_bytes2hex(got_digest)}")
-                    time.sleep(lag_retry_period)
+            response = _get_object(s3, bk)
+            if response is not None:
+                with _prefetched_lock:
+                    _prefetched[_cache_key(s3, bk)] = tp.cast(tp.Tuple[str, bytes], response)
+        except Exception as e:
+            logger.debug(f"prefetching {loc}: {e}")
 
-            new_data = modifier(data)
+    @staticmethod
+    def load(
+        *,
+        loc: str,
+        opts: intf.Options,
+    ) -> bytes:
+        try:
+            session = bh.boto_session(opts)
+            s3 = bh.boto_resource_s3(session, opts)
+            cache = _blob_cache(opts)
+            # reuse blob downloaded by another process on this host within this number of seconds
+            coalesce_period = float(opts.get("coalesce_period") or "0")
+            _fail_on_unused(opts)
+            bk = _BucketKey(loc)
 
-            if new_data != data:
-                if max_lag:
-                    new_digest = _digest(new_data)
-                    dynamo.put(loc, new_digest)
-
-                def action(bucket: tp.Any) -> None:
-                    if new_data is None:
-                        bucket.Object(bk.key).delete()
-                    else:
-                        bucket.put_object(Key=bk.key, Body=new_data)
-
-                def postponed() -> None:
-                    time.sleep(delay_put)
-                    session = bh.boto_session(opts)
-                    s3 = bh.boto_resource_s3(session, opts)
-                    bucket = s3.Bucket(bk.bucket)
-                    action(bucket)
-
-                if delay_put:
-                    threading.Thread(target=postponed, daemon=True).start()
-                else:
-                    action(bucket)
+            if coalesce_period:
+                if cache is None:
+                    raise intf.BackendError("coalesce_period requires cache_size")
+
+                data = _download_coalesced(s3, bk, cache, coalesce_period)
+            else:
+                data = _download(s3, bk, cache)
+            if data is None:
+                raise intf.BackendError(f"{bk.key} does not exist in {bk.bucket}")
+
+            return data
 
         except botocore.exceptions.ClientError as e:
             raise intf.BackendError(e)
@@ -221,22 +627,158 @@ class Backend:
             raise intf.BackendError(e)
 
     @staticmethod
-    def load(
+    def load_file(
         *,
         loc: str,
+        path: pathlib.Path,
         opts: intf.Options,
-    ) -> bytes:
+    ) -> None:
+        if _blob_cache(opts) is not None or opts.get("coalesce_period"):
+            # local copies are kept in memory anyway
+            path.write_bytes(Backend.load(loc=loc, opts=opts))
+            return
+
         try:
             session = bh.boto_session(opts)
             s3 = bh.boto_resource_s3(session, opts)
-            opts.fail_on_unused()
+            _fail_on_unused(opts)
             bk = _BucketKey(loc)
 
-            bucket = s3.Bucket(bk.bucket)
+            try:
+                # multipart download, streamed into the file
+                s3.meta.client.download_file(bk.bucket, bk.key, str(path))
+            except botocore.exceptions.ClientError as e:
+                _handle_download_error(s3, bk, e)
+                raise intf.BackendError(f"{bk.key} does not exist in {bk.bucket}")
+        except botocore.exceptions.ClientError as e:
+            raise intf.BackendError(e)
+        except botocore.exceptions.BotoCoreError as e:
+            raise intf.BackendError(e)
 
-            with io.BytesIO() as f:
-                bucket.download_fileobj(bk.key, f)
-                return f.getvalue()
+    @staticmethod
+    def glob(
+        *,
+        loc: str,
+        opts: intf.Options,
+    ) -> tp.List[str]:
+        try:
+            session = bh.boto_session(opts)
+            s3 = bh.boto_resource_s3(session, opts)
+            bk = _BucketKey(loc)
+            result: tp.List[str] = []
+
+            paginator = s3.meta.client.get_paginator("list_objects_v2")
+
+            for page in paginator.paginate(Bucket=bk.bucket, Prefix=intf.glob_prefix(bk.key)):
+                for i in page.get("Contents", ()):
+                    # keys ending with a slash are directory placeholders rather than blobs
+                    if not i["Key"].endswith("/") and fnmatch.fnmatchcase(i["Key"], bk.key):
+                        result.append(f"{bk.bucket}/{i['Key']}")
+
+            return result
+        except botocore.exceptions.ClientError as e:
+            raise intf.BackendError(e)
+        except botocore.exceptions.BotoCoreError as e:
+            raise intf.BackendError(e)
+
+    @staticmethod
+    def load_consistent(
+        *,
+        locs: tp.Sequence[tp.Tuple[str, intf.Options]],
+    ) -> tp.List[tp.Union[bytes, intf.BackendError]]:
+        result: tp.List[tp.Union[bytes, intf.BackendError]] = []
+        prepared: tp.Dict[int, tp.Tuple[intf.Options, _BucketKey, tp.Optional[BlobCache], int, float]] = {}
+        digest_stores: tp.Dict[int, _DynamoDbDigestStore] = {}
+
+        for i, (loc, opts) in enumerate(locs):
+            try:
+                session = bh.boto_session(opts)
+                max_lag = int(opts.get("max_lag") or "30")
+                lag_retry_period = float(opts.get("lag_retry_period") or "1")
+                cache = _blob_cache(opts)
+
+                if _digest_in_lock(opts):
+                    raise intf.BackendError("digest of this blob is carried by its lock, which must be held to load it")
+
+                if max_lag:
+                    digest_stores[i] = _DynamoDbDigestStore(session, opts, loc)
+
+                bk = _BucketKey(loc)
+                _fail_on_unused(opts)
+            except intf.BackendError as e:
+                digest_stores.pop(i, None)
+                result.append(e)
+                continue
+            except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+                digest_stores.pop(i, None)
+                result.append(intf.BackendError(e))
+                continue
+
+            prepared[i] = opts, bk, cache, max_lag, lag_retry_period
+            result.append(b"")
+
+        batches: tp.Dict[tp.Tuple[str, str], tp.List[int]] = {}
+        for i, digest_store in digest_stores.items():
+            batches.setdefault(digest_store.batch_id, []).append(i)
+
+        expected_digests: tp.Dict[int, tp.Optional[bytes]] = {}
+        for batch in batches.values():
+            try:
+                expected_digests.update(zip(batch, _DynamoDbDigestStore.batch_get([digest_stores[i] for i in batch])))
+            except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+                for i in batch:
+                    prepared.pop(i)
+                    result[i] = intf.BackendError(f"getting digest: {e}")
+
+        def download(i: int) -> None:
+            opts, bk, cache, max_lag, lag_retry_period = prepared[i]
+
+            try:
+                # boto3 sessions and resources are not thread safe, so each worker makes its own, or reuses pooled ones
+                s3 = bh.boto_resource_s3(bh.boto_session(opts), opts)
+                data = _download_consistent(
+                    s3,
+                    bk,
+                    cache=cache,
+                    expected_digest=expected_digests.get(i),
+                    max_lag=max_lag,
+                    lag_retry_period=lag_retry_period,
+                )
+            except intf.BackendError as e:
+                result[i] = e
+                return
+            except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+                result[i] = intf.BackendError(e)
+                return
+
+            result[i] = intf.BackendError(f"{bk.key} does not exist in {bk.bucket}") if data is None else data
+
+        if prepared:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(prepared), _MAX_DOWNLOAD_WORKERS)) as tpe:
+                list(tpe.map(download, prepared))
+
+        return result
+
+    @staticmethod
+    def provision(
+        *,
+        loc: str,
+        opts: intf.Options,
+    ) -> None:
+        try:
+            session = bh.boto_session(opts)
+            bh.boto_resource_s3(session, opts)
+
+            _blob_cache(opts)
+            max_lag = int(opts.get("max_lag") or "30")
+
+            digest_store = _DynamoDbDigestStore(session, opts, loc) if max_lag and not _digest_in_lock(opts) else None
+
+            _BucketKey(loc)
+            _fail_on_unused(opts)
+
+            if digest_store is not None:
+                digest_store.ensure_table(force=True)
 
         except botocore.exceptions.ClientError as e:
             raise intf.BackendError(e)
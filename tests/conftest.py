@@ -1,3 +1,4 @@
+import pathlib
 import time
 import typing as tp
 
@@ -5,6 +6,14 @@ import boto3
 import common
 import pytest
 import with_cloud_blob.backend_intf as intf
+import with_cloud_blob.backends.storage_s3
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path: pathlib.Path, monkeypatch: tp.Any) -> pathlib.Path:
+    path = tmp_path / "cache"
+    monkeypatch.setenv("WITH_CLOUD_BLOB_CACHE_DIR", str(path))
+    return path
 
 
 @pytest.fixture
@@ -17,6 +26,8 @@ def s3_bucket() -> tp.Any:
     try:
         yield bucket
     finally:
+        # writes postponed by _delay_put must not outlive the bucket
+        with_cloud_blob.backends.storage_s3._join_postponed()
         bucket.objects.all().delete()
         bucket.delete()
 
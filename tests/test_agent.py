@@ -0,0 +1,163 @@
+import pathlib
+import socket
+import stat
+import threading
+import time
+import typing as tp
+
+import with_cloud_blob._agent as agent_module
+import with_cloud_blob.backend_intf as intf
+import with_cloud_blob.backends._boto_helpers
+import with_cloud_blob._cli
+import with_cloud_blob._modify
+from with_cloud_blob._cli import root
+
+
+def test_agent(tmp_path: pathlib.Path, capfd: tp.Any, monkeypatch: tp.Any) -> None:
+    sock = tmp_path / "agent.sock"
+    monkeypatch.setenv("WITH_CLOUD_BLOB_AGENT_SOCKET", str(sock))
+    # pooling enabled by the agent must not outlive this test
+    monkeypatch.setattr(with_cloud_blob.backends._boto_helpers, "_pool", None)
+    blob = tmp_path / "blob"
+    blob.write_text("A")
+
+    agent = agent_module.Agent(max_age=60, cache_size=1024)
+    thread = threading.Thread(target=agent.serve, args=(sock,))
+    thread.start()
+
+    try:
+        while not sock.exists():
+            time.sleep(0.01)
+
+        assert stat.S_IMODE(sock.stat().st_mode) == 0o600
+        assert agent_module.load([("file", str(blob), {})], consistent=False) == [b"A"]
+
+        # served from memory within max_age, unless consistent
+        blob.write_text("B")
+        root(["read", f"--blob=b=:file:{blob}", "--", "cat", "b"], standalone_mode=False)
+        root(["read", "--consistent", f"--blob=b=:file:{blob}", "--", "cat", "b"], standalone_mode=False)
+        assert capfd.readouterr().out == "AB"
+
+        # group commit made by the agent is not hidden by its memory
+        root(["modify", "--group-commit", f":file:{blob}", "--", "sh", "-c", "echo C > blob"], standalone_mode=False)
+        root(["read", f"--blob=b=:file:{blob}", "--", "cat", "b"], standalone_mode=False)
+        assert capfd.readouterr().out == "C\n"
+
+        result = agent_module.load([("nosuch", "x", {}), ("file", str(blob), {"x": "y"})], consistent=False)
+        assert result is not None
+        assert all(isinstance(i, intf.BackendError) for i in result)
+
+        # relative to the current directory of the client
+        monkeypatch.chdir(tmp_path)
+        loc = with_cloud_blob._cli.Locator(backend="file", opts=intf.Options({}), loc="blob")
+        assert with_cloud_blob._cli.agent_loc(loc) == ("file", str(blob), {})
+
+        # loads with other credentials are not served by the agent
+        monkeypatch.setenv("AWS_PROFILE", "other")
+        assert agent_module.load([("file", str(blob), {})], consistent=False) is None
+    finally:
+        agent.shutdown()
+        thread.join()
+
+    assert not sock.exists()
+    assert agent_module.load([("file", str(blob), {})], consistent=False) is None
+
+
+def test_agent_timeout(tmp_path: pathlib.Path, monkeypatch: tp.Any) -> None:
+    sock_path = tmp_path / "agent.sock"
+    monkeypatch.setenv("WITH_CLOUD_BLOB_AGENT_SOCKET", str(sock_path))
+    monkeypatch.setattr(agent_module, "_TIMEOUT", 0.1)
+    blob = tmp_path / "blob"
+
+    # connections are accepted by the kernel, but never answered
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as wedged:
+        wedged.bind(str(sock_path))
+        wedged.listen(4)
+
+        assert agent_module.load([("file", str(blob), {})], consistent=False) is None
+        assert not agent_module.modify(("file", str(blob), {}), [], lambda data: b"", first_timeout=1, timeout_step=1)
+
+
+def test_agent_group_commit(tmp_path: pathlib.Path, monkeypatch: tp.Any) -> None:
+    sock = tmp_path / "agent.sock"
+    monkeypatch.setenv("WITH_CLOUD_BLOB_AGENT_SOCKET", str(sock))
+    monkeypatch.setattr(with_cloud_blob.backends._boto_helpers, "_pool", None)
+    monkeypatch.setattr(agent_module, "_TIMEOUT", 0.5)
+    monkeypatch.setattr(agent_module, "_KEEPALIVE_PERIOD", 0.1)
+    blob = tmp_path / "blob"
+    storage: agent_module.AgentLoc = ("file", str(blob), {})
+
+    commits = []
+    modify_with_locks = with_cloud_blob._modify.modify_with_locks
+
+    def counting_modify_with_locks(**kw: tp.Any) -> None:
+        # all made by the agent, as clients leave them to it
+        commits.append(kw["storage"].loc)
+        modify_with_locks(**kw)
+
+    monkeypatch.setattr(with_cloud_blob._modify, "modify_with_locks", counting_modify_with_locks)
+
+    started = threading.Event()
+    release = threading.Event()
+    errors: tp.List[BaseException] = []
+
+    def appending(suffix: bytes, wait: bool = False) -> tp.Callable[[tp.Optional[bytes]], tp.Optional[bytes]]:
+        def modifier(data: tp.Optional[bytes]) -> tp.Optional[bytes]:
+            if wait:
+                started.set()
+                release.wait()
+
+            return (data or b"") + suffix
+
+        return modifier
+
+    def failing(data: tp.Optional[bytes]) -> tp.Optional[bytes]:
+        raise RuntimeError("failed")
+
+    def modify(modifier: tp.Callable[[tp.Optional[bytes]], tp.Optional[bytes]]) -> None:
+        try:
+            assert agent_module.modify(storage, [], modifier, first_timeout=1, timeout_step=1)
+        except BaseException as e:
+            errors.append(e)
+
+    assert not agent_module.modify(storage, [], failing, first_timeout=1, timeout_step=1)
+
+    agent = agent_module.Agent(max_age=0, cache_size=0)
+    thread = threading.Thread(target=agent.serve, args=(sock,))
+    thread.start()
+
+    try:
+        while not sock.exists():
+            time.sleep(0.01)
+
+        threads = [threading.Thread(target=modify, args=(appending(b"a", wait=True),))]
+        threads[0].start()
+        started.wait()
+
+        # queued while the first group commit is running, and committed together
+        for i, modifier in enumerate([appending(b"b"), failing, appending(b"c")]):
+            threads.append(threading.Thread(target=modify, args=(modifier,)))
+            threads[-1].start()
+
+            # one at a time, so that they are queued in order
+            while len(next(iter(agent._modify_queues.values()), [])) <= i:
+                time.sleep(0.01)
+
+        # waiting clients are kept alive
+        time.sleep(1)
+
+        release.set()
+
+        for t in threads:
+            t.join()
+
+        assert blob.read_bytes() == b"abc"
+        assert commits == [str(blob)] * 2
+        assert [str(i) for i in errors] == ["failed"]
+
+        root(["modify", "--group-commit", f":file:{blob}", "--", "sh", "-c", "echo d >> blob"], standalone_mode=False)
+        assert blob.read_bytes() == b"abcd\n"
+        assert len(commits) == 3
+    finally:
+        agent.shutdown()
+        thread.join()
@@ -1,3 +1,6 @@
+import os
+import pathlib
+import time
 import typing as tp
 
 import pytest
@@ -42,3 +45,176 @@ def test_mapped_update() -> None:
         "kw2": "val2",
         "kw3": "val3a",
     }
+
+
+def test_lock_wait() -> None:
+    reports: tp.List[float] = []
+    wait = intf.LockWait(timeout=0.3, first_report=0.1, report_period=0.1, report=reports.append)
+
+    with pytest.raises(intf.TimeoutError):
+        while True:
+            delay = wait.step()
+            assert 0 < delay <= 0.1
+            time.sleep(delay)
+
+    assert 1 <= len(reports) <= 2
+    assert all(0 < i < 0.3 for i in reports)
+
+
+@pytest.mark.parametrize('compress', ["zlib", "zlib:9", "lzma:1"])
+def test_compression(tmp_path: pathlib.Path, compress: str) -> None:
+    backend = be.storage_backend("file")
+    path = tmp_path / "file1"
+    data = b"abc" * 1000
+
+    backend.modify(loc=str(path), modifier=lambda old: data, opts=intf.Options({"compress": compress}))
+    assert len(path.read_bytes()) < len(data)
+
+    # codec is detected regardless of options
+    assert backend.load(loc=str(path), opts=intf.Options({})) == data
+    assert backend.load_consistent(locs=[(str(path), intf.Options({}))]) == [data]
+
+    # unchanged blob is not rewritten, plain one is read as is
+    stored = path.read_bytes()
+    backend.modify(loc=str(path), modifier=lambda old: old, opts=intf.Options({}))
+    assert path.read_bytes() == stored
+
+    backend.modify(loc=str(path), modifier=lambda old: (old or b"") + b"d", opts=intf.Options({}))
+    assert path.read_bytes() == data + b"d"
+    assert backend.load(loc=str(path), opts=intf.Options({"compress": compress})) == data + b"d"
+
+
+def test_compression_file_workspace(tmp_path: pathlib.Path) -> None:
+    backend = be.storage_backend("file")
+    path = tmp_path / "file1"
+    ws = tmp_path / "ws"
+    ws.mkdir()
+    opts = {"compress": "zlib"}
+    seen: tp.List[tp.List[str]] = []
+
+    def modifier(p: pathlib.Path) -> None:
+        seen.append(sorted(i.name for i in ws.iterdir()))
+        p.write_bytes(b"abc")
+
+    backend.modify(loc=str(path), modifier=lambda old: b"a", opts=intf.Options(opts))
+
+    # stored contents are kept aside outside of the directory the command works in
+    backend.modify_file(loc=str(path), path=ws / "x", modifier=modifier, opts=intf.Options(opts))
+    assert seen == [["x"]]
+    assert backend.load(loc=str(path), opts=intf.Options({})) == b"abc"
+
+    backend.load_file(loc=str(path), path=ws / "y", opts=intf.Options({}))
+    assert sorted(i.name for i in ws.iterdir()) == ["y"]
+    assert (ws / "y").read_bytes() == b"abc"
+
+    def rewriter(p: pathlib.Path) -> None:
+        # same size rewrite in place, within the resolution of coarse timestamps
+        st = p.stat()
+        with p.open("r+b") as f:
+            f.write(b"xyz")
+        os.utime(p, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    for i in [opts, tp.cast(tp.Dict[str, str], {})]:
+        backend.modify_file(loc=str(path), path=ws / "z", modifier=rewriter, opts=intf.Options(i))
+        assert backend.load(loc=str(path), opts=intf.Options({})) == b"xyz"
+        backend.modify(loc=str(path), modifier=lambda old: b"abc", opts=intf.Options(i))
+
+
+def test_compression_bad_opts(tmp_path: pathlib.Path) -> None:
+    backend = be.storage_backend("file")
+
+    for compress in ["bzip2", "zlib:x"]:
+        with pytest.raises(intf.BackendError):
+            backend.modify(
+                loc=str(tmp_path / "file1"),
+                modifier=lambda old: b"",
+                opts=intf.Options({"compress": compress}),
+            )
+
+    # options are checked per blob, and the other ones are still loaded
+    (tmp_path / "file2").write_bytes(b"x")
+    locs = [
+        (str(tmp_path / "file2"), intf.Options({"compress": "bzip2"})),
+        (str(tmp_path / "file2"), intf.Options({})),
+    ]
+    result = backend.load_consistent(locs=locs)
+    assert isinstance(result[0], intf.BackendError)
+    assert result[1] == b"x"
+
+
+def test_compression_unknown_codec(tmp_path: pathlib.Path) -> None:
+    backend = be.storage_backend("file")
+    path = tmp_path / "file1"
+
+    # plain data which merely starts like a compressed blob is not mistaken for one
+    for data in [b"\x89WCB\r\n\x1a\nbzip2\nabc", b"\x89WCB\r\n\x1a\nabc"]:
+        path.write_bytes(data)
+        assert backend.load(loc=str(path), opts=intf.Options({})) == data
+        assert backend.load_consistent(locs=[(str(path), intf.Options({}))]) == [data]
+
+
+def test_delta_log(tmp_path: pathlib.Path) -> None:
+    backend = be.storage_backend("file")
+    path = tmp_path / "file1"
+    opts_dict = {"delta_log": "2", "delta_log_size": "100"}
+
+    def side_objects() -> tp.List[str]:
+        # kinds of objects named like file1.wcb-<kind>-<generation>[-<index>]
+        return sorted(i.name.split("-")[1] for i in tmp_path.iterdir() if i.name != "file1")
+
+    path.write_bytes(b"base")
+    for i in range(4):
+        backend.modify(loc=str(path), modifier=lambda old: (old or b"") + b" %d" % i, opts=intf.Options(opts_dict))
+
+    # converted on the first change, compacted on the fourth one
+    assert side_objects() == ["base"]
+    assert backend.load(loc=str(path), opts=intf.Options({})) == b"base 0 1 2 3"
+    assert backend.glob(loc=str(tmp_path / "*"), opts=intf.Options({})) == [str(path)]
+
+    # existing log is kept by default, and too large delta causes compaction
+    backend.modify(loc=str(path), modifier=lambda old: b"x" * 200, opts=intf.Options({}))
+    assert side_objects() == ["base"]
+
+    backend.modify(loc=str(path), modifier=lambda old: b"y" + (old or b"")[1:], opts=intf.Options({}))
+    assert side_objects() == ["base", "delta"]
+    assert path.stat().st_size < 100
+    assert backend.load_consistent(locs=[(str(path), intf.Options({}))]) == [b"y" + b"x" * 199]
+
+    backend.modify(loc=str(path), modifier=lambda old: old, opts=intf.Options({"delta_log": "0"}))
+    assert side_objects() == ["base", "delta"]
+
+    # left behind by modifications which failed after putting them
+    (tmp_path / "file1.wcb-base-0123").write_bytes(b"orphan")
+    (tmp_path / "file1.wcb-delta-0123-5").write_bytes(b"orphan")
+
+    backend.modify(loc=str(path), modifier=lambda old: b"plain", opts=intf.Options({"delta_log": "0"}))
+    assert side_objects() == []
+    assert path.read_bytes() == b"plain"
+
+
+@pytest.mark.parametrize('opts_dict', [{}, {"compress": "zlib"}, {"compress": "lzma", "delta_log": "2"}])
+def test_modify_file(tmp_path: pathlib.Path, opts_dict: tp.Dict[str, str]) -> None:
+    backend = be.storage_backend("file")
+    loc = str(tmp_path / "file1")
+    work_path = tmp_path / "work"
+    data = b"abc" * 1000
+
+    def modifier(path: pathlib.Path) -> None:
+        with path.open("ab") as f:
+            f.write(data)
+
+    for i in range(3):
+        backend.modify_file(loc=loc, path=work_path, modifier=modifier, opts=intf.Options(opts_dict))
+
+    assert backend.load(loc=loc, opts=intf.Options({})) == data * 3
+
+    backend.load_file(loc=loc, path=tmp_path / "loaded", opts=intf.Options({}))
+    assert (tmp_path / "loaded").read_bytes() == data * 3
+    (tmp_path / "loaded").unlink()
+
+    stored = (tmp_path / "file1").read_bytes()
+    backend.modify_file(loc=loc, path=work_path, modifier=lambda path: None, opts=intf.Options(opts_dict))
+    assert (tmp_path / "file1").read_bytes() == stored
+
+    backend.modify_file(loc=loc, path=work_path, modifier=lambda path: path.unlink(), opts=intf.Options(opts_dict))
+    assert [i.name for i in tmp_path.iterdir()] == []
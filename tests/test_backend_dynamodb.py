@@ -0,0 +1,180 @@
+import pathlib
+import threading
+import time
+import typing as tp
+
+import boto3
+import common
+import pytest
+import with_cloud_blob.backend_intf as intf
+import with_cloud_blob.backends._boto_helpers
+import with_cloud_blob.backends.lock_dynamodb
+
+
+lock_backend = tp.cast(intf.ILockBackend, with_cloud_blob.backends.lock_dynamodb.Backend)
+
+
+def _opts(**kwargs: str) -> intf.Options:
+    return intf.Options({
+        "dynamodb_endpoint": common.DYNAMODB_ENDPOINT,
+        "region": "us-east-1",
+        **kwargs,
+    })
+
+
+def _wait(timeout: float) -> intf.LockWait:
+    return intf.LockWait(timeout=timeout, first_report=timeout, report_period=timeout, report=lambda remaining: None)
+
+
+@pytest.fixture
+def lock_loc() -> str:
+    return f"with-cloud-blob-test-{time.time_ns()}"
+
+
+def test_bad_heartbeat_period(lock_loc: str) -> None:
+    with pytest.raises(intf.BackendError):
+        lock_backend.make_lock(
+            loc=lock_loc,
+            opts=_opts(lease_duration="5", heartbeat_period="5"),
+            wait=_wait(0),
+        )
+
+
+def test_shared(lock_loc: str) -> None:
+    with lock_backend.make_lock(loc=lock_loc, opts=_opts(), wait=_wait(0), shared=True):
+        with lock_backend.make_lock(loc=lock_loc, opts=_opts(), wait=_wait(0), shared=True):
+            with pytest.raises(intf.TimeoutError):
+                with lock_backend.make_lock(loc=lock_loc, opts=_opts(), wait=_wait(0.5)):
+                    pass  # pragma: no cover
+
+    with lock_backend.make_lock(loc=lock_loc, opts=_opts(), wait=_wait(0)):
+        with pytest.raises(intf.TimeoutError):
+            with lock_backend.make_lock(loc=lock_loc, opts=_opts(), wait=_wait(0.5), shared=True):
+                pass  # pragma: no cover
+
+
+def test_abandoned_reader(lock_loc: str) -> None:
+    table = boto3.Session().resource(
+        "dynamodb",
+        endpoint_url=common.DYNAMODB_ENDPOINT,
+        region_name="us-east-1",
+    ).Table("DynamoDBLockTable")
+
+    with lock_backend.make_lock(loc=lock_loc, opts=_opts(), wait=_wait(0), shared=True):
+        pass
+
+    # as if a reader with 1s lease has crashed
+    table.update_item(
+        Key={"lock_key": lock_loc, "sort_key": "-"},
+        UpdateExpression="SET #readers.#ghost = :entry",
+        ExpressionAttributeNames={"#readers": "readers", "#ghost": "ghost"},
+        ExpressionAttributeValues={":entry": "0 1"},
+    )
+
+    start = time.monotonic()
+    with lock_backend.make_lock(loc=lock_loc, opts=_opts(), wait=_wait(10)):
+        assert time.monotonic() - start >= 1
+
+
+def test_reader_heartbeat(lock_loc: str) -> None:
+    opts = {"lease_duration": "1", "heartbeat_period": "0.2"}
+
+    with lock_backend.make_lock(loc=lock_loc, opts=_opts(**opts), wait=_wait(0), shared=True):
+        # live reader is not mistaken for an abandoned one
+        with pytest.raises(intf.TimeoutError):
+            with lock_backend.make_lock(loc=lock_loc, opts=_opts(**opts), wait=_wait(2)):
+                pass  # pragma: no cover
+
+
+def test_writer_waiting(lock_loc: str) -> None:
+    opts = {"retry_period": "0.05", "max_retry_period": "0.1"}
+    acquired = threading.Event()
+
+    def writer() -> None:
+        with lock_backend.make_lock(loc=lock_loc, opts=_opts(**opts), wait=_wait(10)):
+            acquired.set()
+
+    with lock_backend.make_lock(loc=lock_loc, opts=_opts(**opts), wait=_wait(0), shared=True):
+        thread = threading.Thread(target=writer)
+        thread.start()
+        time.sleep(0.5)
+
+        # once a writer waits, new readers wait for it, rather than keeping it waiting indefinitely
+        with pytest.raises(intf.TimeoutError):
+            with lock_backend.make_lock(loc=lock_loc, opts=_opts(**opts), wait=_wait(0.5), shared=True):
+                pass  # pragma: no cover
+
+        assert not acquired.is_set()
+
+    thread.join()
+    assert acquired.is_set()
+
+    with lock_backend.make_lock(loc=lock_loc, opts=_opts(**opts), wait=_wait(0), shared=True):
+        pass
+
+    # writer which gives up lets readers in right away, rather than once its mark lapses
+    with lock_backend.make_lock(loc=lock_loc, opts=_opts(), wait=_wait(0), shared=True):
+        with pytest.raises(intf.TimeoutError):
+            with lock_backend.make_lock(loc=lock_loc, opts=_opts(**opts), wait=_wait(0.5)):
+                pass  # pragma: no cover
+
+        with lock_backend.make_lock(loc=lock_loc, opts=_opts(), wait=_wait(0), shared=True):
+            pass
+
+
+def test_carry_digest(lock_loc: str) -> None:
+    table = boto3.Session().resource(
+        "dynamodb",
+        endpoint_url=common.DYNAMODB_ENDPOINT,
+        region_name="us-east-1",
+    ).Table("DynamoDBLockTable")
+    key = {"lock_key": lock_loc, "sort_key": "-"}
+    opts = {"carry_digest": "1"}
+
+    with lock_backend.make_lock(loc=lock_loc, opts=_opts(**opts), wait=_wait(0)) as digest_store:
+        assert digest_store is not None
+        assert digest_store.get() is None
+        digest_store.put(b"A", ttl=2 * 3600)
+
+    # TTL never deletes the item carrying the digest
+    assert "expiry_time" not in table.get_item(Key=key, ConsistentRead=True)["Item"]
+
+    with lock_backend.make_lock(loc=lock_loc, opts=_opts(**opts), wait=_wait(0), shared=True) as digest_store:
+        assert digest_store is not None
+        assert digest_store.get() == b"A"
+
+    assert "expiry_time" not in table.get_item(Key=key, ConsistentRead=True)["Item"]
+
+    # failed modification publishes nothing, and discards the digest it may have invalidated
+    with pytest.raises(ValueError):
+        with lock_backend.make_lock(loc=lock_loc, opts=_opts(**opts), wait=_wait(0)) as digest_store:
+            assert digest_store is not None
+            digest_store.put(b"B", ttl=60)
+            raise ValueError()
+
+    with lock_backend.make_lock(loc=lock_loc, opts=_opts(**opts), wait=_wait(0)) as digest_store:
+        assert digest_store is not None
+        assert digest_store.get() is None
+
+
+def test_unusable_cache_dir(lock_loc: str, tmp_path: pathlib.Path, monkeypatch: tp.Any) -> None:
+    # remembering known tables is an optimization, which must not get in the way
+    (tmp_path / "file").write_text("")
+    monkeypatch.setenv("WITH_CLOUD_BLOB_CACHE_DIR", str(tmp_path / "file" / "cache"))
+    monkeypatch.setattr(with_cloud_blob.backends._boto_helpers, "_known_dynamodb_tables", None)
+
+    with lock_backend.make_lock(loc=lock_loc, opts=_opts(), wait=_wait(0)):
+        pass
+
+    monkeypatch.delenv("WITH_CLOUD_BLOB_CACHE_DIR")
+    monkeypatch.delenv("XDG_CACHE_HOME", raising=False)
+    monkeypatch.delenv("HOME")
+
+    def no_home() -> pathlib.Path:
+        raise KeyError("getpwuid(): uid not found")
+
+    monkeypatch.setattr(pathlib.Path, "home", no_home)
+    monkeypatch.setattr(with_cloud_blob.backends._boto_helpers, "_known_dynamodb_tables", None)
+
+    with lock_backend.make_lock(loc=lock_loc, opts=_opts(), wait=_wait(0)):
+        pass
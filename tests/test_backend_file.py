@@ -1,6 +1,11 @@
 import contextlib
+import fcntl
 import os
 import pathlib
+import signal
+import stat
+import threading
+import time
 import typing as tp
 
 import filelock
@@ -17,6 +22,10 @@ storage_backend = tp.cast(intf.IStorageBackend, with_cloud_blob.backends.storage
 lock_backend = tp.cast(intf.ILockBackend, with_cloud_blob.backends.lock_file.Backend)
 
 
+def _no_wait() -> intf.LockWait:
+    return intf.LockWait(timeout=0, first_report=0, report_period=0, report=lambda remaining: None)
+
+
 def test_read(tmp_path: pathlib.Path) -> None:
     path = tmp_path / "file1"
     path.write_bytes(DATA)
@@ -37,8 +46,9 @@ def test_read_nonexistent(tmp_path: pathlib.Path) -> None:
         storage_backend.load(loc=str(path), opts=intf.Options({}))
 
 
+@pytest.mark.parametrize('engine', ["flock", "filelock"])
 @pytest.mark.parametrize('count', [1, 5, 50])
-def test_lock(tmp_path: pathlib.Path, count: int) -> None:
+def test_lock(tmp_path: pathlib.Path, count: int, engine: str) -> None:
     path = tmp_path / "file1"
 
     with contextlib.ExitStack() as es:
@@ -48,8 +58,8 @@ def test_lock(tmp_path: pathlib.Path, count: int) -> None:
             es.enter_context(
                 lock_backend.make_lock(
                     loc=lock_name,
-                    opts=intf.Options({}),
-                    timeout=0,
+                    opts=intf.Options({"engine": engine}),
+                    wait=_no_wait(),
                 ),
             )
             assert pathlib.Path(lock_fname).exists()
@@ -59,7 +69,8 @@ def test_lock(tmp_path: pathlib.Path, count: int) -> None:
                     pass  # pragma: no cover
 
 
-def test_lock_timeout(tmp_path: pathlib.Path) -> None:
+@pytest.mark.parametrize('engine', ["flock", "filelock"])
+def test_lock_timeout(tmp_path: pathlib.Path, engine: str) -> None:
     path = tmp_path / "file1"
 
     lock_fname = f"{path}.lock"
@@ -67,10 +78,129 @@ def test_lock_timeout(tmp_path: pathlib.Path) -> None:
         with pytest.raises(intf.TimeoutError):
             with lock_backend.make_lock(
                     loc=str(path),
-                    opts=intf.Options({}),
-                    timeout=0,
+                    opts=intf.Options({"engine": engine}),
+                    wait=_no_wait(),
+            ):
+                pass  # pragma: no cover
+
+
+def test_lock_shared(tmp_path: pathlib.Path) -> None:
+    path = tmp_path / "file1"
+    opts = {"engine": "flock"}
+
+    with lock_backend.make_lock(loc=str(path), opts=intf.Options(opts), wait=_no_wait(), shared=True):
+        with lock_backend.make_lock(loc=str(path), opts=intf.Options(opts), wait=_no_wait(), shared=True):
+            with pytest.raises(intf.TimeoutError):
+                with lock_backend.make_lock(loc=str(path), opts=intf.Options(opts), wait=_no_wait()):
+                    pass  # pragma: no cover
+
+    with lock_backend.make_lock(loc=str(path), opts=intf.Options(opts), wait=_no_wait()):
+        with pytest.raises(intf.TimeoutError):
+            with lock_backend.make_lock(loc=str(path), opts=intf.Options(opts), wait=_no_wait(), shared=True):
+                pass  # pragma: no cover
+
+
+def test_lock_flock_wakeup(tmp_path: pathlib.Path) -> None:
+    path = tmp_path / "file1"
+    reports: tp.List[float] = []
+    released: tp.List[float] = []
+
+    holder = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT)
+    fcntl.flock(holder, fcntl.LOCK_EX)
+
+    def release() -> None:
+        released.append(time.monotonic())
+        os.close(holder)
+
+    timer = threading.Timer(0.5, release)
+    timer.start()
+
+    try:
+        with lock_backend.make_lock(
+                loc=str(path),
+                opts=intf.Options({"engine": "flock"}),
+                wait=intf.LockWait(timeout=10, first_report=0.2, report_period=5, report=reports.append),
+        ):
+            acquired = time.monotonic()
+    finally:
+        timer.join()
+
+    # woken up by the release rather than by the next report
+    assert len(reports) == 1
+    assert acquired - released[0] < 0.2
+
+
+def test_lock_flock_keeps_alarm(tmp_path: pathlib.Path) -> None:
+    path = tmp_path / "file1"
+    alarms: tp.List[float] = []
+
+    holder = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT)
+    fcntl.flock(holder, fcntl.LOCK_EX)
+    old_handler = signal.signal(signal.SIGALRM, lambda signum, frame: alarms.append(time.monotonic()))
+
+    try:
+        start = time.monotonic()
+        signal.setitimer(signal.ITIMER_REAL, 0.3)
+
+        # timer of the caller fires on time, and its handler is in place after the wait
+        with pytest.raises(intf.TimeoutError):
+            with lock_backend.make_lock(
+                    loc=str(path),
+                    opts=intf.Options({"engine": "flock"}),
+                    wait=intf.LockWait(timeout=0.8, first_report=5, report_period=5, report=lambda remaining: None),
+            ):
+                pass  # pragma: no cover
+
+        assert len(alarms) == 1
+        assert 0.25 < alarms[0] - start < 0.5
+        assert signal.getitimer(signal.ITIMER_REAL)[0] == 0
+
+        # timer which outlasts the wait keeps running
+        signal.setitimer(signal.ITIMER_REAL, 10)
+
+        with pytest.raises(intf.TimeoutError):
+            with lock_backend.make_lock(
+                    loc=str(path),
+                    opts=intf.Options({"engine": "flock"}),
+                    wait=intf.LockWait(timeout=0.3, first_report=5, report_period=5, report=lambda remaining: None),
+            ):
+                pass  # pragma: no cover
+
+        assert 9 < signal.getitimer(signal.ITIMER_REAL)[0] < 9.8
+        assert len(alarms) == 1
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, old_handler)
+        os.close(holder)
+
+
+def test_lock_flock_thread(tmp_path: pathlib.Path) -> None:
+    path = tmp_path / "file1"
+    errors: tp.List[BaseException] = []
+
+    def lock() -> None:
+        try:
+            with lock_backend.make_lock(
+                    loc=str(path),
+                    opts=intf.Options({"engine": "flock"}),
+                    wait=intf.LockWait(timeout=0.3, first_report=5, report_period=5, report=lambda remaining: None),
             ):
                 pass  # pragma: no cover
+        except BaseException as e:
+            errors.append(e)
+
+    # outside of the main thread, waiting polls rather than relying on SIGALRM
+    with lock_backend.make_lock(loc=str(path), opts=intf.Options({"engine": "flock"}), wait=_no_wait()):
+        thread = threading.Thread(target=lock)
+        thread.start()
+        thread.join()
+
+    assert len(errors) == 1 and isinstance(errors[0], intf.TimeoutError)
+
+
+def test_lock_bad_engine(tmp_path: pathlib.Path) -> None:
+    with pytest.raises(intf.BackendError):
+        lock_backend.make_lock(loc=str(tmp_path / "file1"), opts=intf.Options({"engine": "x"}), wait=_no_wait())
 
 
 def test_modify(tmp_path: pathlib.Path) -> None:
@@ -128,3 +258,81 @@ def test_modify(tmp_path: pathlib.Path) -> None:
     )
 
     assert not path.exists()
+
+
+def test_store(tmp_path: pathlib.Path) -> None:
+    path = tmp_path / "file1"
+
+    storage_backend.store(loc=str(path), data=DATA, opts=intf.Options({}))
+    assert path.read_bytes() == DATA
+
+    storage_backend.store(loc=str(path), data=None, opts=intf.Options({}))
+    assert not path.exists()
+
+    # already absent
+    storage_backend.store(loc=str(path), data=None, opts=intf.Options({}))
+
+    # failed write is not mistaken for an absent blob
+    with pytest.raises(intf.BackendError):
+        storage_backend.store(loc=str(tmp_path / "nonexistent" / "file1"), data=DATA, opts=intf.Options({}))
+
+
+def test_glob(tmp_path: pathlib.Path) -> None:
+    tmp_path.joinpath("b").mkdir()
+    for i in ["a.txt", "b/c.txt", "d.log"]:
+        tmp_path.joinpath(i).write_bytes(DATA)
+
+    assert storage_backend.glob(loc=f"{tmp_path}/*.txt", opts=intf.Options({})) == [
+        f"{tmp_path}/a.txt",
+        f"{tmp_path}/b/c.txt",
+    ]
+
+
+def test_modify_file(tmp_path: pathlib.Path) -> None:
+    path = tmp_path / "file1"
+    work_path = tmp_path / "work"
+    seen: tp.List[bytes] = []
+
+    def modifier(p: pathlib.Path) -> None:
+        seen.append(p.read_bytes())
+        p.write_bytes(DATA * 2)
+
+    path.write_bytes(DATA)
+    storage_backend.modify_file(loc=str(path), path=work_path, modifier=modifier, opts=intf.Options({}))
+    assert seen == [DATA]
+    assert path.read_bytes() == DATA * 2
+    assert not work_path.exists()
+
+    # unchanged file is left alone
+    inode = path.stat().st_ino
+    storage_backend.modify_file(loc=str(path), path=work_path, modifier=lambda p: None, opts=intf.Options({}))
+    assert path.stat().st_ino == inode
+
+    def rewriter(p: pathlib.Path) -> None:
+        # same size rewrite in place, within the resolution of coarse timestamps
+        st = p.stat()
+        with p.open("r+b") as f:
+            f.write(DATA[::-1] * 2)
+        os.utime(p, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    storage_backend.modify_file(loc=str(path), path=work_path, modifier=rewriter, opts=intf.Options({}))
+    assert path.read_bytes() == DATA[::-1] * 2
+
+    storage_backend.modify_file(loc=str(path), path=work_path, modifier=lambda p: p.unlink(), opts=intf.Options({}))
+    assert not path.exists()
+
+    def writer(p: pathlib.Path) -> None:
+        p.write_bytes(DATA)
+
+    # mode of the blob is kept, and new ones are private
+    storage_backend.modify_file(
+        loc=str(path),
+        path=work_path,
+        modifier=writer,
+        opts=intf.Options({}),
+    )
+    assert stat.S_IMODE(path.stat().st_mode) == 0o600
+
+    path.chmod(0o640)
+    storage_backend.modify_file(loc=str(path), path=work_path, modifier=modifier, opts=intf.Options({}))
+    assert stat.S_IMODE(path.stat().st_mode) == 0o640
@@ -1,9 +1,14 @@
 import io
+import pathlib
+import threading
 import typing as tp
 
+import boto3
 import botocore
+import common
 import pytest
 import with_cloud_blob.backend_intf as intf
+import with_cloud_blob.backends
 import with_cloud_blob.backends.storage_s3
 
 
@@ -49,6 +54,19 @@ def test_read_bad_opts() -> None:
         storage_backend.load(loc="", opts=intf.Options({"x": "y"}))
 
 
+def test_same_opts_for_all_operations(s3_bucket: tp.Any, tmp_path: pathlib.Path) -> None:
+    loc = f"{s3_bucket.name}/file1"
+    opts_dict = {**common.s3_modify_options_dict(delay_put=0), "coalesce_period": "0"}
+
+    storage_backend.store(loc=loc, data=DATA, opts=intf.Options(opts_dict))
+    assert storage_backend.load(loc=loc, opts=intf.Options(opts_dict)) == DATA
+    storage_backend.load_file(loc=loc, path=tmp_path / "file1", opts=intf.Options(opts_dict))
+    assert storage_backend.load_consistent(locs=[(loc, intf.Options(opts_dict))]) == [DATA]
+
+    with pytest.raises(intf.UnsupportedOptionsError):
+        storage_backend.store(loc=loc, data=DATA, opts=intf.Options({**opts_dict, "x": "y"}))
+
+
 def test_read_bad_loc(s3_read_options: intf.Options) -> None:
     with pytest.raises(intf.BackendError, match=r".*one slash.*"):
         storage_backend.load(loc="", opts=s3_read_options)
@@ -142,3 +160,192 @@ def test_modify(
 
     if not delay_put:
         assert not s3_key_exists(s3_bucket, "file1")
+
+
+def test_load_consistent(s3_bucket: tp.Any) -> None:
+    opts_dict = common.s3_modify_options_dict(delay_put=1)
+
+    for i in range(2):
+        storage_backend.modify(
+            loc=f"{s3_bucket.name}/file{i}",
+            modifier=lambda data: DATA * (i + 1),
+            opts=intf.Options(opts_dict),
+        )
+
+    result = storage_backend.load_consistent(
+        locs=[(f"{s3_bucket.name}/file{i}", intf.Options(opts_dict)) for i in range(3)],
+    )
+
+    assert result[:2] == [DATA, DATA * 2]
+    assert isinstance(result[2], intf.BackendError)
+
+    # digests carried by locks are not seen by consistent loads, which refuse to pretend otherwise
+    result = storage_backend.load_consistent(
+        locs=[(f"{s3_bucket.name}/file0", intf.Options({**opts_dict, "digest_in_lock": "1"}))],
+    )
+    assert isinstance(result[0], intf.BackendError)
+
+    with pytest.raises(intf.BackendError, match="digest_in_lock"):
+        storage_backend.modify(
+            loc=f"{s3_bucket.name}/file0",
+            modifier=lambda data: data,
+            opts=intf.Options({**opts_dict, "digest_in_lock": "1"}),
+        )
+
+
+def test_load_consistent_threads(s3_bucket: tp.Any, monkeypatch: tp.Any) -> None:
+    storage_s3 = with_cloud_blob.backends.storage_s3
+    opts_dict = {"endpoint": common.ENDPOINT, "max_lag": "0"}
+    created: tp.Dict[int, int] = {}
+    boto_resource_s3 = storage_s3.bh.boto_resource_s3
+    download_consistent = storage_s3._download_consistent
+
+    def recording_boto_resource_s3(*args: tp.Any) -> tp.Any:
+        result = boto_resource_s3(*args)
+        created[id(result)] = threading.get_ident()
+        return result
+
+    def checking_download_consistent(s3: tp.Any, *args: tp.Any, **kw: tp.Any) -> tp.Optional[bytes]:
+        # boto3 resources are not thread safe
+        assert created[id(s3)] == threading.get_ident()
+        return download_consistent(s3, *args, **kw)
+
+    monkeypatch.setattr(storage_s3.bh, "boto_resource_s3", recording_boto_resource_s3)
+    monkeypatch.setattr(storage_s3, "_download_consistent", checking_download_consistent)
+
+    for i in range(4):
+        s3_bucket.put_object(Key=f"file{i}", Body=DATA)
+
+    result = storage_backend.load_consistent(
+        locs=[(f"{s3_bucket.name}/file{i}", intf.Options(opts_dict)) for i in range(4)],
+    )
+    assert result == [DATA] * 4
+
+
+def test_cache(s3_bucket: tp.Any, cache_dir: pathlib.Path) -> None:
+    loc = f"{s3_bucket.name}/file1"
+    opts_dict = {**common.s3_modify_options_dict(delay_put=0), "cache_size": "1000"}
+
+    storage_backend.modify(loc=loc, modifier=lambda data: DATA, opts=intf.Options(opts_dict))
+
+    # written through on modify
+    entries = [i for i in (cache_dir / "blobs").iterdir() if not i.suffix]
+    assert len(entries) == 1
+    assert entries[0].read_bytes().endswith(b"\n" + DATA)
+
+    # unmodified blob is not downloaded again, so that tampering with cached copy is visible
+    entries[0].write_bytes(entries[0].read_bytes()[:-len(DATA)] + b"cached")
+    assert storage_backend.load(loc=loc, opts=intf.Options({"endpoint": common.ENDPOINT, "cache_size": "1000"})) \
+        == b"cached"
+
+    s3_bucket.put_object(Key="file1", Body=DATA * 2)
+    assert storage_backend.load(loc=loc, opts=intf.Options({"endpoint": common.ENDPOINT, "cache_size": "1000"})) \
+        == DATA * 2
+
+
+def test_coalesce(s3_bucket: tp.Any) -> None:
+    loc = f"{s3_bucket.name}/file1"
+    opts_dict = {"endpoint": common.ENDPOINT, "cache_size": "1000", "coalesce_period": "60"}
+
+    with pytest.raises(intf.BackendError):
+        storage_backend.load(loc=loc, opts=intf.Options({"endpoint": common.ENDPOINT, "coalesce_period": "60"}))
+
+    s3_bucket.put_object(Key="file1", Body=DATA)
+    assert storage_backend.load(loc=loc, opts=intf.Options(opts_dict)) == DATA
+
+    # recently downloaded copy is reused without any requests
+    s3_bucket.put_object(Key="file1", Body=DATA * 2)
+    assert storage_backend.load(loc=loc, opts=intf.Options(opts_dict)) == DATA
+
+    opts_dict["coalesce_period"] = "0.001"
+    assert storage_backend.load(loc=loc, opts=intf.Options(opts_dict)) == DATA * 2
+
+
+@pytest.mark.parametrize('cache_size', ["0", "1000"])
+def test_prefetch(s3_bucket: tp.Any, cache_size: str) -> None:
+    loc = f"{s3_bucket.name}/file1"
+    opts_dict = {**common.s3_modify_options_dict(delay_put=0), "cache_size": cache_size}
+    seen: tp.List[tp.Optional[bytes]] = []
+
+    def modifier(data: tp.Optional[bytes]) -> tp.Optional[bytes]:
+        seen.append(data)
+        return data
+
+    s3_bucket.put_object(Key="file1", Body=DATA)
+    storage_backend.prefetch(loc=loc, opts=intf.Options(opts_dict))
+    storage_backend.modify(loc=loc, modifier=modifier, opts=intf.Options(opts_dict))
+
+    # blob changed while waiting for locks is not mistaken for the prefetched one
+    storage_backend.prefetch(loc=loc, opts=intf.Options(opts_dict))
+    s3_bucket.put_object(Key="file1", Body=DATA * 2)
+    storage_backend.modify(loc=loc, modifier=modifier, opts=intf.Options(opts_dict))
+
+    assert seen == [DATA, DATA * 2]
+    assert not with_cloud_blob.backends.storage_s3._prefetched
+
+
+def test_glob(s3_bucket: tp.Any, s3_read_options: intf.Options) -> None:
+    for i in ["configs/a", "configs/b/c", "configs/d/", "configs2/e", "other"]:
+        s3_bucket.put_object(Key=i, Body=DATA)
+
+    assert sorted(storage_backend.glob(loc=f"{s3_bucket.name}/configs/*", opts=s3_read_options)) == [
+        f"{s3_bucket.name}/configs/a",
+        f"{s3_bucket.name}/configs/b/c",
+    ]
+
+
+def test_delta_log(s3_bucket: tp.Any) -> None:
+    backend = with_cloud_blob.backends.storage_backend("s3")
+    loc = f"{s3_bucket.name}/file1"
+    opts_dict = {
+        **common.s3_modify_options_dict(delay_put=0),
+        "delta_log": "4",
+        "delta_log_size": "10000",
+        "compress": "zlib",
+    }
+
+    for i in range(3):
+        backend.modify(loc=loc, modifier=lambda data: (data or b"") + DATA * 100, opts=intf.Options(opts_dict))
+
+    assert len(list(s3_bucket.objects.all())) == 4
+    assert backend.load(loc=loc, opts=intf.Options({"endpoint": common.ENDPOINT})) == DATA * 300
+
+    # side objects are stored without keeping their digests
+    digest_table = boto3.Session().resource(
+        "dynamodb",
+        endpoint_url=common.DYNAMODB_ENDPOINT,
+        region_name="us-east-1",
+    ).Table(opts_dict["dynamodb_table"])
+    assert [i["key"] for i in digest_table.scan()["Items"]] == [loc]
+    assert backend.glob(loc=f"{s3_bucket.name}/*", opts=intf.Options({"endpoint": common.ENDPOINT})) == [loc]
+
+    backend.modify(loc=loc, modifier=lambda data: None, opts=intf.Options(opts_dict))
+    assert not list(s3_bucket.objects.all())
+
+
+@pytest.mark.parametrize('cache_size', ["0", "1000"])
+def test_modify_file(s3_bucket: tp.Any, tmp_path: pathlib.Path, cache_size: str) -> None:
+    loc = f"{s3_bucket.name}/file1"
+    work_path = tmp_path / "work"
+    opts_dict = {**common.s3_modify_options_dict(delay_put=0), "cache_size": cache_size}
+    seen: tp.List[tp.Optional[bytes]] = []
+
+    def modifier(path: pathlib.Path) -> None:
+        seen.append(path.read_bytes() if path.exists() else None)
+        with path.open("ab") as f:
+            f.write(DATA)
+
+    for i in range(2):
+        storage_backend.modify_file(loc=loc, path=work_path, modifier=modifier, opts=intf.Options(opts_dict))
+
+    assert seen == [None, DATA]
+    assert read_s3_obj(s3_bucket, "file1") == DATA * 2
+
+    storage_backend.load_file(loc=loc, path=tmp_path / "loaded", opts=intf.Options({"endpoint": common.ENDPOINT}))
+    assert (tmp_path / "loaded").read_bytes() == DATA * 2
+
+    storage_backend.modify_file(loc=loc, path=work_path, modifier=lambda p: p.unlink(), opts=intf.Options(opts_dict))
+    assert not s3_key_exists(s3_bucket, "file1")
+
+    with pytest.raises(intf.BackendError):
+        storage_backend.load_file(loc=loc, path=tmp_path / "loaded", opts=intf.Options({"endpoint": common.ENDPOINT}))
@@ -0,0 +1,93 @@
+import pathlib
+import time
+import typing as tp
+
+from with_cloud_blob._cache import BlobCache
+
+
+def test_blob_cache(cache_dir: pathlib.Path) -> None:
+    cache = BlobCache(size_limit=100)
+
+    assert cache.get("a") is None
+
+    cache.put("a", "v1", b"x" * 40)
+    assert cache.get("a") == ("v1", b"x" * 40)
+
+    cache.put("a", "v2", b"y" * 40)
+    assert cache.get("a") == ("v2", b"y" * 40)
+
+    time.sleep(0.01)
+    cache.put("b", "v1", b"z" * 40)
+    time.sleep(0.01)
+    # refreshes "a", so that "b" becomes the least recently used one
+    cache.get("a")
+    time.sleep(0.01)
+    cache.put("c", "v1", b"w" * 40)
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+
+    cache.discard("a")
+    assert cache.get("a") is None
+    assert cache.validated_at("a") == 0
+
+    before = time.time()
+    cache.mark_validated("c")
+    assert cache.validated_at("c") >= before - 1
+
+    # never cached
+    cache.put("d", "v1", b"x" * 101)
+    assert cache.get("d") is None
+
+
+def test_blob_cache_eviction(cache_dir: pathlib.Path, monkeypatch: tp.Any) -> None:
+    cache = BlobCache(size_limit=100)
+    evictions: tp.List[None] = []
+    evict = cache._evict
+
+    def counting_evict() -> int:
+        evictions.append(None)
+        return evict()
+
+    monkeypatch.setattr(cache, "_evict", counting_evict)
+
+    def lock_files() -> tp.List[str]:
+        return sorted(i.name for i in cache._path.iterdir() if i.name.endswith(".lock") and len(i.name) > 64)
+
+    def fetch(key: str, data: tp.Optional[bytes]) -> None:
+        with cache.lock(key, timeout=1):
+            if data is None:
+                cache.discard(key)
+            else:
+                cache.put(key, "v1", data)
+
+    # the first put has no tracked size to start from
+    fetch("a", b"x" * 40)
+    assert len(evictions) == 1
+
+    time.sleep(0.01)
+    fetch("b", b"x" * 40)
+    # blob which no longer exists, so that its lock file is left behind
+    fetch("gone", None)
+    assert len(evictions) == 1
+    assert len(lock_files()) == 3
+
+    cache.discard("b")
+    time.sleep(0.01)
+    fetch("c", b"x" * 40)
+    assert len(evictions) == 1
+
+    # evicts "a" along with its lock file, and the one of "gone"
+    fetch("d", b"x" * 40)
+    assert len(evictions) == 2
+    assert cache.get("a") is None
+    assert len(lock_files()) == 2
+
+    # lock of an entry being fetched is kept along with the entry
+    with cache.lock("c", timeout=1):
+        time.sleep(0.01)
+        fetch("e", b"x" * 40)
+
+    assert cache.get("c") is not None
+    assert cache.get("d") is None
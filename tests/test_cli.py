@@ -1,5 +1,11 @@
 import concurrent.futures
+import io
+import json
 import pathlib
+import shutil
+import subprocess
+import tarfile
+import threading
 import typing as tp
 
 import click
@@ -7,7 +13,9 @@ import common
 import nacl.secret
 import nacl.utils
 import pytest
+import with_cloud_blob._crypto as cr
 from with_cloud_blob._cli import root
+from with_cloud_blob._cli import watch_command
 
 
 def cli(args: tp.List[str]) -> None:
@@ -41,6 +49,11 @@ def test_newkey(capfd: tp.Any) -> None:
         (["--blob=a=:file:/"], ["true"], 1, ""),
         (["--blob=a=:file:/", "--allow-errors"], ["true"], 0, ""),
         (["*alpha*ONE", "*beta*TWO"], ["cat", "alpha", "beta"], 0, "ONETWO"),
+        (["--consistent", "*alpha*ONE", "*beta*TWO"], ["cat", "alpha", "beta"], 0, "ONETWO"),
+        (["--consistent", "--blob=a=:file:/", "*beta*TWO"], ["cat", "beta"], 1, ""),
+        (["--stdio", "*alpha*ONE"], ["cat"], 0, "ONE"),
+        (["--stdio", "--consistent", "*alpha*ONE"], ["cat"], 0, "ONE"),
+        (["--stdio", "--blob=a=:file:/"], ["cat"], 1, ""),
     ],
 )
 def test_read(
@@ -76,6 +89,96 @@ def test_read(
     assert captured.out == expected_out
 
 
+def test_read_glob(tmp_path: pathlib.Path, capfd: tp.Any) -> None:
+    src = tmp_path / "src"
+    src.joinpath("sub").mkdir(parents=True)
+    src.joinpath("a.txt").write_text("A")
+    src.joinpath("sub", "b.txt").write_text("B")
+    src.joinpath("c.log").write_text("C")
+
+    cli(["read", f"--blob=d=:file:{src}/*.txt", "--", "bash", "-c", "find d -type f | sort; cat d/a.txt d/sub/b.txt"])
+
+    captured = capfd.readouterr()
+    assert captured.out == "d/a.txt\nd/sub/b.txt\nAB"
+
+    # matches which are gone are removed from a persistent directory, and nothing else is
+    into = tmp_path / "into"
+    args = ["read", f"--into={into}", f"--blob=d=:file:{src}/*.txt", "--", "bash", "-c"]
+    cli(args + ["touch d/extra"])
+    src.joinpath("sub", "b.txt").unlink()
+    cli(args + ["find d | sort"])
+    assert capfd.readouterr().out == "d\nd/a.txt\nd/extra\n"
+
+
+def test_read_workspace(tmp_path: pathlib.Path, capfd: tp.Any, monkeypatch: tp.Any) -> None:
+    blob = tmp_path / "blob"
+    blob.write_text("A")
+    workspace = tmp_path / "ws"
+    workspace.mkdir()
+
+    cli(["read", f"--workspace={workspace}", f"--blob=a=:file:{blob}", "--", "bash", "-c", "pwd; cat a"])
+    captured = capfd.readouterr()
+    assert captured.out.startswith(f"{workspace}/with-cloud-blob-")
+    assert captured.out.endswith("\nA")
+    assert not list(workspace.iterdir())
+
+    monkeypatch.setattr(shutil, "disk_usage", lambda path: shutil._ntuple_diskusage(0, 0, 0))  # type: ignore
+    with pytest.raises(click.ClickException, match="do not fit"):
+        cli(["read", f"--workspace={workspace}", f"--blob=a=:file:{blob}", "--", "true"])
+
+
+def test_read_into(tmp_path: pathlib.Path, capfd: tp.Any) -> None:
+    blob = f":file:{tmp_path / 'blob'}"
+    xblob = f":file:{tmp_path / 'xblob'}"
+    key = nacl.encoding.HexEncoder.encode(nacl.utils.random(nacl.secret.SecretBox.KEY_SIZE)).decode()
+    into = tmp_path / "into"
+
+    (tmp_path / "blob").write_text("A")
+    cli(["xmodify", xblob, key, "--", "bash", "-c", "mkdir -p master tenants/one; echo a > tenants/one/a"])
+    cli(["xgetkeys", xblob, key, "one"])
+    reader_key = capfd.readouterr().out.strip()
+
+    args = ["read", f"--into={into}", f"--blob=b={blob}", "--xblob", f"x={xblob}", reader_key, "--"]
+    cli(args + ["bash", "-c", "pwd; cat b x/a; touch x/extra"])
+    assert capfd.readouterr().out == f"{into}\nAa\n"
+
+    cli(["xput", xblob, key, f"tenants/one/c={tmp_path / 'blob'}"])
+    cli(args + ["bash", "-c", "find . | sort"])
+    assert capfd.readouterr().out == ".\n./b\n./x\n./x/a\n./x/c\n"
+
+
+def test_read_watch(tmp_path: pathlib.Path, capfd: tp.Any) -> None:
+    blob = tmp_path / "blob"
+    blob.write_text("A")
+    timer = threading.Timer(0.5, lambda: blob.write_text("B"))
+    timer.start()
+
+    try:
+        cli([
+            "read", "--watch=0.1", "--watch-signal=hup", f"--blob=b=:file:{blob}", "--", "bash", "-c",
+            "trap 'echo; cat b; exit 0' HUP; cat b; for i in $(seq 200); do sleep 0.05; done; exit 1",
+        ])
+    finally:
+        timer.cancel()
+
+    assert capfd.readouterr().out == "A\nB"
+
+
+def test_watch_command_refresh_exception(tmp_path: pathlib.Path) -> None:
+    calls: tp.List[None] = []
+
+    def refresh() -> tp.Tuple[bool, bool]:
+        calls.append(None)
+        if len(calls) == 1:
+            raise ValueError("cannot decrypt")
+        return False, False
+
+    assert watch_command(
+        ["bash", "-c", "sleep 1; exit 3"], tmp_path, refresh, interval=0.05, sig=None,
+    ) == 3
+    assert len(calls) > 1
+
+
 def test_read_param_exceptions() -> None:
     with pytest.raises(click.BadParameter):
         cli(["read", "--blob="])
@@ -92,6 +195,25 @@ def test_read_param_exceptions() -> None:
     with pytest.raises(click.BadParameter):
         cli(["read", "--blob=a=="])
 
+    for name in ["", "/abs", "../x", "y/../../x", "y//z", "."]:
+        with pytest.raises(click.BadParameter, match="not a valid blob name"):
+            cli(["read", f"--blob={name}=:x:y", "true"])
+
+        with pytest.raises(click.BadParameter, match="not a valid blob name"):
+            cli(["read", "--xblob", f"{name}=:x:y", "1:00", "true"])
+
+    with pytest.raises(click.BadParameter):
+        cli(["read", "--stdio", "--blob=a=:x:y", "--blob=b=:x:y", "true"])
+
+    with pytest.raises(click.BadParameter):
+        cli(["read", "--stdio", "--into=x", "--blob=a=:x:y", "true"])
+
+    with pytest.raises(click.BadParameter):
+        cli(["read", "--watch-signal=HUP", "--blob=a=:x:y", "true"])
+
+    with pytest.raises(click.BadParameter):
+        cli(["read", "--watch=1", "--watch-signal=NOSUCH", "--blob=a=:x:y", "true"])
+
 
 def test_backends_list(
     capfd: tp.Any,
@@ -104,6 +226,32 @@ def test_backends_list(
     assert "storage: file" in lines
 
 
+def test_provision_file(tmp_path: pathlib.Path) -> None:
+    file1 = tmp_path / "file1"
+    cli(["provision", "--lock", f":file:{file1}:timeout=5", f":file:{file1}"])
+
+    with pytest.raises(click.ClickException):
+        cli(["provision", f":file:{file1}:x=y"])
+
+
+def test_provision_s3_dynamodb(
+    s3_bucket: tp.Any,
+    cache_dir: pathlib.Path,
+) -> None:
+    s3_name = f"{s3_bucket.name}/file1"
+    s3_opts = common.s3_modify_options_dict(delay_put=0)
+    s3_loc = f"|s3|{s3_name}" + "".join(f"|{k}={v}" for k, v in s3_opts.items())
+    lock_loc = f"|dynamodb||dynamodb_endpoint={common.DYNAMODB_ENDPOINT}|region=us-east-1|timeout=5"
+
+    cli(["provision", "--lock", lock_loc, s3_loc])
+
+    known_tables = {i.split(" ")[1] for i in (cache_dir / "dynamodb-tables").read_text().splitlines()}
+    assert known_tables == {s3_opts["dynamodb_table"], "DynamoDBLockTable"}
+
+    cli(["modify", "--lock", lock_loc, s3_loc, "--", "bash", "-c", "echo -n a >> blob"])
+    assert s3_bucket.Object("file1").get()["Body"].read() == b"a"
+
+
 @pytest.mark.parametrize(
     "start_state,tasks",
     [
@@ -148,6 +296,68 @@ def test_modify(
             assert file1.read_text() == expected_state
 
 
+def test_modify_stdio(tmp_path: pathlib.Path) -> None:
+    file1 = tmp_path / "file1"
+
+    cli(["modify", "--stdio", f":file:{file1}", "--", "echo", "a"])
+    cli(["modify", "--stdio", f":file:{file1}", "--", "sed", "s/a/b/"])
+    assert file1.read_text() == "b\n"
+
+    with pytest.raises(SystemExit):
+        cli(["modify", "--stdio", f":file:{file1}", "--", "bash", "-c", "echo c; false"])
+
+    assert file1.read_text() == "b\n"
+
+
+def test_mmodify(tmp_path: pathlib.Path) -> None:
+    file1 = tmp_path / "file1"
+    file2 = tmp_path / "file2"
+    file3 = tmp_path / "file3"
+    file1.write_text("a")
+    file3.write_text("c")
+
+    args = [
+        "mmodify",
+        "--lock", ":file::timeout=5",
+        "--lock", f":file:{tmp_path / 'common'}:timeout=5",
+        f"--blob=x=:file:{file1}",
+        f"--blob=y/z=:file:{file2}",
+        f"--blob=w=:file:{file3}",
+        "--",
+        "bash",
+        "-c",
+    ]
+
+    cli(args + ["echo -n b >> x; echo -n c > y/z; rm w"])
+    assert file1.read_text() == "ab"
+    assert file2.read_text() == "c"
+    assert not file3.exists()
+
+    with pytest.raises(SystemExit):
+        cli(args + ["echo -n d >> x; echo -n d > w; false"])
+
+    assert file1.read_text() == "ab"
+    assert not file3.exists()
+
+    # command is not run unless all blobs are read
+    with pytest.raises(click.ClickException, match="file4"):
+        cli([
+            "mmodify",
+            f"--blob=x=:file:{file1}",
+            f"--blob=y=:file:{tmp_path / 'file4'}:x=y",
+            "--",
+            "bash",
+            "-c",
+            "echo -n d >> x",
+        ])
+
+    assert file1.read_text() == "ab"
+
+    for name in ["", "/abs", "../x", "y/../../x", "y//z", "y/", "."]:
+        with pytest.raises(click.BadParameter, match="not a valid blob name"):
+            cli(["mmodify", f"--blob={name}=:file:{file1}", "--", "true"])
+
+
 def _test_parallel_modify(
     *,
     tmp_path: pathlib.Path,
@@ -208,6 +418,8 @@ def test_parallel_modify_file(
         (20, 5, "file", 0.05),
         (10, 1, "dynamodb", 0.1),
         (20, 5, "dynamodb", 0.1),
+        (20, 5, "dynamodb+digest", 0.1),
+        (20, 5, "file+prefetch", 0.05),
     ],
 )
 def test_parallel_modify_s3_dynamodb(
@@ -219,11 +431,16 @@ def test_parallel_modify_s3_dynamodb(
     delay_put: float,
 ) -> None:
     s3_name = f"{s3_bucket.name}/file1"
+    extra_args = []
+
+    if lock.endswith("+prefetch"):
+        lock = lock[:-len("+prefetch")]
+        extra_args.append("--prefetch")
 
     if lock == "file":
         file1 = tmp_path / "file1"
         lock_loc = f"|file|{file1}"
-    elif lock == "dynamodb":
+    elif lock in ("dynamodb", "dynamodb+digest"):
         lock_loc = f"|dynamodb|{s3_name}|dynamodb_endpoint={common.DYNAMODB_ENDPOINT}|region=us-east-1"
     else:
         assert 0
@@ -231,6 +448,12 @@ def test_parallel_modify_s3_dynamodb(
     lock_loc += "|timeout=15"
 
     s3_opts = common.s3_modify_options_dict(delay_put=delay_put)
+
+    if lock == "dynamodb+digest":
+        lock_loc += "|carry_digest=1"
+        s3_opts.pop("dynamodb_endpoint")
+        s3_opts.pop("dynamodb_table")
+        s3_opts["digest_in_lock"] = "1"
     # s3_opts["max_lag"] = "0"
     # s3_opts.pop("dynamodb_endpoint", None)
     # s3_opts.pop("dynamodb_table", None)
@@ -241,5 +464,103 @@ def test_parallel_modify_s3_dynamodb(
         tmp_path=tmp_path,
         count=count,
         jobs=jobs,
-        args=["--lock", lock_loc, s3_loc],
+        args=extra_args + ["--lock", lock_loc, s3_loc],
     )
+
+
+def test_xmodify_only(tmp_path: pathlib.Path, capfd: tp.Any) -> None:
+    blob = f":file:{tmp_path / 'blob'}"
+    key = nacl.encoding.HexEncoder.encode(nacl.utils.random(nacl.secret.SecretBox.KEY_SIZE)).decode()
+
+    cli([
+        "xmodify", blob, key, "--", "bash", "-c",
+        "mkdir -p master tenants/one tenants/two; echo m > master/m; echo 1 > tenants/one/a; echo 2 > tenants/two/b",
+    ])
+
+    cli(["xmodify", "--only=tenants/one", blob, key, "--", "bash", "-c", "find . -type f; echo 3 > tenants/one/c"])
+    assert capfd.readouterr().out == "./tenants/one/a\n"
+
+    with pytest.raises(click.ClickException, match="outside"):
+        cli(["xmodify", "--only=tenants/one", blob, key, "--", "bash", "-c", "mkdir tenants/two; echo > tenants/two/d"])
+
+    cli(["xmodify", blob, key, "--", "bash", "-c", "find master tenants -type f | sort"])
+    assert capfd.readouterr().out == "master/m\ntenants/one/a\ntenants/one/c\ntenants/two/b\n"
+
+
+def test_xput_xdel_xpatch(tmp_path: pathlib.Path, capfd: tp.Any) -> None:
+    blob = f":file:{tmp_path / 'blob'}"
+    key = nacl.encoding.HexEncoder.encode(nacl.utils.random(nacl.secret.SecretBox.KEY_SIZE)).decode()
+
+    src = tmp_path / "src"
+    src.joinpath("master").mkdir(parents=True)
+    src.joinpath("master", "m").write_text("m")
+    src.joinpath("tenants", "one").mkdir(parents=True)
+    src.joinpath("tenants", "one", "a").write_text("a")
+    subprocess.check_call(["tar", "-cf", str(tmp_path / "src.tar"), "-C", str(src), "."])
+
+    cli(["xput", f"--tar={tmp_path / 'src.tar'}", blob, key, f"tenants/two/b={src / 'master' / 'm'}"])
+    assert cr.read_tenants_digests((tmp_path / "blob").read_bytes()) is None
+    cli(["xdel", "--blob-version=2", blob, key, "tenants/one"])
+    assert cr.read_tenants_digests((tmp_path / "blob").read_bytes()) is not None
+
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps({
+        "put": {"tenants/two/c": "c"},
+        "put_base64": {"master/x": "eA=="},
+        "delete": ["master/m"],
+    }))
+    cli(["xpatch", blob, key, str(manifest)])
+
+    cli(["xmodify", blob, key, "--", "bash", "-c", "find master tenants -type f | sort | xargs cat"])
+    assert capfd.readouterr().out == "xmc"
+
+    for name in ["tenants/two", "../x", "other/x"]:
+        with pytest.raises(click.ClickException):
+            cli(["xput", blob, key, f"{name}={src / 'master' / 'm'}"])
+
+
+def test_xcat(tmp_path: pathlib.Path, capfd: tp.Any) -> None:
+    blob = f":file:{tmp_path / 'blob'}"
+    key = nacl.encoding.HexEncoder.encode(nacl.utils.random(nacl.secret.SecretBox.KEY_SIZE)).decode()
+
+    cli([
+        "xmodify", blob, key, "--", "bash", "-c",
+        "mkdir -p master tenants/one; echo m > master/m; echo a > tenants/one/a",
+    ])
+    cli(["xgetkeys", blob, key, "one"])
+    reader_key = capfd.readouterr().out.strip()
+
+    # read-only command has nothing to commit
+    with pytest.raises(click.NoSuchOption):
+        cli(["xgetkeys", "--group-commit", blob, key, "one"])
+
+    cli(["xcat", blob, key, "master/m"])
+    cli(["xcat", "--consistent", blob, reader_key, "a"])
+    assert capfd.readouterr().out == "m\na\n"
+
+    missing = f":file:{tmp_path / 'missing'}"
+
+    for args in [[blob, key, "master/x"], [blob, reader_key, "master/m"], [missing, key, "master/m"]]:
+        with pytest.raises(click.ClickException):
+            cli(["xcat"] + args)
+
+
+def test_xtar(tmp_path: pathlib.Path, capfdbinary: tp.Any) -> None:
+    blob = f":file:{tmp_path / 'blob'}"
+    key = nacl.encoding.HexEncoder.encode(nacl.utils.random(nacl.secret.SecretBox.KEY_SIZE)).decode()
+
+    cli([
+        "xmodify", blob, key, "--", "bash", "-c",
+        "mkdir -p master tenants/one/d; echo m > master/m; echo a > tenants/one/d/a; ln -s d/a tenants/one/l",
+    ])
+    cli(["xgetkeys", blob, key, "one"])
+    reader_key = capfdbinary.readouterr().out.decode().strip()
+
+    cli(["xtar", blob, reader_key])
+    with tarfile.open(fileobj=io.BytesIO(capfdbinary.readouterr().out)) as tf:
+        assert sorted((i.name, i.linkname) for i in tf) == [("d/a", ""), ("l", "d/a")]
+        assert tf.extractfile("d/a").read() == b"a\n"  # type: ignore
+
+    cli(["xtar", blob, key, "master"])
+    with tarfile.open(fileobj=io.BytesIO(capfdbinary.readouterr().out)) as tf:
+        assert tf.getnames() == ["master/m"]
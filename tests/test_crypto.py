@@ -1,5 +1,7 @@
 import io
+import os
 import pathlib
+import tarfile
 import typing as tp
 
 import fastavro
@@ -36,6 +38,40 @@ def test_dump_load_blob() -> None:
     assert cb1.xtenants == cb2.xtenants
 
 
+def test_tenants_digests() -> None:
+    cb1 = cr.CryptoBlob()
+    cb1.version = 1
+    cb1.xtenants = {1: b"tenant1", 2: b"tenant2"}
+    assert cr.read_tenants_digests(cb1.dump_to_blob()) is None
+
+    cb1.version = 2
+    blob = cb1.dump_to_blob()
+    digests = {1: cb1.tenant_digest(1), 2: cb1.tenant_digest(2)}
+    assert digests[1] != digests[2]
+    # header is at the start of blob
+    assert cr.read_tenants_digests(blob[:blob.index(b"tenant1")]) == digests
+
+    cb2 = cr.CryptoBlob()
+    cb2.load_from_blob(blob)
+    assert cb2.version == 2
+    assert cb2.xtenants == cb1.xtenants
+
+
+def test_unsupported_blob_version(tmp_path: pathlib.Path) -> None:
+    with io.BytesIO() as f:
+        fastavro.schemaless_writer(f, "int", 3)
+        blob = f.getvalue()
+
+    with pytest.raises(cr.Error, match="unsupported blob version 3"):
+        cr.CryptoBlob().load_from_blob(blob)
+
+    with pytest.raises(cr.Error, match="unsupported blob version 3"):
+        cr.read_tenants_digests(blob)
+
+    with pytest.raises(cr.Error, match="unsupported blob version 3"):
+        cr.CryptoBlob().collect(tmp_path, master_key=cr.new_key(), existing_tenants_keys=[], version=3)
+
+
 def test_compressed_avro_dump_load() -> None:
     data = [b"\x01\x02", b"\x03\x04\x05"]
     blob = cr.compressed_avro_dump(data, schema_name="partition", schema_version=1)
@@ -239,7 +275,9 @@ def test_writeout(
         },
     }
 
-    cr.writeout(partitions, files, tmpdir)
+    reserved: tp.List[int] = []
+    cr.writeout(partitions, files, tmpdir, reserved.append)
+    assert reserved == [20]
 
     for prefix, pfiles in files.items():
         for fname, f in pfiles.items():
@@ -317,3 +355,204 @@ def test_collect_writeout(
             assert fpath.exists()
             assert fpath.stat().st_mtime_ns == mtimes[fname]
             assert fpath.read_bytes() == fbody
+
+
+def _write_files(dest: pathlib.Path, files: tp.Mapping[str, bytes]) -> None:
+    for fname, fbody in files.items():
+        fpath = dest.joinpath(fname)
+        fpath.parent.mkdir(parents=True, exist_ok=True)
+        fpath.write_bytes(fbody)
+
+
+def _read_files(src: pathlib.Path) -> tp.Dict[str, bytes]:
+    return {str(i.relative_to(src)): i.read_bytes() for i in src.rglob("*") if i.is_file()}
+
+
+def test_patch(
+    tmpdir: tp.Any,
+) -> None:
+    tmpdir = pathlib.Path(tmpdir)
+    files: tp.Dict[str, bytes] = {
+        "master/a": b"a",
+        "tenants/one/a": b"a",
+        "tenants/two/b": b"b",
+        "tenants/three/c": b"c",
+    }
+    _write_files(tmpdir / "collect", files)
+
+    master_key = cr.new_key()
+    cb = cr.CryptoBlob()
+    cb.collect(tmpdir / "collect", master_key=master_key, existing_tenants_keys=[])
+    tenants_keys = {i.tenant_name: i for i in cb.get_tenants_keys(cb.unseal_master(master_key))}
+    xpartitions = list(cb.xpartitions)
+    xtenants = dict(cb.xtenants)
+
+    _write_files(tmpdir / "add", {"tenants/two/b": b"B", "tenants/four/d": b"d"})
+    cb.patch(
+        master_key=master_key,
+        master_data=cb.unseal_master(master_key),
+        remove=lambda name: name == "tenants/three/c",
+        add=cr.collect_files(tmpdir / "add"),
+    )
+    files.update({"tenants/two/b": b"B", "tenants/four/d": b"d"})
+    del files["tenants/three/c"]
+
+    # untouched partition and tenant entry are carried over, unused partitions are reused
+    assert cb.xpartitions[0] == xpartitions[0]
+    assert len(cb.xpartitions) == 3
+    assert cb.xtenants[tenants_keys["one"].key_id] == xtenants[tenants_keys["one"].key_id]
+    assert tenants_keys["three"].key_id not in cb.xtenants
+
+    cb2 = cr.CryptoBlob()
+    cb2.load_from_blob(cb.dump_to_blob())
+    master_data = cb2.unseal_master(master_key)
+
+    cb2.writeout_master(master_data, tmpdir / "master")
+    assert _read_files(tmpdir / "master") == files
+
+    cb2.writeout_master(master_data, tmpdir / "sparse", select=lambda name: name.startswith("tenants/two/"))
+    assert _read_files(tmpdir / "sparse") == {"tenants/two/b": b"B"}
+
+    for tenant_keys in cb2.get_tenants_keys(master_data):
+        tenant = tenant_keys.tenant_name
+        cb2.writeout_tenant(tmpdir / tenant, key_id=tenant_keys.key_id, tenant_key=tenant_keys.reader_key)
+        assert _read_files(tmpdir / tenant) == {
+            k[len(f"tenants/{tenant}/"):]: v for k, v in files.items() if k.startswith(f"tenants/{tenant}/")
+        }
+
+
+def test_read_file(
+    tmpdir: tp.Any,
+) -> None:
+    tmpdir = pathlib.Path(tmpdir)
+    _write_files(tmpdir, {"master/a": b"a", "tenants/one/d/b": b"b", "tenants/two/c": b"c"})
+    (tmpdir / "tenants" / "one" / "l").symlink_to("d/b")
+    (tmpdir / "tenants" / "one" / "d" / "l").symlink_to("l")
+
+    master_key = cr.new_key()
+    cb = cr.CryptoBlob()
+    cb.collect(tmpdir, master_key=master_key, existing_tenants_keys=[])
+    master_data = cb.unseal_master(master_key)
+    tenants_keys = {i.tenant_name: i for i in cb.get_tenants_keys(master_data)}
+
+    assert cb.read_master_file(master_data, "master/a") == b"a"
+    assert cb.read_master_file(master_data, "tenants/one/l") == b"b"
+
+    one = tenants_keys["one"]
+    assert cb.read_tenant_file("l", key_id=one.key_id, tenant_key=one.reader_key) == b"b"
+
+    for name in ["c", "d/l", "../two/c"]:
+        with pytest.raises(cr.Error):
+            cb.read_tenant_file(name, key_id=one.key_id, tenant_key=one.reader_key)
+
+    with pytest.raises(cr.Error):
+        cb.read_master_file(master_data, "tenants/three/c")
+
+    # only the partition holding the file is decrypted
+    partition_id = master_data["files"][""]["a"]["partition_id"]
+    cb.xpartitions = [v if i == partition_id else b"" for i, v in enumerate(cb.xpartitions)]
+    assert cb.read_master_file(master_data, "master/a") == b"a"
+
+
+def test_write_tar(
+    tmpdir: tp.Any,
+) -> None:
+    tmpdir = pathlib.Path(tmpdir)
+    _write_files(tmpdir / "collect", {"master/a": b"a", "master/b": b"b", "tenants/one/c": b"c"})
+    (tmpdir / "collect" / "master" / "l").symlink_to(tmpdir / "collect" / "master" / "a")
+
+    master_key = cr.new_key()
+    cb = cr.CryptoBlob()
+    cb.collect(tmpdir / "collect", master_key=master_key, existing_tenants_keys=[])
+    master_data = cb.unseal_master(master_key)
+
+    with io.BytesIO() as f:
+        cb.write_master_tar(master_data, f)
+        f.seek(0)
+
+        with tarfile.open(fileobj=f) as tf:
+            tf.extractall(tmpdir / "tar")
+
+    cb.writeout_master(master_data, tmpdir / "writeout")
+    assert _read_files(tmpdir / "tar") == _read_files(tmpdir / "writeout")
+    assert os.readlink(tmpdir / "tar" / "master" / "l") == "a"
+    # tar keeps mtimes to microseconds
+    mtimes = [int((tmpdir / i / "master" / "a").stat().st_mtime * 1e6) for i in ["tar", "writeout"]]
+    assert abs(mtimes[0] - mtimes[1]) <= 1
+
+
+def test_sync(
+    tmpdir: tp.Any,
+) -> None:
+    tmpdir = pathlib.Path(tmpdir)
+    files = {"tenants/one/a": b"a", "tenants/one/d/b": b"b", "tenants/two/c": b"c"}
+    _write_files(tmpdir / "collect", files)
+    (tmpdir / "collect" / "tenants" / "one" / "l").symlink_to("d/b")
+
+    master_key = cr.new_key()
+    cb = cr.CryptoBlob()
+    cb.collect(tmpdir / "collect", master_key=master_key, existing_tenants_keys=[])
+    one = {i.tenant_name: i for i in cb.get_tenants_keys(cb.unseal_master(master_key))}["one"]
+
+    dest = tmpdir / "dest"
+    _write_files(dest, {"a": b"old", "x/y": b"stale", "d": b"not a dir"})
+
+    def sync() -> None:
+        cb.sync_tenant(dest, key_id=one.key_id, tenant_key=one.reader_key, state_path=tmpdir / "state")
+
+    sync()
+    cb.writeout_tenant(tmpdir / "writeout", key_id=one.key_id, tenant_key=one.reader_key)
+    assert _read_files(dest) == _read_files(tmpdir / "writeout") == {"a": b"a", "d/b": b"b", "l": b"b"}
+    assert os.readlink(dest / "l") == "d/b"
+    assert (dest / "a").stat().st_mtime_ns == (tmpdir / "writeout" / "a").stat().st_mtime_ns
+    assert sorted(i.name for i in dest.iterdir()) == ["a", "d", "l"]
+
+    # nothing is decrypted when neither metadata nor files on disk have changed
+    xpartitions = cb.xpartitions
+    cb.xpartitions = [b""] * len(xpartitions)
+    sync()
+
+    cb.xpartitions = xpartitions
+    (dest / "d" / "b").write_bytes(b"changed")
+    sync()
+    assert _read_files(dest) == {"a": b"a", "d/b": b"b", "l": b"b"}
+
+    _write_files(tmpdir / "add", {"tenants/one/e": b"e"})
+    cb.patch(
+        master_key=master_key,
+        master_data=cb.unseal_master(master_key),
+        remove=lambda name: name == "tenants/one/a",
+        add=cr.collect_files(tmpdir / "add"),
+    )
+    sync()
+    assert _read_files(dest) == {"d/b": b"b", "e": b"e", "l": b"b"}
+
+    # version 2 blobs let unchanged tenants be skipped without parsing the blob
+    assert cb.version == 1
+    cb.patch(
+        master_key=master_key,
+        master_data=cb.unseal_master(master_key),
+        remove=lambda name: False,
+        add=cr.FilesCollection(),
+        version=2,
+    )
+    blob = cb.dump_to_blob()
+    (dest / "e").write_bytes(b"changed")
+    assert cr.sync_tenant_blob(blob, dest, key_id=one.key_id, tenant_key=one.reader_key, state_path=tmpdir / "state")
+    truncated = blob[:blob.index(cb.xmaster)]
+    assert not cr.sync_tenant_blob(
+        truncated,
+        dest,
+        key_id=one.key_id,
+        tenant_key=one.reader_key,
+        state_path=tmpdir / "state",
+    )
+
+    # written version is never lowered
+    cb.patch(
+        master_key=master_key,
+        master_data=cb.unseal_master(master_key),
+        remove=lambda name: False,
+        add=cr.FilesCollection(),
+    )
+    assert cb.version == 2